@@ -0,0 +1,469 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Times and memory-profiles every pipeline stage on synthetic terrain, so
+# ABOUTME: performance is measurable without data/. Appends to a JSON run history.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+import calc_flow
+import extract_attributes
+import fis_suitability
+from study_area import DATA_DIR, NAMED_AREAS, DEFAULT_AREA
+
+gdal.UseExceptions()
+
+HISTORY_PATH = os.path.join(DATA_DIR, "benchmarks", "history.json")
+
+PIXEL_SIZE = 3.0  # feet
+# Grid shapes (rows, cols) by size label
+SIZES = {
+    "1m": (1000, 1000),
+    "4m": (2000, 2000),
+    "16m": (4000, 4000),
+    "100m": (10000, 10000),
+}
+TERRAINS = ["fractal", "plane", "bowl"]
+
+# Street grid spacing (feet) and the cap on segments sampled by zonal stats
+STREET_SPACING = 300
+MAX_SEGMENTS = 500
+N_FACILITIES = 200
+
+# A stage regresses when it is this much slower (or hungrier) than its best run
+REGRESSION_THRESHOLD = 0.25
+# Per-stage overrides for noisy stages
+STAGE_THRESHOLDS = {
+    "zonal_stats": 0.40,
+    "validation": 0.40,
+}
+
+
+# ─── Synthetic inputs ────────────────────────────────────────────────────────
+
+def fractal_dem(shape, rng, relief=40.0, beta=3.0):
+    """Fractal terrain by spectral synthesis: power-law filtered white noise."""
+    rows, cols = shape
+    fy = np.fft.fftfreq(rows)[:, None]
+    fx = np.fft.rfftfreq(cols)[None, :]
+    freq = np.sqrt(fx ** 2 + fy ** 2)
+    freq[0, 0] = 1.0
+    spectrum = np.fft.rfft2(rng.normal(size=shape)) * freq ** (-beta / 2)
+    spectrum[0, 0] = 0.0
+    elev = np.fft.irfft2(spectrum, s=shape)
+    elev -= elev.min()
+    return elev * (relief / elev.max()) + 10.0
+
+
+def plane_dem(shape, rng, relief=40.0):
+    """Tilted plane with centimetre-scale noise, so every cell has a receiver."""
+    rows, cols = shape
+    r, c = np.indices(shape)
+    elev = relief * (r / rows * 0.6 + c / cols * 0.4)
+    return elev + rng.uniform(0, 0.01, shape) + 10.0
+
+
+def bowl_dem(shape, rng, relief=40.0, n_pits=50):
+    """Paraboloid bowl pocked with Gaussian pits (closed depressions)."""
+    rows, cols = shape
+    r, c = np.indices(shape, dtype=np.float64)
+    elev = relief * (((r - rows / 2) / rows) ** 2 + ((c - cols / 2) / cols) ** 2) * 2
+    radius = max(rows, cols) / 100
+    for pr, pc in zip(rng.uniform(0, rows, n_pits), rng.uniform(0, cols, n_pits)):
+        r0, r1 = int(max(pr - 4 * radius, 0)), int(min(pr + 4 * radius, rows))
+        c0, c1 = int(max(pc - 4 * radius, 0)), int(min(pc + 4 * radius, cols))
+        d2 = (r[r0:r1, c0:c1] - pr) ** 2 + (c[r0:r1, c0:c1] - pc) ** 2
+        elev[r0:r1, c0:c1] -= 2.0 * np.exp(-d2 / (2 * radius ** 2))
+    return elev + 10.0
+
+
+DEM_BUILDERS = {"fractal": fractal_dem, "plane": plane_dem, "bowl": bowl_dem}
+
+
+def impervious_mask(shape, rng, fraction=0.6):
+    """Binary impervious mask from thresholded smooth noise."""
+    noise = fractal_dem(shape, rng, relief=1.0, beta=2.0)
+    return (noise < np.quantile(noise, fraction)).astype(np.float64)
+
+
+def grid_geotransform():
+    """Geotransform anchored at the default study area's upper-left corner."""
+    ext = NAMED_AREAS[DEFAULT_AREA]
+    return (ext["xmin"], PIXEL_SIZE, 0, ext["ymax"], 0, -PIXEL_SIZE)
+
+
+def write_vector(path, geom_type, features, fields):
+    """Write (geometry, attributes) pairs to a GeoJSON file in EPSG:2913."""
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(2913)
+    ds = ogr.GetDriverByName("GeoJSON").CreateDataSource(path)
+    layer = ds.CreateLayer(os.path.splitext(os.path.basename(path))[0], srs, geom_type)
+    for name, field_type in fields.items():
+        layer.CreateField(ogr.FieldDefn(name, field_type))
+    for geom, attrs in features:
+        feat = ogr.Feature(layer.GetLayerDefn())
+        for name, value in attrs.items():
+            if value is not None:
+                feat.SetField(name, value)
+        feat.SetGeometry(geom)
+        layer.CreateFeature(feat)
+    ds = None
+
+
+def rectangle(x0, y0, x1, y1):
+    """Axis-aligned polygon from corner coordinates."""
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]:
+        ring.AddPoint_2D(x, y)
+    poly = ogr.Geometry(ogr.wkbPolygon)
+    poly.AddGeometry(ring)
+    return poly
+
+
+def synthetic_vectors(shape, gt, rng, out_dir):
+    """HSG polygons, street lines, inlets and GSI facilities over the grid.
+
+    Returns a dict of GeoJSON paths under out_dir.
+    """
+    rows, cols = shape
+    x0, y1 = gt[0], gt[3]
+    x1, y0 = x0 + cols * PIXEL_SIZE, y1 - rows * PIXEL_SIZE
+    paths = {name: f"{out_dir}/{name}.geojson"
+             for name in ["hsg", "streets", "inlets", "gsi"]}
+
+    # HSG: 8×8 patchwork, mostly B with D and unclassified Urban Land
+    hsg = []
+    xs, ys = np.linspace(x0, x1, 9), np.linspace(y0, y1, 9)
+    for i in range(8):
+        for j in range(8):
+            group = rng.choice(["B", "B", "B", "D", None])
+            hsg.append((rectangle(xs[i], ys[j], xs[i + 1], ys[j + 1]),
+                        {"HydrolGrp": group, "MUSYM": "50C" if group is None else "1A"}))
+    write_vector(paths["hsg"], ogr.wkbPolygon, hsg,
+                 {"HydrolGrp": ogr.OFTString, "MUSYM": ogr.OFTString})
+
+    # Streets: block-length segments on a regular grid, inlets at intersections
+    gx = np.arange(x0 + STREET_SPACING / 2, x1, STREET_SPACING)
+    gy = np.arange(y0 + STREET_SPACING / 2, y1, STREET_SPACING)
+    segments = []
+    for x in gx:
+        for ya, yb in zip(gy[:-1], gy[1:]):
+            segments.append(((x, ya), (x, yb)))
+    for y in gy:
+        for xa, xb in zip(gx[:-1], gx[1:]):
+            segments.append(((xa, y), (xb, y)))
+    if len(segments) > MAX_SEGMENTS:
+        keep = rng.choice(len(segments), MAX_SEGMENTS, replace=False)
+        segments = [segments[k] for k in sorted(keep)]
+    streets = []
+    for k, (a, b) in enumerate(segments):
+        line = ogr.Geometry(ogr.wkbLineString)
+        line.AddPoint_2D(*a)
+        line.AddPoint_2D(*b)
+        streets.append((line, {"OBJECTID": k + 1, "FULL_NAME": f"Street {k + 1}", "CFCC": "A41"}))
+    write_vector(paths["streets"], ogr.wkbLineString, streets,
+                 {"OBJECTID": ogr.OFTInteger, "FULL_NAME": ogr.OFTString, "CFCC": ogr.OFTString})
+
+    def points(coords):
+        out = []
+        for x, y in coords:
+            pt = ogr.Geometry(ogr.wkbPoint)
+            pt.AddPoint_2D(float(x), float(y))
+            out.append((pt, {}))
+        return out
+
+    inlets = [(x, y) for x in gx for y in gy]
+    write_vector(paths["inlets"], ogr.wkbPoint, points(inlets), {})
+    facilities = zip(rng.uniform(x0, x1, N_FACILITIES), rng.uniform(y0, y1, N_FACILITIES))
+    write_vector(paths["gsi"], ogr.wkbPoint, points(facilities), {})
+    return paths
+
+
+def write_mem_raster(path, array, gt):
+    """Write an array as a Float32 GeoTIFF (in /vsimem/) for RasterReader."""
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(2913)
+    fis_suitability.write_raster(path, array, gt, srs.ExportToWkt())
+
+
+# ─── Stages ──────────────────────────────────────────────────────────────────
+# Each stage reads its inputs from ctx, stores its outputs there, and returns
+# the number of cells (or features) it processed.
+
+def stage_slope(ctx):
+    ctx["slope_deg"], ctx["tan_slope"] = calc_flow.calc_slope(ctx["elev"], PIXEL_SIZE)
+    return ctx["elev"].size
+
+
+def stage_d8(ctx):
+    ctx["flow_dir"] = calc_flow.calc_d8_flow_direction(ctx["elev"], PIXEL_SIZE)
+    return ctx["elev"].size
+
+
+def stage_accumulation(ctx):
+    ctx["accum"] = calc_flow.calc_flow_accumulation(ctx["elev"], ctx["flow_dir"])
+    return ctx["elev"].size
+
+
+def stage_twi(ctx):
+    ctx["twi"] = calc_flow.calc_twi(ctx["accum"], ctx["tan_slope"], PIXEL_SIZE)
+    return ctx["elev"].size
+
+
+def stage_box_mean(ctx):
+    ctx["imp_frac"] = fis_suitability.box_mean(ctx["impervious"], 11)
+    return ctx["impervious"].size
+
+
+def stage_rasterize_hsg(ctx):
+    ctx["hsg"] = fis_suitability.rasterize_hsg(
+        ctx["gt"], ctx["proj"], ctx["elev"].shape, ctx["vectors"]["hsg"], cache=False,
+    )
+    return ctx["elev"].size
+
+
+def stage_fis_suitability(ctx):
+    ctx["suitability"] = fis_suitability.evaluate_fis(
+        rules=fis_suitability.STAGE1_RULES,
+        mf_dicts=[fis_suitability.SLOPE_MF, fis_suitability.HSG_MF],
+        inputs=[ctx["slope_deg"], ctx["hsg"]],
+        rule_input_keys=None,
+    )
+    return ctx["elev"].size
+
+
+def stage_fis_priority(ctx):
+    ctx["priority"] = fis_suitability.evaluate_fis(
+        rules=fis_suitability.STAGE2_RULES,
+        mf_dicts=[fis_suitability.SUIT_IN_MF, fis_suitability.IMP_MF, fis_suitability.TWI_MF],
+        inputs=[ctx["suitability"], ctx["imp_frac"], ctx["twi"]],
+        rule_input_keys=None,
+    )
+    return ctx["elev"].size
+
+
+def stage_zonal_stats(ctx):
+    """Per-segment sampling as in extract_attributes.main()."""
+    mem = ctx["mem_dir"]
+    layers = {"slope_deg": ctx["slope_deg"], "flow_accum": ctx["accum"],
+              "twi": ctx["twi"], "impervious": ctx["impervious"]}
+    readers = {}
+    for name, array in layers.items():
+        write_mem_raster(f"{mem}/{name}.tif", array, ctx["gt"])
+        readers[name] = extract_attributes.RasterReader(f"{mem}/{name}.tif")
+    inlet_points = extract_attributes.load_inlets(ctx["vectors"]["inlets"])
+    hsg_grid = extract_attributes.load_hsg_grid(
+        ctx["vectors"]["hsg"], readers["slope_deg"], cache=False,
+    )
+
+    ds = ogr.Open(ctx["vectors"]["streets"])
+    n = 0
+    for feat in ds.GetLayer():
+        geom = feat.GetGeometryRef()
+        buffered = geom.Buffer(extract_attributes.BUFFER_DIST)
+        for reader in readers.values():
+            reader.sample_polygon(buffered)
+        extract_attributes.assign_hsg(geom, hsg_grid)
+        extract_attributes.nearest_inlet_distance(geom, inlet_points)
+        n += 1
+    ds = None
+    return n
+
+
+def stage_validation(ctx):
+    fis_suitability.validate_against_gsi(
+        ctx["suitability"], ctx["priority"], ctx["gt"], ctx["vectors"]["gsi"],
+    )
+    return ctx["priority"].size
+
+
+# (name, function, stages whose outputs it needs), in pipeline order
+STAGES = [
+    ("calc_slope", stage_slope, []),
+    ("d8_flow_direction", stage_d8, []),
+    ("flow_accumulation", stage_accumulation, ["d8_flow_direction"]),
+    ("twi", stage_twi, ["calc_slope", "flow_accumulation"]),
+    ("box_mean", stage_box_mean, []),
+    ("rasterize_hsg", stage_rasterize_hsg, []),
+    ("fis_suitability", stage_fis_suitability, ["calc_slope", "rasterize_hsg"]),
+    ("fis_priority", stage_fis_priority, ["fis_suitability", "box_mean", "twi"]),
+    ("zonal_stats", stage_zonal_stats, ["calc_slope", "flow_accumulation", "twi"]),
+    ("validation", stage_validation, ["fis_priority"]),
+]
+
+
+def required_stages(selected):
+    """Selected stages plus everything they depend on, in pipeline order."""
+    deps = {name: requires for name, _, requires in STAGES}
+    needed = set()
+    pending = list(selected)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(deps[name])
+    return [name for name, _, _ in STAGES if name in needed]
+
+
+def run_stage(func, ctx, profile_memory):
+    """Run one stage quietly; returns (result dict, items processed)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        n_items = func(ctx)
+        wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+
+        peak_mb = None
+        if profile_memory:
+            # Second, traced run: tracemalloc slows Python loops, so it is not timed
+            tracemalloc.start()
+            func(dict(ctx))
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+
+    return {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "peak_mb": None if peak_mb is None else round(peak_mb, 1),
+        "items_per_s": round(n_items / wall, 1) if wall > 0 else None,
+    }, n_items
+
+
+def benchmark_grid(size, terrain, selected, profile_memory, seed):
+    """Generate one synthetic grid and run the selected stages over it."""
+    shape = SIZES[size]
+    rng = np.random.default_rng(seed)
+    gt = grid_geotransform()
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(2913)
+    mem_dir = f"/vsimem/benchmark_{size}_{terrain}"
+    ctx = {
+        "elev": DEM_BUILDERS[terrain](shape, rng),
+        "impervious": impervious_mask(shape, rng),
+        "gt": gt,
+        "proj": srs.ExportToWkt(),
+        "mem_dir": mem_dir,
+    }
+    ctx["vectors"] = synthetic_vectors(shape, gt, rng, mem_dir)
+
+    results = []
+    funcs = {name: func for name, func, _ in STAGES}
+    for name in required_stages(selected):
+        result, n_items = run_stage(funcs[name], ctx, profile_memory)
+        results.append({"stage": name, "size": size, "terrain": terrain,
+                        "items": n_items, **result})
+        peak = "" if result["peak_mb"] is None else f"  peak {result['peak_mb']:>8.1f} MB"
+        print(f"  {name:<20} {result['wall_s']:>9.3f}s wall  {result['cpu_s']:>9.3f}s cpu{peak}")
+
+    gdal.RmdirRecursive(mem_dir)
+    return results
+
+
+# ─── History and regressions ─────────────────────────────────────────────────
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_regressions(results, history):
+    """Compare results with the best previous run of each stage/size/terrain."""
+    regressions = []
+    for res in results:
+        key = (res["stage"], res["size"], res["terrain"])
+        previous = [r for run in history for r in run["results"]
+                    if (r["stage"], r["size"], r["terrain"]) == key]
+        if not previous:
+            continue
+        threshold = STAGE_THRESHOLDS.get(res["stage"], REGRESSION_THRESHOLD)
+        for metric in ["wall_s", "peak_mb"]:
+            values = [r[metric] for r in previous if r.get(metric)]
+            if not values or res[metric] is None:
+                continue
+            best = min(values)
+            if res[metric] > best * (1 + threshold):
+                regressions.append(
+                    f"{res['stage']} [{res['size']}, {res['terrain']}] {metric}:"
+                    f" {res[metric]} vs best {best} (+{(res[metric] / best - 1) * 100:.0f}%,"
+                    f" threshold {threshold * 100:.0f}%)"
+                )
+    return regressions
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    stage_names = [name for name, _, _ in STAGES]
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic terrain.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["1m"],
+                        help="Grid sizes in cells (default: 1m; D8 and accumulation are "
+                             "pure-Python loops, so 100m takes hours)")
+    parser.add_argument("--terrains", nargs="+", choices=TERRAINS, default=["fractal"])
+    parser.add_argument("--stages", nargs="+", choices=stage_names, default=stage_names,
+                        help="Stages to run (their prerequisites run too)")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip the traced memory-profiling pass")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--no-record", action="store_true",
+                        help="Compare against history without appending this run")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit non-zero when any stage regresses")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for terrain in args.terrains:
+            rows, cols = SIZES[size]
+            print(f"\n{terrain} terrain, {rows}x{cols} ({rows * cols:,} cells)")
+            results.extend(benchmark_grid(size, terrain, args.stages,
+                                          not args.no_memory, args.seed))
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history)
+    if regressions:
+        print(f"\nREGRESSIONS ({len(regressions)}):")
+        for line in regressions:
+            print(f"  {line}")
+    else:
+        print("\nNo regressions against history.")
+
+    if not args.no_record:
+        history.append({
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "seed": args.seed,
+            "results": results,
+        })
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=2)
+        print(f"  -> {args.history}")
+
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,45 @@
 # requires-python = ">=3.10"
 # dependencies = ["numpy", "gdal"]
 # ///
-# ABOUTME: Computes slope, D8 flow direction, flow accumulation, and TWI from DEM.
+# ABOUTME: Computes slope, curvature, D8 flow direction, flow accumulation, and TWI from DEM.
 # ABOUTME: Outputs are GeoTIFFs in EPSG:2913, aligned to the study area DEM grid.
 
+import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 from osgeo import gdal, osr
 
-# Match the canonical study area DEM
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
-DEM_PATH = os.path.join(DATA_DIR, "dem", "study_area_dem.tif")
-DERIVED_DIR = os.path.join(DATA_DIR, "derived")
+from instrument import run_report, stage
+from rasterize import rasterize_coverage, rasterize_values
+from study_area import add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+from terrain import PRODUCTS, terrain
+
+# Paths relative to the area data directory; match the study area DEM
+DEM_PATH = os.path.join("dem", "study_area_dem.tif")
+DERIVED_DIR = "derived"
+IMPERVIOUS_PATH = os.path.join("impervious", "impervious.tif")
+BUILDINGS_PATH = os.path.join("impervious", "building_footprints.geojson")
+HSG_PATH = os.path.join("stormwater", "hydrologic_soil_groups.geojson")
+WEIGHTED_ACCUM_PATH = os.path.join(DERIVED_DIR, "weighted_accumulation.tif")
+# Terrain products written alongside slope.tif (name → file in DERIVED_DIR)
+TERRAIN_OUTPUTS = {
+    "slope_deg": "slope.tif",
+    "aspect": "aspect.tif",
+    "plan_curv": "plan_curvature.tif",
+    "profile_curv": "profile_curvature.tif",
+    "hillshade": "hillshade.tif",
+}
+
+# Runoff coefficients (rational method): impervious cover, and pervious
+# ground by hydrologic soil group (Urban Land and unmapped soil count as D)
+IMPERVIOUS_RUNOFF_C = 0.90
+PERVIOUS_RUNOFF_C = {"A": 0.10, "B": 0.15, "C": 0.20, "D": 0.25}
+# Depth (inches) of the design storm the runoff band is weighted by:
+# Portland's 24-hour water quality storm
+DESIGN_STORM_IN = 0.83
 
 # D8 neighbor offsets: (row_offset, col_offset) for 8 directions
 # Order: E, SE, S, SW, W, NW, N, NE
@@ -25,11 +53,11 @@ D8_DISTANCES = [1.0, np.sqrt(2), 1.0, np.sqrt(2),
                 1.0, np.sqrt(2), 1.0, np.sqrt(2)]
 
 
-def read_dem():
+def read_dem(path):
     """Read DEM and return elevation array, geotransform, projection."""
-    ds = gdal.Open(DEM_PATH)
+    ds = gdal.Open(path)
     if ds is None:
-        raise FileNotFoundError(f"Cannot open {DEM_PATH}")
+        raise FileNotFoundError(f"Cannot open {path}")
     band = ds.GetRasterBand(1)
     elev = band.ReadAsArray().astype(np.float64)
     nodata = band.GetNoDataValue()
@@ -37,7 +65,8 @@ def read_dem():
     proj = ds.GetProjection()
     pixel_size = gt[1]  # feet
     print(f"DEM: {elev.shape[1]}x{elev.shape[0]}, pixel={pixel_size}ft")
-    print(f"  Elevation range: {np.nanmin(elev):.1f} – {np.nanmax(elev):.1f} ft")
+    elev_stats = summarize(elev)
+    print(f"  Elevation range: {elev_stats.min:.1f} – {elev_stats.max:.1f} ft")
     ds = None
     return elev, gt, proj, pixel_size, nodata
 
@@ -57,13 +86,11 @@ def write_raster(path, array, gt, proj, nodata=-9999, dtype=gdal.GDT_Float32):
 
 
 def calc_slope(elev, pixel_size):
-    """Compute slope in degrees using numpy gradient (Horn's method approx)."""
-    # np.gradient computes central differences, returns (dz/dy, dz/dx)
-    dz_dy, dz_dx = np.gradient(elev, pixel_size)
-    slope_rad = np.arctan(np.sqrt(dz_dx**2 + dz_dy**2))
-    slope_deg = np.degrees(slope_rad)
-    print(f"  Slope range: {slope_deg.min():.2f} – {slope_deg.max():.2f} degrees")
-    return slope_deg, slope_rad
+    """Compute Horn slope in degrees, plus tan(slope) for calc_twi."""
+    out = terrain(elev, pixel_size, ["slope_deg", "tan_slope"])
+    slope_deg = out["slope_deg"]
+    print(f"  Slope: {summarize(slope_deg).describe('.2f')} degrees")
+    return slope_deg, out["tan_slope"]
 
 
 def calc_d8_flow_direction(elev, pixel_size):
@@ -92,30 +119,276 @@ def calc_d8_flow_direction(elev, pixel_size):
 
 
 def calc_flow_accumulation(elev, flow_dir):
-    """Compute flow accumulation by processing cells from highest to lowest."""
-    rows, cols = elev.shape
-    accum = np.ones((rows, cols), dtype=np.float64)  # each cell contributes 1
+    """Compute flow accumulation (upstream cell count, including the cell itself)."""
+    accum = accumulate_weights(flow_dir, np.ones((1, *elev.shape)))[0]
+    print(f"  Flow accumulation: {summarize(accum).describe('.0f')} cells")
+    return accum
 
-    # Sort cells by elevation, highest first
-    flat_indices = np.argsort(elev, axis=None)[::-1]
 
-    for idx in flat_indices:
-        r, c = divmod(idx, cols)
-        d = flow_dir[r, c]
-        if d >= 0:
-            dr, dc = D8_OFFSETS[d]
-            nr, nc = r + dr, c + dc
-            accum[nr, nc] += accum[r, c]
+# ─── Weighted flow accumulation ──────────────────────────────────────────────
+# Several weight rasters (cell count, impervious area, roof area, runoff) are
+# routed through the D8 graph together, in topological order rather than by
+# elevation sort: the frontier starts at ridge cells and every step pushes all
+# bands of the whole frontier downstream with one vectorized reduction.
 
-    print(f"  Flow accumulation range: {accum.min():.0f} – {accum.max():.0f} cells")
-    return accum
+def downstream_index(flow_dir):
+    """Flat index of each cell's D8 receiver; -1 for sinks and grid exits."""
+    rows, cols = flow_dir.shape
+    _, exits, target_r, target_c = cut_tile_flow_dir(flow_dir)
+    receiver = target_r * cols + target_c
+    receiver[(flow_dir < 0) | exits] = -1
+    return receiver.ravel()
+
+
+def accumulate_weights(flow_dir, weights):
+    """Accumulate a (bands, rows, cols) stack of weights downstream in one pass.
+
+    Each output cell holds its own weight plus the weight of every cell
+    upstream of it, for all bands.
+    """
+    bands = weights.shape[0]
+    receiver = downstream_index(flow_dir)
+    accum = weights.reshape(bands, receiver.size).astype(np.float64)
+    flows = receiver >= 0
+    indegree = np.bincount(receiver[flows], minlength=receiver.size)
+
+    # Kahn's algorithm: a cell is final once all its upstream neighbours are
+    frontier = np.flatnonzero(indegree == 0)
+    while frontier.size:
+        frontier = frontier[flows[frontier]]
+        order = np.argsort(receiver[frontier], kind="stable")
+        frontier = frontier[order]
+        targets, starts, counts = np.unique(
+            receiver[frontier], return_index=True, return_counts=True,
+        )
+        if targets.size == 0:
+            break
+        accum[:, targets] += np.add.reduceat(accum[:, frontier], starts, axis=1)
+        indegree[targets] -= counts
+        frontier = targets[indegree[targets] == 0]
+    return accum.reshape(weights.shape)
+
+
+def weight_stack(data_dir, gt, proj, shape, pixel_size, rain_in=DESIGN_STORM_IN, imp=None):
+    """Per-cell weights for accumulation, from whichever inputs exist.
+
+    imp: impervious array already in memory (read from disk if None).
+    Returns (band names, (bands, rows, cols) array). Areas are ft², runoff ft³.
+    """
+    cell_area = pixel_size * pixel_size
+    names, bands = ["cells"], [np.ones(shape)]
+
+    imp_path = os.path.join(data_dir, IMPERVIOUS_PATH)
+    if imp is not None:
+        names.append("impervious_ft2")
+        bands.append(imp * cell_area)
+    elif os.path.exists(imp_path):
+        ds = gdal.Open(imp_path)
+        imp = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+        ds = None
+        names.append("impervious_ft2")
+        bands.append(imp * cell_area)
+
+    buildings_path = os.path.join(data_dir, BUILDINGS_PATH)
+    if os.path.exists(buildings_path):
+        names.append("roof_ft2")
+        bands.append(rasterize_coverage(buildings_path, gt, proj, shape) * cell_area)
+
+    hsg_path = os.path.join(data_dir, HSG_PATH)
+    if imp is not None and os.path.exists(hsg_path):
+        # Rational-method runoff coefficient: impervious cover, else by soil group
+        cases = " ".join(f"WHEN '{g}' THEN {c}" for g, c in PERVIOUS_RUNOFF_C.items())
+        pervious_c = rasterize_values(
+            hsg_path, gt, proj, shape,
+            f"CASE HydrolGrp {cases} ELSE {PERVIOUS_RUNOFF_C['D']} END",
+            default=PERVIOUS_RUNOFF_C["D"],
+        )
+        runoff_c = imp * IMPERVIOUS_RUNOFF_C + (1 - imp) * pervious_c
+        names.append("runoff_ft3")
+        bands.append(runoff_c * cell_area * rain_in / 12)
+
+    return names, np.stack(bands)
+
+
+def write_bands(path, stack, names, gt, proj):
+    """Write a (bands, rows, cols) stack as a multi-band GeoTIFF with band names."""
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(path, stack.shape[2], stack.shape[1], stack.shape[0],
+                       gdal.GDT_Float32, options=["COMPRESS=LZW", "INTERLEAVE=BAND"])
+    ds.SetGeoTransform(gt)
+    ds.SetProjection(proj)
+    for i, name in enumerate(names, start=1):
+        band = ds.GetRasterBand(i)
+        band.SetDescription(name)
+        band.WriteArray(stack[i - 1].astype(np.float32))
+    ds.FlushCache()
+    ds = None
 
 
-def calc_twi(accum, slope_rad, pixel_size):
+# ─── Tiled flow accumulation ─────────────────────────────────────────────────
+# Each tile accumulates locally and reports a boundary graph: exit cells (whose
+# flow leaves the tile), how much of every weight band they carry, and where
+# each perimeter cell's flow path leaves the tile. A small global pass chains
+# exits across tiles; a second per-tile pass then adds the resolved inflows at
+# entry cells.
+
+def cut_tile_flow_dir(flow_dir):
+    """Tile flow directions with flows leaving the tile cut to -1.
+
+    Returns (cut flow_dir, exit mask, target row, target col), targets in
+    tile coordinates (outside the tile for exits).
+    """
+    rows, cols = flow_dir.shape
+    offsets = np.array(D8_OFFSETS + [(0, 0)])
+    dr = offsets[flow_dir, 0]  # index -1 (sink) picks the (0, 0) entry
+    dc = offsets[flow_dir, 1]
+    target_r = np.arange(rows)[:, None] + dr
+    target_c = np.arange(cols)[None, :] + dc
+    exits = (flow_dir >= 0) & (
+        (target_r < 0) | (target_r >= rows) | (target_c < 0) | (target_c >= cols)
+    )
+    cut = np.where(exits, -1, flow_dir).astype(np.int8)
+    return cut, exits, target_r, target_c
+
+
+def tile_boundary_graph(elev, flow_dir, weights, row0, col0, grid_cols):
+    """Pass 1 for one tile: local accumulation reduced to its boundary graph.
+
+    weights: the tile's (bands, rows, cols) weight stack. Returns a dict of
+    global flat indices: exit cells with their targets, elevations and local
+    accumulation (bands, exits), and each perimeter cell's terminal exit (-1
+    when its flow path ends at a sink inside the tile).
+    """
+    rows, cols = elev.shape
+    cut, exits, target_r, target_c = cut_tile_flow_dir(flow_dir)
+    accum = accumulate_weights(cut, weights)
+
+    # Terminal cell of every in-tile flow path, by pointer doubling
+    offsets = np.array(D8_OFFSETS + [(0, 0)])
+    local = np.arange(rows * cols).reshape(rows, cols)
+    nxt = (local + offsets[cut, 0] * cols + offsets[cut, 1]).ravel()
+    while True:
+        jumped = nxt[nxt]
+        if np.array_equal(jumped, nxt):
+            break
+        nxt = jumped
+
+    def to_global(r, c):
+        return (row0 + r) * grid_cols + (col0 + c)
+
+    er, ec = np.nonzero(exits)
+    edge = np.zeros((rows, cols), dtype=bool)
+    edge[[0, -1], :] = True
+    edge[:, [0, -1]] = True
+    pr, pc = np.nonzero(edge)
+    term = nxt[local[pr, pc]]
+    tr, tc = np.divmod(term, cols)
+    edge_terminal = np.where(exits[tr, tc], to_global(tr, tc), -1)
+
+    return {
+        "exit_cells": to_global(er, ec),
+        "exit_targets": to_global(target_r[er, ec], target_c[er, ec]),
+        "exit_elev": elev[er, ec],
+        "exit_accum": accum[:, er, ec],
+        "edge_cells": to_global(pr, pc),
+        "edge_terminal": edge_terminal,
+    }
+
+
+def resolve_boundary_flows(graphs):
+    """Global pass: chain exit flows across tiles.
+
+    Returns (entry cells, inflow): global flat indices and the total
+    upstream weight of each band arriving from neighbouring tiles at each
+    entry cell, (bands, entries).
+    """
+    exit_cells = np.concatenate([g["exit_cells"] for g in graphs])
+    exit_targets = np.concatenate([g["exit_targets"] for g in graphs])
+    exit_elev = np.concatenate([g["exit_elev"] for g in graphs])
+    outflow = np.concatenate([g["exit_accum"] for g in graphs], axis=1)
+    edge_cells = np.concatenate([g["edge_cells"] for g in graphs])
+    edge_terminal = np.concatenate([g["edge_terminal"] for g in graphs])
+
+    # Where the flow of each exit leaves the next tile (index into exits)
+    by_edge = np.argsort(edge_cells)
+    terminal = edge_terminal[by_edge][np.searchsorted(edge_cells[by_edge], exit_targets)]
+    by_exit = np.argsort(exit_cells)
+    downstream = np.where(
+        terminal >= 0,
+        by_exit[np.searchsorted(exit_cells[by_exit], np.maximum(terminal, 0))],
+        -1,
+    )
+
+    # Flow is strictly downhill, so upstream exits always sit higher
+    for e in np.argsort(exit_elev)[::-1]:
+        if downstream[e] >= 0:
+            outflow[:, downstream[e]] += outflow[:, e]
+
+    entry_cells, inverse = np.unique(exit_targets, return_inverse=True)
+    inflow = np.zeros((outflow.shape[0], len(entry_cells)), dtype=np.float64)
+    np.add.at(inflow, (slice(None), inverse.ravel()), outflow)
+    return entry_cells, inflow
+
+
+def tile_accumulation(flow_dir, weights, entry_rows, entry_cols, inflow):
+    """Pass 2 for one tile: local accumulation of all bands plus resolved inflows."""
+    cut, _, _, _ = cut_tile_flow_dir(flow_dir)
+    weights = weights.astype(np.float64)
+    weights[:, entry_rows, entry_cols] += inflow
+    return accumulate_weights(cut, weights)
+
+
+def calc_flow_accumulation_tiled(elev, flow_dir, tile_size, workers=None, weights=None):
+    """Flow accumulation over tiles, equal to calc_flow_accumulation().
+
+    Tiles run in parallel processes and each only holds its own window.
+    weights: (bands, rows, cols) stack to accumulate instead of cell counts;
+    the result is then the stack accumulate_weights() would give.
+    """
+    rows, cols = elev.shape
+    stacked = weights is not None
+    if not stacked:
+        weights = np.ones((1, rows, cols))
+    windows = [
+        (r0, c0, min(r0 + tile_size, rows), min(c0 + tile_size, cols))
+        for r0 in range(0, rows, tile_size)
+        for c0 in range(0, cols, tile_size)
+    ]
+    print(f"  {len(windows)} tiles of up to {tile_size}x{tile_size} cells")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        graphs = list(pool.map(
+            tile_boundary_graph,
+            *zip(*[(elev[r0:r1, c0:c1], flow_dir[r0:r1, c0:c1], weights[:, r0:r1, c0:c1],
+                    r0, c0, cols)
+                   for r0, c0, r1, c1 in windows]),
+        ))
+
+        entry_cells, inflow = resolve_boundary_flows(graphs)
+        print(f"  Boundary graph: {sum(len(g['exit_cells']) for g in graphs):,} exits,"
+              f" {len(entry_cells):,} entry cells")
+        entry_r, entry_c = np.divmod(entry_cells, cols)
+
+        jobs = []
+        for r0, c0, r1, c1 in windows:
+            inside = (entry_r >= r0) & (entry_r < r1) & (entry_c >= c0) & (entry_c < c1)
+            jobs.append((flow_dir[r0:r1, c0:c1], weights[:, r0:r1, c0:c1],
+                         entry_r[inside] - r0, entry_c[inside] - c0, inflow[:, inside]))
+        accum = np.empty(weights.shape, dtype=np.float64)
+        for (r0, c0, r1, c1), tile in zip(windows, pool.map(tile_accumulation, *zip(*jobs))):
+            accum[:, r0:r1, c0:c1] = tile
+
+    if stacked:
+        return accum
+    print(f"  Flow accumulation: {summarize(accum[0]).describe('.0f')} cells")
+    return accum[0]
+
+
+def calc_twi(accum, tan_slope, pixel_size):
     """Compute Topographic Wetness Index: TWI = ln(a / tan(b)).
 
     a = specific catchment area (upslope area per unit contour length)
-    b = local slope in radians
+    tan(b) = local slope gradient, as returned by calc_slope
     """
     # Specific catchment area: flow_accum * cell_area / contour_length
     # For a square grid, contour_length ≈ pixel_size
@@ -123,43 +396,90 @@ def calc_twi(accum, slope_rad, pixel_size):
     specific_area = accum * cell_area / pixel_size  # ft
 
     # Clamp slope to avoid division by zero (flat areas get high TWI)
-    tan_slope = np.tan(slope_rad)
     tan_slope = np.maximum(tan_slope, 0.001)
 
     twi = np.log(specific_area / tan_slope)
-    print(f"  TWI range: {twi.min():.2f} – {twi.max():.2f}")
+    print(f"  TWI: {summarize(twi).describe('.2f')}")
     return twi
 
 
 def main():
-    os.makedirs(DERIVED_DIR, exist_ok=True)
-
-    print("Reading DEM...")
-    elev, gt, proj, pixel_size, nodata = read_dem()
-
-    print("Computing slope...")
-    slope_deg, slope_rad = calc_slope(elev, pixel_size)
-    slope_path = os.path.join(DERIVED_DIR, "slope.tif")
-    write_raster(slope_path, slope_deg.astype(np.float32), gt, proj)
-    print(f"  -> {slope_path}")
-
-    print("Computing D8 flow direction...")
-    flow_dir = calc_d8_flow_direction(elev, pixel_size)
-    fdir_path = os.path.join(DERIVED_DIR, "flow_direction.tif")
-    write_raster(fdir_path, flow_dir.astype(np.float32), gt, proj, nodata=-1)
-    print(f"  -> {fdir_path}")
-
-    print("Computing flow accumulation...")
-    accum = calc_flow_accumulation(elev, flow_dir)
-    accum_path = os.path.join(DERIVED_DIR, "flow_accumulation.tif")
-    write_raster(accum_path, accum.astype(np.float32), gt, proj)
-    print(f"  -> {accum_path}")
-
-    print("Computing TWI...")
-    twi = calc_twi(accum, slope_rad, pixel_size)
-    twi_path = os.path.join(DERIVED_DIR, "twi.tif")
-    write_raster(twi_path, twi.astype(np.float32), gt, proj)
-    print(f"  -> {twi_path}")
+    parser = argparse.ArgumentParser(description="Derive slope, D8 routing and TWI from the DEM.")
+    parser.add_argument(
+        "--tile-size", type=int, default=None,
+        help="Accumulate flow over tiles of this many cells per side, in parallel",
+    )
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes for tiled accumulation (default: CPU count)")
+    parser.add_argument("--rain-in", type=float, default=DESIGN_STORM_IN,
+                        help=f"Design storm depth (inches) for the runoff band (default: {DESIGN_STORM_IN})")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    derived_dir = os.path.join(data_dir, DERIVED_DIR)
+    os.makedirs(derived_dir, exist_ok=True)
+
+    with run_report(derived_dir, "calc_flow", area=area):
+        print(f"Reading DEM ({area})...")
+        with stage("read_dem") as span:
+            elev, gt, proj, pixel_size, nodata = read_dem(os.path.join(data_dir, DEM_PATH))
+            span.record(elev=elev)
+
+        print("Computing slope, aspect, curvature and hillshade...")
+        with stage("terrain", cells=elev.size) as span:
+            derivs = terrain(elev, pixel_size, PRODUCTS)
+            span.record(**derivs)
+        tan_slope = derivs["tan_slope"]
+        print(f"  Slope: {summarize(derivs['slope_deg']).describe('.2f')} degrees")
+        with stage("write_terrain"):
+            for name, filename in TERRAIN_OUTPUTS.items():
+                path = os.path.join(derived_dir, filename)
+                write_raster(path, derivs[name], gt, proj)
+                print(f"  -> {path}")
+
+        print("Computing D8 flow direction...")
+        with stage("d8_flow_direction", cells=elev.size) as span:
+            flow_dir = calc_d8_flow_direction(elev, pixel_size)
+            span.record(flow_dir=flow_dir)
+        fdir_path = os.path.join(derived_dir, "flow_direction.tif")
+        with stage("write_flow_direction"):
+            write_raster(fdir_path, flow_dir.astype(np.float32), gt, proj, nodata=-1)
+        print(f"  -> {fdir_path}")
+
+        print("Computing flow accumulation...")
+        with stage("weight_stack") as span:
+            names, weights = weight_stack(data_dir, gt, proj, elev.shape, pixel_size, args.rain_in)
+            span.record(weights=weights)
+        with stage("flow_accumulation", cells=elev.size) as span:
+            if args.tile_size:
+                weighted = calc_flow_accumulation_tiled(elev, flow_dir, args.tile_size,
+                                                        args.workers, weights)
+                span.note(tile_size=args.tile_size, workers=args.workers)
+            else:
+                weighted = accumulate_weights(flow_dir, weights)
+            accum = weighted[0]
+            print(f"  Flow accumulation: {summarize(accum).describe('.0f')} cells")
+            span.record(weighted=weighted)
+            span.note(bands=names)
+        accum_path = os.path.join(derived_dir, "flow_accumulation.tif")
+        weighted_path = os.path.join(data_dir, WEIGHTED_ACCUM_PATH)
+        with stage("write_flow_accumulation"):
+            write_raster(accum_path, accum.astype(np.float32), gt, proj)
+            write_bands(weighted_path, weighted, names, gt, proj)
+        print(f"  -> {accum_path}")
+        for name, band in zip(names[1:], weighted[1:]):
+            print(f"  Upstream {name}: max {band.max():,.0f}")
+        print(f"  -> {weighted_path} (bands: {', '.join(names)})")
+
+        print("Computing TWI...")
+        with stage("twi", cells=elev.size) as span:
+            twi = calc_twi(accum, tan_slope, pixel_size)
+            span.record(twi=twi)
+        twi_path = os.path.join(derived_dir, "twi.tif")
+        with stage("write_twi"):
+            write_raster(twi_path, twi.astype(np.float32), gt, proj)
+        print(f"  -> {twi_path}")
 
     print("\nDone. All outputs in EPSG:2913, matching DEM grid.")
 
@@ -0,0 +1,194 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal"]
+# ///
+# ABOUTME: Labels every cell with the sink, inlet or bioswale its water ends at, by
+# ABOUTME: pointer jumping over the D8 receivers. Writes catchment IDs + outlet table.
+
+import argparse
+import csv
+import os
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from calc_flow import downstream_index
+from instrument import run_report, stage
+from rasterize import write_raster
+from study_area import add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+FLOW_DIR_PATH = os.path.join("derived", "flow_direction.tif")
+IMPERVIOUS_PATH = os.path.join("impervious", "impervious.tif")
+INLETS_PATH = os.path.join("sewer", "inlets.geojson")
+CATCHMENT_PATH = os.path.join("derived", "catchment_id.tif")
+OUTLETS_CSV = os.path.join("derived", "catchment_outlets.csv")
+
+# Outlet type codes; later types win when a cell is several kinds at once
+OUTLET_TYPES = ["sink", "inlet", "bioswale"]
+
+
+# ─── Pointer jumping ─────────────────────────────────────────────────────────
+
+def receiver_array(flow_dir, terminals=None):
+    """Flat D8 receiver of every cell, with sinks and terminals pointing to themselves."""
+    receiver = downstream_index(flow_dir)
+    cells = np.arange(receiver.size)
+    receiver = np.where(receiver < 0, cells, receiver)
+    if terminals is not None:
+        receiver[terminals] = terminals
+    return receiver
+
+
+def jump(pointer, active):
+    """Path doubling in place until every active cell points at a terminal."""
+    active = active[pointer[pointer[active]] != pointer[active]]
+    while active.size:
+        pointer[active] = pointer[pointer[active]]
+        active = active[pointer[pointer[active]] != pointer[active]]
+    return pointer
+
+
+def label_outlets(receiver):
+    """Terminal cell (flat index) each cell drains to, in O(n log depth) array ops."""
+    return jump(receiver.copy(), np.arange(receiver.size))
+
+
+def relabel_with_terminals(receiver, outlet, new_cells):
+    """Add terminals (e.g. new bioswales) and update outlet labels.
+
+    Only cells in the catchments that contain a new terminal can change, so
+    pointer jumping reruns on those cells alone. Returns (receiver, outlet).
+    """
+    new_cells = np.asarray(new_cells)
+    receiver = receiver.copy()
+    receiver[new_cells] = new_cells
+    affected = np.flatnonzero(np.isin(outlet, outlet[new_cells]))
+    pointer = outlet.copy()
+    pointer[affected] = receiver[affected]
+    return receiver, jump(pointer, affected)
+
+
+def catchment_mask(receiver, outlet, cell):
+    """Boolean mask (flat) of every cell whose water reaches `cell`."""
+    _, outlet = relabel_with_terminals(receiver, outlet, [cell])
+    return outlet == cell
+
+
+def catchment_ids(outlet):
+    """Compact catchment IDs (1..K) per cell and the outlet cell of each ID."""
+    outlets, ids = np.unique(outlet, return_inverse=True)
+    return ids.astype(np.int32) + 1, outlets
+
+
+# ─── I/O ─────────────────────────────────────────────────────────────────────
+
+def point_cells(path, gt, shape):
+    """Flat indices of the grid cells holding each point feature in a layer."""
+    ds = ogr.Open(path)
+    cells = []
+    for feat in ds.GetLayer():
+        geom = feat.GetGeometryRef()
+        col = int((geom.GetX() - gt[0]) / gt[1])
+        row = int((geom.GetY() - gt[3]) / gt[5])
+        if 0 <= row < shape[0] and 0 <= col < shape[1]:
+            cells.append(row * shape[1] + col)
+    ds = None
+    return np.unique(np.array(cells, dtype=np.int64))
+
+
+def write_outlet_table(path, ids, outlets, outlet_type, gt, shape, impervious=None):
+    """One row per catchment: outlet location and type, cell count and areas."""
+    cell_area = abs(gt[1] * gt[5])
+    counts = np.bincount(ids.ravel(), minlength=len(outlets) + 1)[1:]
+    imp_cells = None
+    if impervious is not None:
+        imp_cells = np.bincount(ids.ravel(), weights=impervious.ravel(),
+                                minlength=len(outlets) + 1)[1:]
+    rows, cols = np.divmod(outlets, shape[1])
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        header = ["catchment_id", "outlet_type", "outlet_row", "outlet_col", "x", "y",
+                  "cells", "area_ft2"]
+        if imp_cells is not None:
+            header.append("impervious_ft2")
+        writer.writerow(header)
+        for k in range(len(outlets)):
+            row = [k + 1, outlet_type[k], rows[k], cols[k],
+                   round(gt[0] + (cols[k] + 0.5) * gt[1], 1),
+                   round(gt[3] + (rows[k] + 0.5) * gt[5], 1),
+                   counts[k], round(counts[k] * cell_area, 1)]
+            if imp_cells is not None:
+                row.append(round(imp_cells[k] * cell_area, 1))
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label cells with the outlet they drain to.")
+    parser.add_argument("--no-inlets", action="store_true",
+                        help="Do not treat storm inlets as outlets")
+    parser.add_argument("--bioswales",
+                        help="Point layer of bioswale sites to add as outlets "
+                             "(e.g. derived/fis_top_candidates.geojson)")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    derived_dir = os.path.dirname(os.path.join(data_dir, CATCHMENT_PATH))
+
+    with run_report(derived_dir, "catchments", area=area):
+        ds = gdal.Open(os.path.join(data_dir, FLOW_DIR_PATH))
+        flow_dir = ds.GetRasterBand(1).ReadAsArray().astype(np.int8)
+        gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+        ds = None
+        shape = flow_dir.shape
+        print(f"Labelling outlets ({area}): {shape[1]}x{shape[0]} cells")
+
+        kind = np.zeros(flow_dir.size, dtype=np.int8)  # index into OUTLET_TYPES
+        inlets = np.array([], dtype=np.int64)
+        if not args.no_inlets:
+            inlets = point_cells(os.path.join(data_dir, INLETS_PATH), gt, shape)
+            kind[inlets] = OUTLET_TYPES.index("inlet")
+            print(f"  {len(inlets)} inlet cells")
+
+        with stage("label_outlets", cells=flow_dir.size) as span:
+            receiver = receiver_array(flow_dir, inlets)
+            outlet = label_outlets(receiver)
+            span.record(outlet=outlet)
+
+        if args.bioswales:
+            sites = point_cells(args.bioswales, gt, shape)
+            kind[sites] = OUTLET_TYPES.index("bioswale")
+            with stage("relabel_bioswales") as span:
+                receiver, outlet = relabel_with_terminals(receiver, outlet, sites)
+                span.note(sites=len(sites))
+            print(f"  {len(sites)} bioswale sites added as outlets")
+
+        ids, outlets = catchment_ids(outlet)
+        ids = ids.reshape(shape)
+        outlet_type = [OUTLET_TYPES[k] for k in kind[outlets]]
+        by_type = ", ".join(f"{outlet_type.count(t):,} {t}" for t in OUTLET_TYPES)
+        print(f"  {len(outlets):,} catchments ({by_type})")
+
+        impervious = None
+        imp_path = os.path.join(data_dir, IMPERVIOUS_PATH)
+        if os.path.exists(imp_path):
+            ds = gdal.Open(imp_path)
+            impervious = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+            ds = None
+
+        catchment_path = os.path.join(data_dir, CATCHMENT_PATH)
+        outlets_path = os.path.join(data_dir, OUTLETS_CSV)
+        with stage("write_outputs"):
+            write_raster(catchment_path, ids, gt, proj, gdal.GDT_Int32, nodata=0)
+            write_outlet_table(outlets_path, ids, outlets, outlet_type, gt, shape, impervious)
+        print(f"  -> {catchment_path}")
+        print(f"  -> {outlets_path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal"]
+# ///
+# ABOUTME: Bit-packed per-cell placement constraints (excluded zoning, building footprints,
+# ABOUTME: street right-of-way) rasterized from fetched layers; feasibility is one bitwise AND.
+
+import argparse
+import os
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from instrument import run_report, stage
+from rasterize import feature_attributes, rasterize_coverage, rasterize_ids, write_raster
+from study_area import add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+REFERENCE_PATH = os.path.join("dem", "study_area_dem.tif")
+ZONING_PATH = os.path.join("zoning", "zoning.geojson")
+BUILDINGS_PATH = os.path.join("impervious", "building_footprints.geojson")
+STREETS_PATH = os.path.join("streets", "streets.geojson")
+CONSTRAINTS_PATH = os.path.join("derived", "constraints.tif")
+
+# Flag bits, one uint8 per cell
+ZONE_EXCLUDED = 1
+BUILDING = 2
+RIGHT_OF_WAY = 4
+FLAG_NAMES = {ZONE_EXCLUDED: "zone_excluded", BUILDING: "building", RIGHT_OF_WAY: "right_of_way"}
+# Cells with any of these bits set never become candidates
+DEFAULT_FORBID = ZONE_EXCLUDED | BUILDING
+
+# Base zone attribute, first one present
+ZONE_FIELDS = ["ZONE", "BASE_ZONE", "ZONE_CODE"]
+# Heavy and general industrial zones: no infiltration facilities on sites
+# that may handle contaminants
+EXCLUDED_ZONES = ["IH", "IG1", "IG2"]
+# A cell is a building when footprints cover at least this fraction of it
+BUILDING_COVER_MIN = 0.5
+# Half the typical 60 ft residential right-of-way, measured from the centerline
+ROW_HALF_WIDTH_FT = 30.0
+
+
+# ─── Layers ──────────────────────────────────────────────────────────────────
+
+def zone_mask(path, gt, proj, shape, excluded=EXCLUDED_ZONES):
+    """Cells whose base zone is in `excluded`; None if the layer has no zone field."""
+    table = feature_attributes(path)
+    fields = {k.upper(): k for props in table.values() for k in props}
+    field = next((fields[f] for f in ZONE_FIELDS if f in fields), None)
+    if field is None:
+        return None
+    ids = rasterize_ids(path, gt, proj, shape)
+    # Feature ID → excluded lookup, applied to the whole ID grid at once
+    lut = np.zeros(max(table, default=0) + 1, dtype=bool)
+    excluded = {z.upper() for z in excluded}
+    for fid, props in table.items():
+        lut[fid] = str(props.get(field) or "").upper() in excluded
+    return lut[ids]
+
+
+def row_mask(path, gt, proj, shape, half_width=ROW_HALF_WIDTH_FT):
+    """Cells within half_width of a street centerline."""
+    src = ogr.Open(path)
+    layer = src.GetLayer()
+    tmp_path = "/vsimem/row_buffers.geojson"
+    dst = ogr.GetDriverByName("GeoJSON").CreateDataSource(tmp_path)
+    out = dst.CreateLayer("row", layer.GetSpatialRef(), ogr.wkbPolygon)
+    for feat in layer:
+        geom = feat.GetGeometryRef()
+        if geom is None:
+            continue
+        buffered = ogr.Feature(out.GetLayerDefn())
+        buffered.SetGeometry(geom.Buffer(half_width))
+        out.CreateFeature(buffered)
+    dst = src = None
+    try:
+        return rasterize_ids(tmp_path, gt, proj, shape, cache=False) > 0
+    finally:
+        gdal.Unlink(tmp_path)
+
+
+def build_flags(data_dir, gt, proj, shape, excluded_zones=EXCLUDED_ZONES):
+    """Constraint flags (uint8 bits) of every cell from the fetched layers.
+
+    Layers that are not fetched leave their bit clear.
+    """
+    flags = np.zeros(shape, dtype=np.uint8)
+    zoning = os.path.join(data_dir, ZONING_PATH)
+    if os.path.exists(zoning):
+        mask = zone_mask(zoning, gt, proj, shape, excluded_zones)
+        if mask is None:
+            print(f"  {ZONING_PATH}: no zone field ({', '.join(ZONE_FIELDS)}), skipping")
+        else:
+            flags[mask] |= ZONE_EXCLUDED
+    buildings = os.path.join(data_dir, BUILDINGS_PATH)
+    if os.path.exists(buildings):
+        flags[rasterize_coverage(buildings, gt, proj, shape) >= BUILDING_COVER_MIN] |= BUILDING
+    streets = os.path.join(data_dir, STREETS_PATH)
+    if os.path.exists(streets):
+        flags[row_mask(streets, gt, proj, shape)] |= RIGHT_OF_WAY
+    return flags
+
+
+def feasible(flags, forbid=DEFAULT_FORBID, require=0):
+    """Cells with no forbidden bit and every required bit set."""
+    return (flags & (forbid | require)) == require
+
+
+# ─── Cache ───────────────────────────────────────────────────────────────────
+
+
+def load_flags(data_dir):
+    """Constraint flags of an area, cached in CONSTRAINTS_PATH.
+
+    The cache is rebuilt when a source layer is newer or the reference grid's
+    geotransform or shape no longer matches it (another area or DEM).
+    """
+    ds = gdal.Open(os.path.join(data_dir, REFERENCE_PATH))
+    gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+    shape = (ds.RasterYSize, ds.RasterXSize)
+    ds = None
+    path = os.path.join(data_dir, CONSTRAINTS_PATH)
+    sources = [os.path.join(data_dir, p) for p in (ZONING_PATH, BUILDINGS_PATH, STREETS_PATH)]
+    sources = [p for p in sources if os.path.exists(p)]
+    if os.path.exists(path) and all(os.path.getmtime(path) >= os.path.getmtime(p)
+                                    for p in sources):
+        ds = gdal.Open(path)
+        same_grid = (tuple(ds.GetGeoTransform()) == tuple(gt)
+                     and (ds.RasterYSize, ds.RasterXSize) == shape)
+        flags = ds.GetRasterBand(1).ReadAsArray().astype(np.uint8) if same_grid else None
+        ds = None
+        if flags is not None:
+            return flags
+    flags = build_flags(data_dir, gt, proj, shape)
+    write_raster(path, flags, gt, proj, gdal.GDT_Byte)
+    return flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rasterize bioswale placement constraints.")
+    parser.add_argument("--exclude-zones", nargs="+", default=EXCLUDED_ZONES,
+                        help=f"Base zones where bioswales cannot go "
+                             f"(default: {' '.join(EXCLUDED_ZONES)})")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+
+    ds = gdal.Open(os.path.join(data_dir, REFERENCE_PATH))
+    gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+    shape = (ds.RasterYSize, ds.RasterXSize)
+    ds = None
+    print(f"Constraints ({area}): {shape[1]}x{shape[0]} cells")
+
+    path = os.path.join(data_dir, CONSTRAINTS_PATH)
+    with run_report(os.path.join(data_dir, "derived"), "constraints", area=area):
+        with stage("build_flags", cells=shape[0] * shape[1]) as span:
+            flags = build_flags(data_dir, gt, proj, shape, args.exclude_zones)
+            span.record(flags=flags)
+        for bit, name in FLAG_NAMES.items():
+            print(f"  {name}: {np.count_nonzero(flags & bit) / flags.size * 100:.1f}% of cells")
+        print(f"  Feasible (not excluded zoning or building): {feasible(flags).mean() * 100:.1f}%")
+        with stage("write"):
+            write_raster(path, flags, gt, proj, gdal.GDT_Byte)
+        print(f"  -> {path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,48 +5,130 @@
 # ABOUTME: Extracts per-segment attributes for each of the 834 street segments.
 # ABOUTME: Buffers each segment, samples rasters, does spatial joins. Outputs GeoJSON.
 
+import argparse
 import json
 import os
+from collections import OrderedDict
+
 import numpy as np
 from osgeo import gdal, ogr, osr
 
+from instrument import run_report, stage
+from rasterize import FeatureGrid
+from study_area import add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+
 gdal.UseExceptions()
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+# Paths below are relative to the area data directory
 
 # Input paths
-STREETS_PATH = os.path.join(DATA_DIR, "streets", "streets.geojson")
-HSG_PATH = os.path.join(DATA_DIR, "stormwater", "hydrologic_soil_groups.geojson")
-INLETS_PATH = os.path.join(DATA_DIR, "sewer", "inlets.geojson")
+STREETS_PATH = os.path.join("streets", "streets.geojson")
+HSG_PATH = os.path.join("stormwater", "hydrologic_soil_groups.geojson")
+INLETS_PATH = os.path.join("sewer", "inlets.geojson")
 
 # Raster inputs
 RASTERS = {
-    "slope_deg": os.path.join(DATA_DIR, "derived", "slope.tif"),
-    "flow_accum": os.path.join(DATA_DIR, "derived", "flow_accumulation.tif"),
-    "twi": os.path.join(DATA_DIR, "derived", "twi.tif"),
-    "impervious": os.path.join(DATA_DIR, "impervious", "impervious.tif"),
+    "slope_deg": os.path.join("derived", "slope.tif"),
+    "flow_accum": os.path.join("derived", "flow_accumulation.tif"),
+    "twi": os.path.join("derived", "twi.tif"),
+    "impervious": os.path.join("impervious", "impervious.tif"),
 }
 
 # Output
-OUTPUT_PATH = os.path.join(DATA_DIR, "derived", "segment_attributes.geojson")
+OUTPUT_PATH = os.path.join("derived", "segment_attributes.geojson")
 
 # Buffer distance (feet) — captures street + fronting properties
 BUFFER_DIST = 50
 
+# Block cache budget per raster in lazy mode
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
 
 class RasterReader:
-    """Reads a GeoTIFF into a numpy array with coordinate mapping."""
+    """Reads a GeoTIFF into a numpy array with coordinate mapping.
+
+    With lazy=True nothing is loaded up front: read_window() fetches only the
+    GDAL blocks it needs and keeps recently used ones in an LRU cache of at
+    most cache_bytes.
+    """
 
-    def __init__(self, path):
+    def __init__(self, path, lazy=False, cache_bytes=DEFAULT_CACHE_BYTES):
         ds = gdal.Open(path)
-        self.array = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
         gt = ds.GetGeoTransform()
+        self.gt = gt
+        self.proj = ds.GetProjection()
         self.x_origin = gt[0]
         self.y_origin = gt[3]
         self.pixel_w = gt[1]
         self.pixel_h = gt[5]  # negative
-        self.rows, self.cols = self.array.shape
-        ds = None
+        self.rows, self.cols = ds.RasterYSize, ds.RasterXSize
+        self.lazy = lazy
+        if lazy:
+            self.ds = ds  # kept open for block reads
+            self.band = ds.GetRasterBand(1)
+            self.block_w, self.block_h = self.band.GetBlockSize()
+            self.cache = OrderedDict()
+            self.cache_bytes = cache_bytes
+            self.cached_bytes = 0
+            self.hits = 0
+            self.misses = 0
+        else:
+            self.array = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+            ds = None
+
+    @classmethod
+    def from_array(cls, array, gt, proj=""):
+        """Reader over an array already in memory (no GeoTIFF round trip)."""
+        self = cls.__new__(cls)
+        self.gt = gt
+        self.proj = proj
+        self.x_origin, self.pixel_w = gt[0], gt[1]
+        self.y_origin, self.pixel_h = gt[3], gt[5]
+        self.rows, self.cols = array.shape
+        self.lazy = False
+        self.array = array
+        return self
+
+    def block(self, brow, bcol):
+        """One GDAL block as float64, from the LRU cache when possible."""
+        key = (brow, bcol)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        x0, y0 = bcol * self.block_w, brow * self.block_h
+        data = self.band.ReadAsArray(x0, y0, min(self.block_w, self.cols - x0),
+                                     min(self.block_h, self.rows - y0)).astype(np.float64)
+        self.cache[key] = data
+        self.cached_bytes += data.nbytes
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+        return data
+
+    def read_window(self, row_min, row_max, col_min, col_max):
+        """Values in rows [row_min, row_max) and cols [col_min, col_max)."""
+        if not self.lazy:
+            return self.array[row_min:row_max, col_min:col_max]
+        out = np.empty((row_max - row_min, col_max - col_min), dtype=np.float64)
+        bh, bw = self.block_h, self.block_w
+        for brow in range(row_min // bh, (row_max - 1) // bh + 1):
+            for bcol in range(col_min // bw, (col_max - 1) // bw + 1):
+                data = self.block(brow, bcol)
+                r0, c0 = brow * bh, bcol * bw
+                rs = slice(max(row_min, r0), min(row_max, r0 + data.shape[0]))
+                cs = slice(max(col_min, c0), min(col_max, c0 + data.shape[1]))
+                out[rs.start - row_min:rs.stop - row_min, cs.start - col_min:cs.stop - col_min] = \
+                    data[rs.start - r0:rs.stop - r0, cs.start - c0:cs.stop - c0]
+        return out
+
+    def cache_stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+                "cached_mb": round(self.cached_bytes / 1e6, 1)}
 
     def sample_polygon(self, geom):
         """Extract mean value of all pixels inside a polygon geometry."""
@@ -92,7 +174,7 @@ class RasterReader:
         mask = mask_ds.GetRasterBand(1).ReadAsArray()
 
         # Extract values where mask == 1
-        sub_array = self.array[row_min:row_max, col_min:col_max]
+        sub_array = self.read_window(row_min, row_max, col_min, col_max)
         values = sub_array[mask == 1]
 
         mask_ds = None
@@ -103,9 +185,9 @@ class RasterReader:
         return float(np.mean(values))
 
 
-def load_inlets():
+def load_inlets(path):
     """Load inlet points as (x, y) array."""
-    ds = ogr.Open(INLETS_PATH)
+    ds = ogr.Open(path)
     layer = ds.GetLayer()
     points = []
     for feat in layer:
@@ -124,45 +206,63 @@ def nearest_inlet_distance(geom, inlet_points):
     return float(np.min(dists))
 
 
-def assign_hsg(geom):
+def load_hsg_grid(hsg_path, reader, cache=True):
+    """Soil polygons as a feature-ID grid aligned to one of the input rasters."""
+    return FeatureGrid(hsg_path, reader.gt, reader.proj, (reader.rows, reader.cols),
+                       fields=["HydrolGrp", "MUSYM"], cache=cache)
+
+
+def assign_hsg(geom, hsg_grid):
     """Spatial join: determine HSG for a segment based on its midpoint."""
-    ds = ogr.Open(HSG_PATH)
-    layer = ds.GetLayer()
     centroid = geom.Centroid()
-
+    props = hsg_grid.lookup(centroid.GetX(), centroid.GetY())
+    if props is None:
+        return "D", "unknown"  # default if outside all polygons
+    if props["HydrolGrp"] is None:
+        # Urban Land (MUSYM 50C) — assign HSG D per USDA guidance
+        return "D", props["MUSYM"]
+    return props["HydrolGrp"], props["MUSYM"]
+
+
+def z_order(rows, cols):
+    """Morton (Z-order) code of each (row, col) pair, for locality-preserving sorts."""
+    code = np.zeros(len(rows), dtype=np.uint64)
+    rows = np.asarray(rows, dtype=np.uint64)
+    cols = np.asarray(cols, dtype=np.uint64)
+    for bit in range(32):
+        b = np.uint64(bit)
+        code |= ((rows >> b) & np.uint64(1)) << np.uint64(2 * bit + 1)
+        code |= ((cols >> b) & np.uint64(1)) << np.uint64(2 * bit)
+    return code
+
+
+def spatial_order(layer, reader):
+    """Feature IDs sorted by the Z-order of their centroid cells.
+
+    Neighbouring segments then sample neighbouring raster blocks, so lazy
+    readers mostly hit their block cache.
+    """
+    fids, rows, cols = [], [], []
     for feat in layer:
-        poly = feat.GetGeometryRef()
-        if poly.Contains(centroid):
-            hsg = feat.GetField("HydrolGrp")
-            musym = feat.GetField("MUSYM")
-            ds = None
-            if hsg is None:
-                # Urban Land (MUSYM 50C) — assign HSG D per USDA guidance
-                return "D", musym
-            return hsg, musym
+        centroid = feat.GetGeometryRef().Centroid()
+        fids.append(feat.GetFID())
+        cols.append(max(0, int((centroid.GetX() - reader.x_origin) / reader.pixel_w)))
+        rows.append(max(0, int((centroid.GetY() - reader.y_origin) / reader.pixel_h)))
+    layer.ResetReading()
+    fids = np.array(fids)
+    return fids[np.argsort(z_order(rows, cols), kind="stable")]
 
-    ds = None
-    return "D", "unknown"  # default if outside all polygons
 
+def process_segments(layer, readers, hsg_grid, inlet_points):
+    """Attributes of every street segment of at least 20 ft.
 
-def main():
-    print("Loading rasters...")
-    readers = {}
-    for name, path in RASTERS.items():
-        readers[name] = RasterReader(path)
-        print(f"  {name}: {readers[name].cols}x{readers[name].rows}")
-
-    print("Loading inlets...")
-    inlet_points = load_inlets()
-    print(f"  {len(inlet_points)} inlet points")
-
-    print("Processing street segments...")
-    ds = ogr.Open(STREETS_PATH)
-    layer = ds.GetLayer()
+    Segments are visited in Z-order of their centroids (see spatial_order) and
+    returned in layer order as (geometry JSON, attribute dict) pairs.
+    """
     n_features = layer.GetFeatureCount()
-
     results = []
-    for i, feat in enumerate(layer):
+    for i, fid in enumerate(spatial_order(layer, readers["slope_deg"])):
+        feat = layer.GetFeature(int(fid))
         geom = feat.GetGeometryRef()
         buffered = geom.Buffer(BUFFER_DIST)
         seg_length = geom.Length()
@@ -177,7 +277,7 @@ def main():
             attrs[name] = reader.sample_polygon(buffered)
 
         # Soil group
-        hsg, musym = assign_hsg(geom)
+        hsg, musym = assign_hsg(geom, hsg_grid)
 
         # Distance to nearest inlet
         inlet_dist = nearest_inlet_distance(geom, inlet_points)
@@ -196,16 +296,18 @@ def main():
             "musym": musym,
             "inlet_dist_ft": round(inlet_dist, 1),
         }
-        results.append((geom.ExportToJson(), result))
+        results.append((int(fid), geom.ExportToJson(), result))
 
         if (i + 1) % 100 == 0:
             print(f"  {i + 1}/{n_features}...")
 
-    ds = None
-    print(f"  {len(results)} segments processed ({n_features - len(results)} skipped as <20ft)")
+    # Back to layer order for output
+    results.sort(key=lambda r: r[0])
+    return [(geom_json, result) for _, geom_json, result in results]
+
 
-    # Write GeoJSON
-    print("Writing output...")
+def write_segments(path, results):
+    """Write (geometry JSON, attributes) pairs as a GeoJSON FeatureCollection."""
     features = []
     for geom_json, attrs in results:
         features.append({
@@ -213,24 +315,18 @@ def main():
             "geometry": json.loads(geom_json),
             "properties": attrs,
         })
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
 
-    geojson = {
-        "type": "FeatureCollection",
-        "features": features,
-    }
 
-    with open(OUTPUT_PATH, "w") as f:
-        json.dump(geojson, f)
-
-    print(f"\nSaved {len(features)} segments to {OUTPUT_PATH}")
-
-    # Summary stats
+def print_summary(results):
+    """Range of each attribute and the HSG distribution over segments."""
     print("\nAttribute summary:")
     for key in ["slope_deg", "flow_accum", "twi", "impervious_pct", "inlet_dist_ft"]:
         vals = [r[key] for _, r in results if r[key] is not None]
         if vals:
-            arr = np.array(vals)
-            print(f"  {key}: min={arr.min():.1f}  median={np.median(arr):.1f}  max={arr.max():.1f}")
+            st = summarize(vals)
+            print(f"  {key}: min={st.min:.1f}  median={st.median:.1f}  max={st.max:.1f}")
 
     hsg_counts = {}
     for _, r in results:
@@ -238,5 +334,65 @@ def main():
     print(f"  HSG distribution: {dict(sorted(hsg_counts.items()))}")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Extract per-segment attributes.")
+    parser.add_argument("--lazy", action="store_true",
+                        help="Read raster blocks on demand instead of loading whole rasters")
+    parser.add_argument("--cache-mb", type=float, default=DEFAULT_CACHE_BYTES / 1024 / 1024,
+                        help="Block cache budget per raster in --lazy mode (default: 64)")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    output_path = os.path.join(data_dir, OUTPUT_PATH)
+
+    with run_report(os.path.dirname(output_path), "extract_attributes", area=area):
+        print(f"Loading rasters ({area})...")
+        readers = {}
+        with stage("load_rasters") as span:
+            for name, path in RASTERS.items():
+                readers[name] = RasterReader(os.path.join(data_dir, path), lazy=args.lazy,
+                                             cache_bytes=int(args.cache_mb * 1024 * 1024))
+                if not args.lazy:
+                    span.record(**{name: readers[name].array})
+                print(f"  {name}: {readers[name].cols}x{readers[name].rows}")
+
+        print("Loading inlets...")
+        with stage("load_inlets"):
+            inlet_points = load_inlets(os.path.join(data_dir, INLETS_PATH))
+        print(f"  {len(inlet_points)} inlet points")
+
+        print("Gridding soil groups...")
+        with stage("hsg_grid"):
+            hsg_grid = load_hsg_grid(os.path.join(data_dir, HSG_PATH), readers["slope_deg"])
+
+        print("Processing street segments...")
+        ds = ogr.Open(os.path.join(data_dir, STREETS_PATH))
+        layer = ds.GetLayer()
+        n_features = layer.GetFeatureCount()
+
+        with stage("segments") as span:
+            results = process_segments(layer, readers, hsg_grid, inlet_points)
+            span.note(segments=n_features, kept=len(results))
+            if args.lazy:
+                stats = {name: reader.cache_stats() for name, reader in readers.items()}
+                span.note(block_cache=stats)
+                for name, st in stats.items():
+                    print(f"  {name} block cache: {st['hits']:,} hits, {st['misses']:,} misses "
+                          f"({st['cached_mb']} MB held)")
+
+        ds = None
+        print(f"  {len(results)} segments processed ({n_features - len(results)} skipped as <20ft)")
+
+        # Write GeoJSON
+        print("Writing output...")
+        with stage("write_output"):
+            write_segments(output_path, results)
+
+        print(f"\nSaved {len(results)} segments to {output_path}")
+
+    print_summary(results)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,252 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Monte Carlo uncertainty for the FIS: perturbs membership breakpoints and rule
+# ABOUTME: centroids, evaluates members in chunks, writes per-cell mean/std/P(top 25%).
+
+import argparse
+import json
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from fis_suitability import (
+    DERIVED_DIR, HSG_MF, HSG_RASTER_PATH, IMP_FRAC_PATH, IMP_MF, SLOPE_MF, SLOPE_PATH,
+    STAGE1_RULES, STAGE2_RULES, SUIT_IN_MF, TWI_MF, TWI_PATH, write_raster,
+)
+from instrument import run_report, stage
+from study_area import add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+
+gdal.UseExceptions()
+
+# Membership functions that are perturbed (HSG classes are crisp and stay fixed)
+PERTURBED_MFS = {"slope": SLOPE_MF, "suit_in": SUIT_IN_MF, "imp": IMP_MF, "twi": TWI_MF}
+
+DEFAULT_MEMBERS = 100
+# Breakpoint jitter relative to each breakpoint's value; centroid jitter absolute
+DEFAULT_MF_SPREAD = 0.05
+DEFAULT_CENTROID_SPREAD = 0.05
+DEFAULT_CHUNK_MB = 256
+# Approximate float64 arrays alive per member × cell while a chunk is evaluated
+ARRAYS_PER_MEMBER_CELL = 24
+
+# Priority histogram resolution for each member's top-quartile threshold
+HIST_BINS = 4096
+TOP_QUANTILE = 0.75
+
+# Outputs relative to the area data directory
+OUTPUT_DIR = os.path.join(DERIVED_DIR, "ensemble")
+OUTPUTS = {
+    "mean": "priority_mean.tif",
+    "std": "priority_std.tif",
+    "p_top_quartile": "priority_p_top_quartile.tif",
+}
+MEMBERS_JSON = "members.json"
+
+
+# ─── Ensemble members ────────────────────────────────────────────────────────
+
+def perturb_mf(mf_dict, n, spread, rng):
+    """n jittered copies of an MF dict: {category: (n, 4) breakpoints}.
+
+    Each distinct breakpoint is scaled by one draw from [1 - spread, 1 + spread],
+    so categories that share an edge keep sharing it. The ends of the
+    variable's range stay fixed, so shoulders stay open, and every trapezoid
+    is re-sorted to a ≤ b ≤ c ≤ d.
+    """
+    params = np.array(list(mf_dict.values()), dtype=np.float64)
+    lo, hi = params.min(), params.max()
+    values, inverse = np.unique(params.ravel(), return_inverse=True)
+    scale = 1 + rng.uniform(-spread, spread, (n, values.size))
+    scale[:, (values == lo) | (values == hi)] = 1
+    members = np.clip(values * scale, lo, hi)[:, inverse].reshape(n, *params.shape)
+    members.sort(axis=2)
+    return {cat: members[:, i] for i, cat in enumerate(mf_dict)}
+
+
+def perturb_centroids(rules, n, spread, rng):
+    """n jittered copies of the rules' output centroids: (n, rules).
+
+    Each centroid level moves by one draw, so rules that share a level stay
+    equal and the ordering of levels is kept for spreads below half their gap.
+    """
+    centroids = np.array([rule[-1] for rule in rules])
+    levels, inverse = np.unique(centroids, return_inverse=True)
+    jittered = np.clip(levels + rng.uniform(-spread, spread, (n, levels.size)), 0, 1)
+    return jittered[:, inverse]
+
+
+def sample_members(n, mf_spread=DEFAULT_MF_SPREAD, centroid_spread=DEFAULT_CENTROID_SPREAD,
+                   seed=0):
+    """Parameters of n ensemble members, reproducible from seed."""
+    rng = np.random.default_rng(seed)
+    members = {name: perturb_mf(mf, n, mf_spread, rng) for name, mf in PERTURBED_MFS.items()}
+    members["hsg"] = {cat: np.array([params], dtype=np.float64) for cat, params in HSG_MF.items()}
+    members["stage1"] = perturb_centroids(STAGE1_RULES, n, centroid_spread, rng)
+    members["stage2"] = perturb_centroids(STAGE2_RULES, n, centroid_spread, rng)
+    return members
+
+
+# ─── Batched FIS ─────────────────────────────────────────────────────────────
+
+def trapmf_batch(x, params):
+    """Trapezoidal membership for every member at once.
+
+    x: (cells,) or (members, cells). params: (members, 4). Returns
+    (members, cells), equal to trapmf() row by row.
+    """
+    a, b, c, d = (params[:, i, None] for i in range(4))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        up = np.where(b > a, (x - a) / (b - a), x >= b)
+        down = np.where(d > c, (d - x) / (d - c), x <= c)
+    return np.clip(np.minimum(up, down), 0.0, 1.0)
+
+
+def evaluate_fis_batch(rules, mf_params, inputs, centroids):
+    """evaluate_fis() with a leading ensemble axis.
+
+    mf_params: per input, {category: (members or 1, 4)}. inputs: (cells,) or
+    (members, cells) arrays. centroids: (members, rules). Returns (members, cells).
+    """
+    n_members = centroids.shape[0]
+    n_cells = inputs[0].shape[-1]
+    memberships = [{cat: trapmf_batch(x, p) for cat, p in mfp.items()}
+                   for mfp, x in zip(mf_params, inputs)]
+    numerator = np.zeros((n_members, n_cells))
+    denominator = np.zeros((n_members, n_cells))
+    strength = np.empty((n_members, n_cells))
+    for k, rule in enumerate(rules):
+        cats = rule[:-1]
+        strength[...] = memberships[0][cats[0]]
+        for j in range(1, len(cats)):
+            np.minimum(strength, memberships[j][cats[j]], out=strength)
+        numerator += strength * centroids[:, k, None]
+        denominator += strength
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator),
+                     where=denominator > 0)
+
+
+def ensemble_priority(members, slope, hsg, imp_frac, twi):
+    """Two-stage FIS priority of every member for a chunk of cells: (members, cells)."""
+    suitability = evaluate_fis_batch(
+        STAGE1_RULES, [members["slope"], members["hsg"]], [slope, hsg], members["stage1"])
+    return evaluate_fis_batch(
+        STAGE2_RULES, [members["suit_in"], members["imp"], members["twi"]],
+        [suitability, imp_frac, twi], members["stage2"])
+
+
+# ─── Streaming statistics ────────────────────────────────────────────────────
+
+def chunk_cells(n_members, chunk_mb):
+    """Cells per chunk so that all members of one chunk fit in chunk_mb."""
+    return max(1, int(chunk_mb * 1e6 / (n_members * ARRAYS_PER_MEMBER_CELL * 8)))
+
+
+def ensemble_stats(members, inputs, chunk_mb=DEFAULT_CHUNK_MB):
+    """Per-cell mean, std and P(top quartile) of priority over the ensemble.
+
+    inputs: flat (slope, hsg, imp_frac, twi) arrays. Two passes over chunks
+    of cells: the first gives mean/std and each member's priority histogram
+    (hence its top-quartile threshold), the second counts how many members
+    put each cell in their top quartile. Only the three outputs are full size.
+    """
+    n_members = members["stage1"].shape[0]
+    n = inputs[0].size
+    step = chunk_cells(n_members, chunk_mb)
+    mean = np.empty(n, dtype=np.float32)
+    std = np.empty(n, dtype=np.float32)
+    p_top = np.empty(n, dtype=np.float32)
+    hist = np.zeros(n_members * HIST_BINS, dtype=np.int64)
+    offsets = (np.arange(n_members) * HIST_BINS)[:, None]
+
+    for s in range(0, n, step):
+        priority = ensemble_priority(members, *(x[s:s + step] for x in inputs))
+        mean[s:s + step] = priority.mean(axis=0)
+        std[s:s + step] = priority.std(axis=0)
+        bins = np.minimum((priority * HIST_BINS).astype(np.int64), HIST_BINS - 1)
+        hist += np.bincount((bins + offsets).ravel(), minlength=hist.size)
+
+    # A member's top quartile is every bin above the one holding its 75th
+    # percentile: at most 25% of cells even when that bin holds a tied
+    # centroid level. Thresholds are those bins' upper edges.
+    cum = hist.reshape(n_members, HIST_BINS).cumsum(axis=1)
+    cut = np.argmax(cum >= TOP_QUANTILE * n, axis=1)[:, None]
+    thresholds = (cut[:, 0] + 1) / HIST_BINS
+
+    for s in range(0, n, step):
+        priority = ensemble_priority(members, *(x[s:s + step] for x in inputs))
+        bins = np.minimum((priority * HIST_BINS).astype(np.int64), HIST_BINS - 1)
+        p_top[s:s + step] = (bins > cut).mean(axis=0)
+
+    return {"mean": mean, "std": std, "p_top_quartile": p_top}, thresholds
+
+
+def read_raster(path):
+    ds = gdal.Open(path)
+    array = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+    gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+    ds = None
+    return array, gt, proj
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo uncertainty of FIS priority.")
+    parser.add_argument("--members", type=int, default=DEFAULT_MEMBERS,
+                        help=f"Ensemble members (default: {DEFAULT_MEMBERS})")
+    parser.add_argument("--mf-spread", type=float, default=DEFAULT_MF_SPREAD,
+                        help="Relative jitter of membership breakpoints "
+                             f"(default: {DEFAULT_MF_SPREAD})")
+    parser.add_argument("--centroid-spread", type=float, default=DEFAULT_CENTROID_SPREAD,
+                        help=f"Rule centroid jitter (default: {DEFAULT_CENTROID_SPREAD})")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_MB,
+                        help=f"Working memory per chunk in MB (default: {DEFAULT_CHUNK_MB})")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    out_dir = os.path.join(data_dir, OUTPUT_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with run_report(out_dir, "fis_ensemble", area=area, members=args.members, seed=args.seed):
+        print(f"Loading FIS inputs ({area})...")
+        with stage("load_inputs"):
+            slope, gt, proj = read_raster(os.path.join(data_dir, SLOPE_PATH))
+            hsg = read_raster(os.path.join(data_dir, HSG_RASTER_PATH))[0]
+            imp_frac = read_raster(os.path.join(data_dir, IMP_FRAC_PATH))[0]
+            twi = read_raster(os.path.join(data_dir, TWI_PATH))[0]
+        shape = slope.shape
+
+        members = sample_members(args.members, args.mf_spread, args.centroid_spread, args.seed)
+        step = chunk_cells(args.members, args.chunk_mb)
+        print(f"Evaluating {args.members} members over {slope.size:,} cells "
+              f"in chunks of {step:,} cells...")
+        with stage("ensemble", cells=slope.size * args.members) as span:
+            stats, thresholds = ensemble_stats(
+                members, [a.ravel() for a in (slope, hsg, imp_frac, twi)], args.chunk_mb)
+            span.note(members=args.members, chunk_cells=step)
+        print(f"  Member top-quartile thresholds: {thresholds.min():.3f} – {thresholds.max():.3f}")
+
+        with stage("write_outputs"):
+            for name, filename in OUTPUTS.items():
+                array = stats[name].reshape(shape)
+                path = os.path.join(out_dir, filename)
+                write_raster(path, array, gt, proj)
+                print(f"  {name}: {summarize(array).describe()}  -> {path}")
+            members_path = os.path.join(out_dir, MEMBERS_JSON)
+            with open(members_path, "w") as f:
+                json.dump({
+                    "members": args.members, "seed": args.seed,
+                    "mf_spread": args.mf_spread, "centroid_spread": args.centroid_spread,
+                    "top_quartile_thresholds": thresholds.round(4).tolist(),
+                }, f, indent=2)
+            print(f"  -> {members_path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
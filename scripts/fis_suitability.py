@@ -6,21 +6,33 @@
 # ABOUTME: Stage 1: physical suitability (slope × HSG). Stage 2: capture priority
 # ABOUTME: (suitability × impervious fraction × TWI). Outputs rasters + ASCII grids.
 
+import argparse
+import json
 import os
 import numpy as np
 from osgeo import gdal, ogr, osr
 from scipy import stats
 
+from constraints import CONSTRAINTS_PATH, feasible, load_flags
+from flow_index import load_index
+from gsi_density import density_correlation, facility_density
+from instrument import run_report, stage
+from neighborhood import box_mean
+from rasterize import rasterize_values
+from study_area import DATA_DIR, add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+
 gdal.UseExceptions()
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
-DERIVED_DIR = os.path.join(DATA_DIR, "derived")
+# Paths below are relative to the area data directory
+DERIVED_DIR = "derived"
 
 # Input paths
 SLOPE_PATH = os.path.join(DERIVED_DIR, "slope.tif")
 TWI_PATH = os.path.join(DERIVED_DIR, "twi.tif")
-HSG_PATH = os.path.join(DATA_DIR, "stormwater", "hydrologic_soil_groups.geojson")
-IMPERVIOUS_PATH = os.path.join(DATA_DIR, "impervious", "impervious.tif")
+HSG_PATH = os.path.join("stormwater", "hydrologic_soil_groups.geojson")
+IMPERVIOUS_PATH = os.path.join("impervious", "impervious.tif")
+# GSI facilities are citywide and shared by every study area
 GSI_PATH = os.path.join(DATA_DIR, "validation", "gsi_facilities.geojson")
 
 # Output paths
@@ -30,10 +42,16 @@ SUIT_PATH = os.path.join(DERIVED_DIR, "fis_suitability.tif")
 PRIORITY_PATH = os.path.join(DERIVED_DIR, "fis_priority.tif")
 SUIT_ASC_PATH = os.path.join(DERIVED_DIR, "fis_suitability_utm.asc")
 PRIORITY_ASC_PATH = os.path.join(DERIVED_DIR, "fis_priority_utm.asc")
+TOP_CANDIDATES_PATH = os.path.join(DERIVED_DIR, "fis_top_candidates.geojson")
 
 # HSG encoding: A=4 (best infiltration) → D=1 (worst)
 HSG_MAP = {"A": 4, "B": 3, "C": 2, "D": 1}
 
+# Screening pyramid block sizes in cells, coarsest first (48/24/12 ft at 3 ft)
+PYRAMID_BLOCKS = [16, 8, 4]
+# Slack on interval bounds so float rounding never prunes a true candidate
+BOUND_SLACK = 1e-9
+
 # ─── Membership function parameters ──────────────────────────────────────────
 # Each is [a, b, c, d] for trapezoidal: ramp up a→b, plateau b→c, ramp down c→d
 
@@ -179,90 +197,21 @@ def trapmf(x, params):
     return result
 
 
-def box_mean(arr, k):
-    """Compute k×k box mean using integral image (summed area table).
+def hsg_expression():
+    """SQLite expression mapping HydrolGrp to its HSG code (Urban Land → D)."""
+    cases = " ".join(f"WHEN '{label}' THEN {val}" for label, val in HSG_MAP.items())
+    return f"CASE HydrolGrp {cases} ELSE {HSG_MAP['D']} END"
 
-    Handles edges by clamping to array bounds. Pure numpy, no scipy.
-    """
-    rows, cols = arr.shape
-    # Summed area table with one row/col of padding
-    sat = np.zeros((rows + 1, cols + 1), dtype=np.float64)
-    sat[1:, 1:] = np.cumsum(np.cumsum(arr.astype(np.float64), axis=0), axis=1)
-
-    half = k // 2
-    # Build coordinate arrays for the four corners of each box
-    r = np.arange(rows)
-    c = np.arange(cols)
-    # Top-left corner (inclusive)
-    r1 = np.clip(r - half, 0, rows - 1)
-    r2 = np.clip(r + half, 0, rows - 1) + 1  # exclusive in SAT
-    c1 = np.clip(c - half, 0, cols - 1)
-    c2 = np.clip(c + half, 0, cols - 1) + 1
-
-    # Use outer indexing for 2D lookup
-    r1 = r1[:, None]
-    r2 = r2[:, None]
-    c1 = c1[None, :]
-    c2 = c2[None, :]
-
-    box_sum = sat[r2, c2] - sat[r1, c2] - sat[r2, c1] + sat[r1, c1]
-    box_count = (r2 - r1) * (c2 - c1)
-    return box_sum / box_count
-
-
-def rasterize_hsg(gt, proj, shape):
+
+def rasterize_hsg(gt, proj, shape, hsg_path, cache=True):
     """Rasterize HSG polygons to numeric grid (A=4, B=3, C=2, D=1).
 
-    Uncovered cells default to 1 (HSG D, conservative).
+    Uncovered cells and Urban Land (no HydrolGrp) default to 1 (HSG D,
+    conservative).
     """
-    rows, cols = shape
     print("Rasterizing HSG polygons...")
-
-    # Create output raster in memory
-    mem_drv = gdal.GetDriverByName("MEM")
-    out_ds = mem_drv.Create("", cols, rows, 1, gdal.GDT_Byte)
-    out_ds.SetGeoTransform(gt)
-    out_ds.SetProjection(proj)
-    band = out_ds.GetRasterBand(1)
-    band.Fill(1)  # default D
-
-    # Open HSG vector
-    vec_ds = ogr.Open(HSG_PATH)
-    vec_lyr = vec_ds.GetLayer()
-
-    # Add numeric field for rasterization
-    # We need to create a temporary layer with the numeric HSG value
-    mem_vec_drv = ogr.GetDriverByName("MEM")
-    tmp_ds = mem_vec_drv.CreateDataSource("")
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(2913)
-    tmp_lyr = tmp_ds.CreateLayer("hsg", srs, ogr.wkbPolygon)
-    tmp_lyr.CreateField(ogr.FieldDefn("hsg_num", ogr.OFTInteger))
-
-    counts = {v: 0 for v in HSG_MAP.values()}
-    for feat in vec_lyr:
-        hsg = feat.GetField("HydrolGrp")
-        musym = feat.GetField("MUSYM")
-        if hsg is None:
-            hsg_val = HSG_MAP["D"]  # Urban Land → D
-        else:
-            hsg_val = HSG_MAP.get(hsg, 1)
-
-        new_feat = ogr.Feature(tmp_lyr.GetLayerDefn())
-        new_feat.SetField("hsg_num", hsg_val)
-        new_feat.SetGeometry(feat.GetGeometryRef().Clone())
-        tmp_lyr.CreateFeature(new_feat)
-        counts[hsg_val] += 1
-
-    print(f"  HSG polygons: {dict(counts)}")
-
-    # Rasterize with attribute burn
-    gdal.RasterizeLayer(out_ds, [1], tmp_lyr, options=["ATTRIBUTE=hsg_num"])
-
-    hsg_arr = band.ReadAsArray().astype(np.float64)
-    out_ds = None
-    tmp_ds = None
-    vec_ds = None
+    hsg_arr = rasterize_values(hsg_path, gt, proj, shape, hsg_expression(),
+                               default=HSG_MAP["D"], cache=cache)
 
     # Report cell counts
     for label, val in HSG_MAP.items():
@@ -320,6 +269,238 @@ def evaluate_fis(rules, mf_dicts, inputs, rule_input_keys):
     return output
 
 
+# ─── Coarse-to-fine candidate screening ──────────────────────────────────────
+# A block's inputs span intervals, so interval arithmetic through the FIS
+# bounds every priority inside it. Blocks whose upper bound cannot reach the
+# top-k are dropped before any cell in them is evaluated exactly.
+
+def trapmf_bounds(lo, hi, params):
+    """Min and max of a trapezoidal membership over intervals [lo, hi].
+
+    A trapezoid only rises to its plateau and then falls, so the minimum over
+    an interval sits at one of its ends and the maximum is 1 wherever the
+    interval touches the plateau.
+    """
+    a, b, c, d = params
+    at_lo = trapmf(lo, params)
+    at_hi = trapmf(hi, params)
+    mf_min = np.minimum(at_lo, at_hi)
+    mf_max = np.where(hi < b, at_hi, np.where(lo > c, at_lo, 1.0))
+    return mf_min, mf_max
+
+
+def fis_bounds(rules, mf_dicts, lows, highs):
+    """Bound evaluate_fis() over boxes of input intervals.
+
+    Firing strengths are bounded per rule; the weighted average is then
+    extremal at a split of the rules by centroid (rules above the split at one
+    bound, the rest at the other), so every split is tried.
+
+    Returns:
+        (lower, upper) arrays, same shape as the interval arrays.
+    """
+    mf_bounds = []
+    for mf_dict, lo, hi in zip(mf_dicts, lows, highs):
+        mf_bounds.append({cat: trapmf_bounds(lo, hi, p) for cat, p in mf_dict.items()})
+
+    # Rules ordered by centroid, highest first
+    ordered = sorted(rules, key=lambda rule: -rule[-1])
+    centroids = np.array([rule[-1] for rule in ordered])[:, None]
+    w_lo = np.empty((len(ordered), lows[0].size), dtype=np.float64)
+    w_hi = np.empty_like(w_lo)
+    for k, rule in enumerate(ordered):
+        cats = rule[:-1]
+        s_lo, s_hi = (m.ravel().copy() for m in mf_bounds[0][cats[0]])
+        for j in range(1, len(cats)):
+            np.minimum(s_lo, mf_bounds[j][cats[j]][0].ravel(), out=s_lo)
+            np.minimum(s_hi, mf_bounds[j][cats[j]][1].ravel(), out=s_hi)
+        w_lo[k] = s_lo
+        w_hi[k] = s_hi
+
+    def split_extreme(w_top, w_rest, reduce):
+        # Split j puts the j highest-centroid rules at w_top, the rest at w_rest
+        zero = np.zeros((1, w_top.shape[1]))
+        num_top = np.concatenate([zero, np.cumsum(w_top * centroids, axis=0)])
+        den_top = np.concatenate([zero, np.cumsum(w_top, axis=0)])
+        num_rest = np.concatenate([np.cumsum((w_rest * centroids)[::-1], axis=0)[::-1], zero])
+        den_rest = np.concatenate([np.cumsum(w_rest[::-1], axis=0)[::-1], zero])
+        num = num_top + num_rest
+        den = den_top + den_rest
+        # No rule firing gives 0, as in evaluate_fis()
+        ratio = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+        return reduce(ratio, axis=0)
+
+    lower = split_extreme(w_lo, w_hi, np.min).reshape(lows[0].shape)
+    upper = split_extreme(w_hi, w_lo, np.max).reshape(lows[0].shape)
+    return lower, upper
+
+
+def block_extremes(arr, block):
+    """Per-block min and max of a 2D array over block×block tiles.
+
+    Ragged edges are padded by replication, which leaves extremes unchanged.
+    """
+    rows, cols = arr.shape
+    padded = np.pad(arr, ((0, -rows % block), (0, -cols % block)), mode="edge")
+    tiles = padded.reshape(padded.shape[0] // block, block, padded.shape[1] // block, block)
+    return tiles.min(axis=(1, 3)), tiles.max(axis=(1, 3))
+
+
+def block_counts(mask, block):
+    """Number of True cells of a 2D boolean array in each block×block tile."""
+    rows, cols = mask.shape
+    padded = np.pad(mask, ((0, -rows % block), (0, -cols % block)))
+    tiles = padded.reshape(padded.shape[0] // block, block, padded.shape[1] // block, block)
+    return tiles.sum(axis=(1, 3), dtype=np.int64)
+
+
+def rank_cells(values, cell_ids, k):
+    """Indices of the k best cells: highest value first, ties by cell id."""
+    k = min(k, values.size)
+    if k == 0:
+        return np.array([], dtype=np.int64)
+    kth = np.partition(values, values.size - k)[values.size - k]
+    contenders = np.flatnonzero(values >= kth)
+    order = np.lexsort((cell_ids[contenders], -values[contenders]))
+    return contenders[order[:k]]
+
+
+def top_candidates(priority, k, allowed=None):
+    """Flat indices of the k highest-priority cells of a full priority grid.
+
+    allowed: optional boolean grid; other cells are dropped before ranking.
+    """
+    values = priority.ravel()
+    if allowed is None:
+        return rank_cells(values, np.arange(values.size), k)
+    cells = np.flatnonzero(allowed.ravel())
+    return cells[rank_cells(values[cells], cells, k)]
+
+
+def screen_top_candidates(slope, hsg, imp_frac, twi, k, blocks=PYRAMID_BLOCKS, allowed=None):
+    """Find the k highest-priority cells by coarse-to-fine screening.
+
+    Input extremes are aggregated into a block pyramid. At each level the
+    surviving blocks are bounded through both FIS stages; a block is kept only
+    if its upper bound reaches the k-th best guaranteed lower bound. Cells of
+    the surviving finest blocks are then evaluated exactly, so the result is
+    identical to top_candidates() on the full-resolution priority grid.
+
+    allowed: optional boolean grid (e.g. constraints.feasible()). Blocks are
+    then counted by their allowed cells only, and other cells are never
+    evaluated exactly or ranked.
+
+    Returns:
+        (flat cell indices, priority, suitability) of the top k, best first.
+    """
+    rows, cols = slope.shape
+    layers = [slope, hsg, imp_frac, twi]
+
+    # Aggregate at the finest block size, then reduce 2×2 for each coarser level
+    pyramid = {blocks[-1]: [block_extremes(layer, blocks[-1]) for layer in layers]}
+    for fine, coarse in zip(blocks[:0:-1], blocks[-2::-1]):
+        factor = coarse // fine
+        level = []
+        for lo, hi in pyramid[fine]:
+            level.append((block_extremes(lo, factor)[0], block_extremes(hi, factor)[1]))
+        pyramid[coarse] = level
+
+    def exact_priority(r, c):
+        suit = evaluate_fis(
+            rules=STAGE1_RULES,
+            mf_dicts=[SLOPE_MF, HSG_MF],
+            inputs=[slope[r, c], hsg[r, c]],
+            rule_input_keys=None,
+        )
+        pri = evaluate_fis(
+            rules=STAGE2_RULES,
+            mf_dicts=[SUIT_IN_MF, IMP_MF, TWI_MF],
+            inputs=[suit, imp_frac[r, c], twi[r, c]],
+            rule_input_keys=None,
+        )
+        return pri, suit
+
+    n_blocks = pyramid[blocks[0]][0][0].shape
+    active = np.indices(n_blocks).reshape(2, -1).T
+    for i, size in enumerate(blocks):
+        br, bc = active[:, 0], active[:, 1]
+        lows = [lo[br, bc] for lo, _ in pyramid[size]]
+        highs = [hi[br, bc] for _, hi in pyramid[size]]
+
+        suit_lo, suit_hi = fis_bounds(STAGE1_RULES, [SLOPE_MF, HSG_MF], lows[:2], highs[:2])
+        pri_lo, pri_hi = fis_bounds(
+            STAGE2_RULES, [SUIT_IN_MF, IMP_MF, TWI_MF],
+            [suit_lo - BOUND_SLACK, lows[2], lows[3]],
+            [suit_hi + BOUND_SLACK, highs[2], highs[3]],
+        )
+
+        # At least k cells lie in blocks whose lower bound is >= tau
+        if allowed is None:
+            n_cells = np.minimum(size, rows - br * size) * np.minimum(size, cols - bc * size)
+        else:
+            n_cells = block_counts(allowed, size)[br, bc]
+        by_lower = np.argsort(-pri_lo, kind="stable")
+        reached = np.searchsorted(np.cumsum(n_cells[by_lower]), k)
+        tau = pri_lo[by_lower[reached]] - BOUND_SLACK if reached < len(by_lower) else -np.inf
+        # Exact priority at one cell per block also proves k cells reach tau
+        if len(br) >= k:
+            sampled = exact_priority(br * size, bc * size)[0]
+            if allowed is not None:
+                sampled = np.where(allowed[br * size, bc * size], sampled, -np.inf)
+            tau = max(tau, np.partition(sampled, len(sampled) - k)[len(sampled) - k])
+        active = active[(pri_hi + BOUND_SLACK >= tau) & (n_cells > 0)]
+        print(f"  {size}x{size}-cell blocks: kept {len(active):,} of {len(br):,}"
+              f" (cutoff {tau:.4f})")
+
+        if i + 1 < len(blocks):
+            factor = size // blocks[i + 1]
+            child_shape = pyramid[blocks[i + 1]][0][0].shape
+            offsets = np.indices((factor, factor)).reshape(2, -1).T
+            active = (active[:, None, :] * factor + offsets[None, :, :]).reshape(-1, 2)
+            inside = (active[:, 0] < child_shape[0]) & (active[:, 1] < child_shape[1])
+            active = active[inside]
+
+    # Exact evaluation of every cell in the surviving finest blocks
+    size = blocks[-1]
+    cell_r = (active[:, 0, None] * size + np.arange(size)[None, :])[:, :, None]
+    cell_c = (active[:, 1, None] * size + np.arange(size)[None, :])[:, None, :]
+    cell_r, cell_c = np.broadcast_arrays(cell_r, cell_c)
+    inside = (cell_r < rows) & (cell_c < cols)
+    cell_r, cell_c = cell_r[inside], cell_c[inside]
+    if allowed is not None:
+        keep = allowed[cell_r, cell_c]
+        cell_r, cell_c = cell_r[keep], cell_c[keep]
+    print(f"  Exact FIS on {cell_r.size:,} of {rows * cols:,} cells"
+          f" ({cell_r.size / (rows * cols) * 100:.2f}%)")
+
+    priority, suitability = exact_priority(cell_r, cell_c)
+    cell_ids = cell_r.astype(np.int64) * cols + cell_c
+    best = rank_cells(priority, cell_ids, k)
+    return cell_ids[best], priority[best], suitability[best]
+
+
+def write_candidates(path, cell_ids, priority, suitability, gt, shape):
+    """Write ranked candidate cells as GeoJSON points at cell centers."""
+    rows, cols = np.divmod(cell_ids, shape[1])
+    features = []
+    for rank, (r, c, pri, suit) in enumerate(zip(rows, cols, priority, suitability), start=1):
+        x = gt[0] + (c + 0.5) * gt[1]
+        y = gt[3] + (r + 0.5) * gt[5]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [x, y]},
+            "properties": {
+                "rank": rank,
+                "row": int(r),
+                "col": int(c),
+                "priority": round(float(pri), 4),
+                "suitability": round(float(suit), 4),
+            },
+        })
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
 def write_raster(path, array, gt, proj, nodata=-9999):
     """Write a single-band Float32 GeoTIFF."""
     driver = gdal.GetDriverByName("GTiff")
@@ -334,9 +515,10 @@ def write_raster(path, array, gt, proj, nodata=-9999):
     ds = None
 
 
-def write_ascii_grid_utm(tif_path, asc_path):
+def write_ascii_grid_utm(tif_path, asc_path, verbose=True):
     """Reproject a GeoTIFF from EPSG:2913 to EPSG:26910 and write as ASCII grid."""
-    print(f"  Reprojecting to UTM ASCII: {os.path.basename(asc_path)}")
+    if verbose:
+        print(f"  Reprojecting to UTM ASCII: {os.path.basename(asc_path)}")
 
     src_ds = gdal.Open(tif_path)
     dst_srs = osr.SpatialReference()
@@ -350,12 +532,13 @@ def write_ascii_grid_utm(tif_path, asc_path):
     )
     gdal.Warp(asc_path, src_ds, options=warp_opts)
     src_ds = None
-    print(f"  -> {asc_path}")
+    if verbose:
+        print(f"  -> {asc_path}")
 
 
-def sample_gsi_facilities(raster, gt):
+def sample_gsi_facilities(raster, gt, gsi_path=GSI_PATH):
     """Sample a raster at GSI facility centroids. Returns array of values."""
-    ds = ogr.Open(GSI_PATH)
+    ds = ogr.Open(gsi_path)
     if ds is None:
         return np.array([])
     lyr = ds.GetLayer()
@@ -374,37 +557,37 @@ def sample_gsi_facilities(raster, gt):
     return np.array(vals)
 
 
-def validate_against_gsi(suitability, priority, gt):
+def validate_against_gsi(suitability, priority, gt, gsi_path=GSI_PATH):
     """Statistical validation of FIS outputs against GSI facility locations.
 
     Tests: Mann-Whitney U, Kolmogorov-Smirnov, AUC-ROC, Boyce Index,
-    percentile rank analysis.
+    percentile rank analysis, facility density vs. priority correlation.
     """
     print("\n" + "=" * 65)
     print("STATISTICAL VALIDATION: FIS Priority vs. GSI Facility Locations")
     print("=" * 65)
 
-    fac_suit = sample_gsi_facilities(suitability, gt)
-    fac_pri = sample_gsi_facilities(priority, gt)
+    fac_suit = sample_gsi_facilities(suitability, gt, gsi_path)
+    fac_pri = sample_gsi_facilities(priority, gt, gsi_path)
     if len(fac_pri) == 0:
         print("  WARNING: Cannot open GSI facilities file, skipping validation.")
         return
 
     bg_vals = priority.ravel()
+    bg = summarize(priority, lo=0.0, hi=1.0)
     n = len(fac_pri)
 
     # ── 1. Descriptive comparison ────────────────────────────────────────
     print(f"\n1. DESCRIPTIVE STATISTICS")
     print(f"   Background (all {bg_vals.size:,} cells):")
-    print(f"     mean={np.mean(bg_vals):.4f}  median={np.median(bg_vals):.4f}"
-          f"  std={np.std(bg_vals):.4f}")
+    print(f"     mean={bg.mean:.4f}  median={bg.median:.4f}  std={bg.std:.4f}")
     print(f"   Facilities ({n} locations):")
     print(f"     mean={np.mean(fac_pri):.4f}  median={np.median(fac_pri):.4f}"
           f"  std={np.std(fac_pri):.4f}")
 
     print(f"\n   Suitability: facility mean={np.mean(fac_suit):.4f}"
-          f"  background mean={np.mean(suitability):.4f}"
-          f"  ratio={np.mean(fac_suit) / np.mean(suitability):.2f}x")
+          f"  background mean={suitability.mean():.4f}"
+          f"  ratio={np.mean(fac_suit) / suitability.mean():.2f}x")
 
     # ── 2. Mann-Whitney U test ───────────────────────────────────────────
     rng = np.random.default_rng(42)
@@ -456,22 +639,16 @@ def validate_against_gsi(suitability, priority, gt):
 
     # ── 5. Boyce Index (continuous) ──────────────────────────────────────
     n_bins = 10
-    bin_edges = np.linspace(priority.min(), priority.max(), n_bins + 1)
+    bin_edges = np.linspace(bg.min, bg.max, n_bins + 1)
     bin_mids = (bin_edges[:-1] + bin_edges[1:]) / 2
 
-    pe_ratios = []
-    for i in range(n_bins):
-        lo, hi = bin_edges[i], bin_edges[i + 1]
-        include_upper = i == n_bins - 1
-        if include_upper:
-            bg_frac = np.mean((bg_vals >= lo) & (bg_vals <= hi))
-            fac_frac = np.mean((fac_pri >= lo) & (fac_pri <= hi))
-        else:
-            bg_frac = np.mean((bg_vals >= lo) & (bg_vals < hi))
-            fac_frac = np.mean((fac_pri >= lo) & (fac_pri < hi))
-        pe_ratios.append(fac_frac / bg_frac if bg_frac > 0 else np.nan)
-
-    pe_ratios = np.array(pe_ratios)
+    # One pass each; np.histogram's last bin includes its upper edge
+    bg_counts = np.histogram(bg_vals, bin_edges)[0]
+    fac_counts = np.histogram(fac_pri, bin_edges)[0]
+    bg_fracs = bg_counts / bg_vals.size
+    fac_fracs = fac_counts / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pe_ratios = np.where(bg_fracs > 0, fac_fracs / bg_fracs, np.nan)
     valid = ~np.isnan(pe_ratios)
     boyce_r, boyce_p = stats.spearmanr(bin_mids[valid], pe_ratios[valid])
 
@@ -483,13 +660,7 @@ def validate_against_gsi(suitability, priority, gt):
     print(f"\n   Bin         Expected   Observed   P/E ratio")
     for i in range(n_bins):
         lo, hi = bin_edges[i], bin_edges[i + 1]
-        include_upper = i == n_bins - 1
-        if include_upper:
-            bg_n = np.sum((bg_vals >= lo) & (bg_vals <= hi))
-            fac_n = np.sum((fac_pri >= lo) & (fac_pri <= hi))
-        else:
-            bg_n = np.sum((bg_vals >= lo) & (bg_vals < hi))
-            fac_n = np.sum((fac_pri >= lo) & (fac_pri < hi))
+        bg_n, fac_n = bg_counts[i], fac_counts[i]
         pe = pe_ratios[i]
         pe_str = f"{pe:.2f}" if not np.isnan(pe) else "  - "
         bar = "#" * min(int(pe * 10), 40) if not np.isnan(pe) else ""
@@ -504,96 +675,177 @@ def validate_against_gsi(suitability, priority, gt):
     print(f"   Median percentile: {np.median(fac_pctiles):.1f}th")
     print(f"   (50th expected if random placement)")
 
-    # Top-quartile enrichment
-    p75 = np.percentile(priority, 75)
+    # Top-quartile enrichment; exact (np.percentile partitions, O(n)), since
+    # histogram quantiles land above ties at FIS centroid values
+    p75 = np.percentile(bg_vals, 75)
     fac_in_top_q = np.sum(fac_pri >= p75)
     pct_top_q = fac_in_top_q / n * 100
     print(f"\n   Top quartile (>= {p75:.3f}): {fac_in_top_q}/{n}"
           f" ({pct_top_q:.1f}%, expected 25%)")
 
+    # ── 7. Facility density correlation ─────────────────────────────────
+    densities = facility_density(gt, priority.shape, gsi_path=gsi_path)
+    corr = density_correlation(priority, densities, gt[1])
+    print(f"\n7. GSI DENSITY vs. PRIORITY (Gaussian kernel density, FFT)")
+    print(f"   Bandwidth   Pearson r   Spearman rho   Block r (blocks)")
+    for bw, c in corr.items():
+        print(f"   {bw:>6g} ft   {c['pearson']:>9.3f}   {c['spearman']:>12.3f}"
+              f"   {c['block_pearson']:>7.3f} ({c['blocks']:,})")
+    print(f"   Block r averages over bandwidth-sized blocks, discounting the")
+    print(f"   autocorrelation the kernel adds to cell-level r.")
+    best_bw = max(corr, key=lambda bw: corr[bw]["block_pearson"])
+
     print(f"\n{'=' * 65}")
     print(f"SUMMARY")
     print(f"  AUC-ROC:         {auc:.3f}")
     print(f"  Mann-Whitney:    p = {u_pval:.2e}  (effect r = {rank_biserial:.3f})")
     print(f"  Boyce Index:     B = {boyce_r:.3f}  (p = {boyce_p:.4f})")
     print(f"  Mean percentile: {np.mean(fac_pctiles):.0f}th")
+    print(f"  Density block r: {corr[best_bw]['block_pearson']:.3f}  (at {best_bw:g} ft)")
     print(f"{'=' * 65}")
 
 
 def main():
-    os.makedirs(DERIVED_DIR, exist_ok=True)
-
-    # ── Load reference raster for grid alignment ─────────────────────────────
-    print("Loading slope raster (reference grid)...")
-    slope_ds = gdal.Open(SLOPE_PATH)
-    slope = slope_ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
-    gt = slope_ds.GetGeoTransform()
-    proj = slope_ds.GetProjection()
-    shape = slope.shape
-    slope_ds = None
-    print(f"  Grid: {shape[1]}x{shape[0]}, pixel={gt[1]}ft")
-    print(f"  Slope range: {slope.min():.2f} – {slope.max():.2f} degrees")
-
-    # ── Load TWI ─────────────────────────────────────────────────────────────
-    print("Loading TWI...")
-    twi_ds = gdal.Open(TWI_PATH)
-    twi = twi_ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
-    twi_ds = None
-    print(f"  TWI range: {twi.min():.2f} – {twi.max():.2f}")
-
-    # ── Step 1: Rasterize HSG ────────────────────────────────────────────────
-    hsg = rasterize_hsg(gt, proj, shape)
-    write_raster(HSG_RASTER_PATH, hsg, gt, proj)
-    print(f"  -> {HSG_RASTER_PATH}")
-
-    # ── Step 2: Compute impervious neighborhood fraction ─────────────────────
-    print("\nComputing impervious neighborhood fraction (11×11 box mean)...")
-    imp_ds = gdal.Open(IMPERVIOUS_PATH)
-    imp_raw = imp_ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
-    imp_ds = None
-    imp_frac = box_mean(imp_raw, 11)
-    print(f"  Raw impervious: {imp_raw.mean():.3f} mean")
-    print(f"  Fraction range: {imp_frac.min():.3f} – {imp_frac.max():.3f}")
-    print(f"  Fraction mean:  {imp_frac.mean():.3f}")
-    print(f"  Fraction median: {np.median(imp_frac):.3f}")
-    write_raster(IMP_FRAC_PATH, imp_frac, gt, proj)
-    print(f"  -> {IMP_FRAC_PATH}")
-
-    # ── Stage 1: Physical Suitability FIS ────────────────────────────────────
-    print("\n=== Stage 1: Physical Suitability (slope × HSG) ===")
-    suitability = evaluate_fis(
-        rules=STAGE1_RULES,
-        mf_dicts=[SLOPE_MF, HSG_MF],
-        inputs=[slope, hsg],
-        rule_input_keys=None,
+    parser = argparse.ArgumentParser(description="Two-stage FIS for bioswale siting.")
+    parser.add_argument(
+        "--top-k", type=int, default=None,
+        help="Screen for the k highest-priority cells with the block pyramid "
+             "instead of writing full suitability and priority rasters",
     )
-    print(f"  Suitability range: {suitability.min():.3f} – {suitability.max():.3f}")
-    print(f"  Suitability mean:  {suitability.mean():.3f}")
-    print(f"  Suitability median: {np.median(suitability):.3f}")
-    write_raster(SUIT_PATH, suitability, gt, proj)
-    print(f"  -> {SUIT_PATH}")
-
-    # ── Stage 2: Capture Priority FIS ────────────────────────────────────────
-    print("\n=== Stage 2: Capture Priority (suitability × impervious × TWI) ===")
-    priority = evaluate_fis(
-        rules=STAGE2_RULES,
-        mf_dicts=[SUIT_IN_MF, IMP_MF, TWI_MF],
-        inputs=[suitability, imp_frac, twi],
-        rule_input_keys=None,
+    parser.add_argument(
+        "--constraints", action="store_true",
+        help=f"With --top-k, skip cells on buildings or excluded zones ({CONSTRAINTS_PATH})",
     )
-    print(f"  Priority range:  {priority.min():.3f} – {priority.max():.3f}")
-    print(f"  Priority mean:   {priority.mean():.3f}")
-    print(f"  Priority median: {np.median(priority):.3f}")
-    write_raster(PRIORITY_PATH, priority, gt, proj)
-    print(f"  -> {PRIORITY_PATH}")
-
-    # ── ASCII grids for NetLogo (EPSG:26910) ─────────────────────────────────
-    print("\nGenerating ASCII grids for NetLogo (EPSG:26910)...")
-    write_ascii_grid_utm(SUIT_PATH, SUIT_ASC_PATH)
-    write_ascii_grid_utm(PRIORITY_PATH, PRIORITY_ASC_PATH)
-
-    # ── Validation ───────────────────────────────────────────────────────────
-    validate_against_gsi(suitability, priority, gt)
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    print(f"Study area: {area}")
+
+    os.makedirs(os.path.join(data_dir, DERIVED_DIR), exist_ok=True)
+
+    slope_path = os.path.join(data_dir, SLOPE_PATH)
+    twi_path = os.path.join(data_dir, TWI_PATH)
+    impervious_path = os.path.join(data_dir, IMPERVIOUS_PATH)
+    hsg_raster_path = os.path.join(data_dir, HSG_RASTER_PATH)
+    imp_frac_path = os.path.join(data_dir, IMP_FRAC_PATH)
+    suit_path = os.path.join(data_dir, SUIT_PATH)
+    priority_path = os.path.join(data_dir, PRIORITY_PATH)
+    suit_asc_path = os.path.join(data_dir, SUIT_ASC_PATH)
+    priority_asc_path = os.path.join(data_dir, PRIORITY_ASC_PATH)
+    top_candidates_path = os.path.join(data_dir, TOP_CANDIDATES_PATH)
+
+    with run_report(os.path.join(data_dir, DERIVED_DIR), "fis_suitability", area=area):
+        # ── Load reference raster for grid alignment ─────────────────────────────
+        print("Loading slope raster (reference grid)...")
+        with stage("load_slope") as span:
+            slope_ds = gdal.Open(slope_path)
+            slope = slope_ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+            gt = slope_ds.GetGeoTransform()
+            proj = slope_ds.GetProjection()
+            shape = slope.shape
+            slope_ds = None
+            span.record(slope=slope)
+        print(f"  Grid: {shape[1]}x{shape[0]}, pixel={gt[1]}ft")
+        slope_stats = summarize(slope)
+        print(f"  Slope range: {slope_stats.min:.2f} – {slope_stats.max:.2f} degrees")
+
+        # ── Load TWI ─────────────────────────────────────────────────────────────
+        print("Loading TWI...")
+        with stage("load_twi") as span:
+            twi_ds = gdal.Open(twi_path)
+            twi = twi_ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+            twi_ds = None
+            span.record(twi=twi)
+        twi_stats = summarize(twi)
+        print(f"  TWI range: {twi_stats.min:.2f} – {twi_stats.max:.2f}")
+
+        # ── Step 1: Rasterize HSG ────────────────────────────────────────────────
+        with stage("rasterize_hsg") as span:
+            hsg = rasterize_hsg(gt, proj, shape, os.path.join(data_dir, HSG_PATH))
+            span.record(hsg=hsg)
+        with stage("write_hsg"):
+            write_raster(hsg_raster_path, hsg, gt, proj)
+        print(f"  -> {hsg_raster_path}")
+
+        # ── Step 2: Compute impervious neighborhood fraction ─────────────────────
+        print("\nComputing impervious neighborhood fraction (11×11 box mean)...")
+        with stage("load_impervious") as span:
+            imp_ds = gdal.Open(impervious_path)
+            imp_raw = imp_ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+            imp_ds = None
+            span.record(imp_raw=imp_raw)
+        with stage("box_mean") as span:
+            imp_frac = box_mean(imp_raw, 11)
+            span.record(imp_frac=imp_frac)
+        print(f"  Raw impervious: {imp_raw.mean():.3f} mean")
+        print(f"  Fraction: {summarize(imp_frac, lo=0.0, hi=1.0).describe()}")
+        with stage("write_imp_frac"):
+            write_raster(imp_frac_path, imp_frac, gt, proj)
+        print(f"  -> {imp_frac_path}")
+
+        if args.top_k is not None:
+            print(f"\n=== Coarse-to-fine screening for top {args.top_k:,} cells ===")
+            allowed = None
+            if args.constraints:
+                with stage("constraints"):
+                    allowed = feasible(load_flags(data_dir))
+                print(f"  Constraints: {allowed.mean() * 100:.1f}% of cells feasible")
+            with stage("screen_top_candidates", cells=slope.size) as span:
+                cell_ids, priority, suitability = screen_top_candidates(
+                    slope, hsg, imp_frac, twi, args.top_k, allowed=allowed,
+                )
+                span.note(top_k=args.top_k)
+            print(f"  Priority of candidates: {priority.min():.3f} – {priority.max():.3f}")
+            write_candidates(top_candidates_path, cell_ids, priority, suitability, gt, shape)
+            print(f"  -> {top_candidates_path}")
+            flow_index = load_index(data_dir)
+            if flow_index is not None:
+                captured = flow_index.capture(cell_ids)
+                print(f"  Combined catchment of candidates: {captured:,} cells "
+                      f"({captured * abs(gt[1] * gt[5]):,.0f} ft²)")
+            print("\nDone.")
+            return
+
+        # ── Stage 1: Physical Suitability FIS ────────────────────────────────────
+        print("\n=== Stage 1: Physical Suitability (slope × HSG) ===")
+        with stage("fis_stage1") as span:
+            suitability = evaluate_fis(
+                rules=STAGE1_RULES,
+                mf_dicts=[SLOPE_MF, HSG_MF],
+                inputs=[slope, hsg],
+                rule_input_keys=None,
+            )
+            span.record(suitability=suitability)
+        print(f"  Suitability: {summarize(suitability, lo=0.0, hi=1.0).describe()}")
+        with stage("write_suitability"):
+            write_raster(suit_path, suitability, gt, proj)
+        print(f"  -> {suit_path}")
+
+        # ── Stage 2: Capture Priority FIS ────────────────────────────────────────
+        print("\n=== Stage 2: Capture Priority (suitability × impervious × TWI) ===")
+        with stage("fis_stage2") as span:
+            priority = evaluate_fis(
+                rules=STAGE2_RULES,
+                mf_dicts=[SUIT_IN_MF, IMP_MF, TWI_MF],
+                inputs=[suitability, imp_frac, twi],
+                rule_input_keys=None,
+            )
+            span.record(priority=priority)
+        print(f"  Priority: {summarize(priority, lo=0.0, hi=1.0).describe()}")
+        with stage("write_priority"):
+            write_raster(priority_path, priority, gt, proj)
+        print(f"  -> {priority_path}")
+
+        # ── ASCII grids for NetLogo (EPSG:26910) ─────────────────────────────────
+        print("\nGenerating ASCII grids for NetLogo (EPSG:26910)...")
+        with stage("ascii_grids"):
+            write_ascii_grid_utm(suit_path, suit_asc_path)
+            write_ascii_grid_utm(priority_path, priority_asc_path)
+
+        # ── Validation ───────────────────────────────────────────────────────────
+        with stage("validation"):
+            validate_against_gsi(suitability, priority, gt)
 
     print("\nDone.")
 
@@ -0,0 +1,205 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal"]
+# ///
+# ABOUTME: Euler-tour (DFS preorder) index of the D8 forest: every cell's upstream area is
+# ABOUTME: one contiguous range, so upstream sums are prefix-sum lookups. Built once, saved.
+
+import argparse
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from calc_flow import accumulate_weights, downstream_index, weight_stack
+from instrument import run_report, stage
+from study_area import add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+FLOW_DIR_PATH = os.path.join("derived", "flow_direction.tif")
+INDEX_PATH = os.path.join("derived", "flow_index.npz")
+
+
+# ─── Preorder ────────────────────────────────────────────────────────────────
+
+def subtree_sizes(flow_dir):
+    """Cells in each cell's upstream tree, itself included (= flow accumulation)."""
+    return accumulate_weights(flow_dir, np.ones((1, *flow_dir.shape)))[0].astype(np.int64)
+
+
+def preorder(receiver, size):
+    """DFS preorder position of every cell in the D8 forest.
+
+    Children of a cell are numbered after it in cell order, each child's block
+    being as long as its subtree, so a cell's position is the sum, along its
+    path to the outlet, of 1 + the sizes of its earlier siblings, plus its
+    tree's start. That path sum is taken by pointer doubling, O(n log depth)
+    in whole-array steps, like catchments.label_outlets().
+    """
+    n = receiver.size
+    offset = np.empty(n, dtype=np.int64)
+
+    # Trees, one per outlet, laid end to end in cell order
+    roots = np.flatnonzero(receiver < 0)
+    offset[roots] = np.cumsum(size[roots]) - size[roots]
+
+    # Children grouped by parent: 1 + total size of earlier siblings
+    children = np.flatnonzero(receiver >= 0)
+    children = children[np.argsort(receiver[children], kind="stable")]
+    before = np.cumsum(size[children]) - size[children]
+    parents = receiver[children]
+    first = np.r_[True, parents[1:] != parents[:-1]]
+    offset[children] = 1 + before - before[first][np.cumsum(first) - 1]
+
+    pointer = receiver.copy()
+    active = children
+    while active.size:
+        up = pointer[active]
+        offset[active] += offset[up]
+        pointer[active] = pointer[up]
+        active = active[pointer[active] >= 0]
+    return offset
+
+
+# ─── Index ───────────────────────────────────────────────────────────────────
+
+class FlowIndex:
+    """Cells in Euler-tour order with prefix sums of per-cell weights.
+
+    The cells upstream of `cell` (itself included) are
+    order[start[cell]:start[cell] + size[cell]], so any weighted upstream sum
+    is prefix[name][end] - prefix[name][start].
+    """
+
+    def __init__(self, start, size, prefix, shape):
+        self.start = start
+        self.size = size
+        self.end = start + size
+        self.prefix = prefix
+        self.shape = tuple(shape)
+        self._order = None
+
+    @classmethod
+    def build(cls, flow_dir, weights=None):
+        """Index a D8 grid; weights: {name: per-cell array} to keep prefix sums of."""
+        receiver = downstream_index(flow_dir)
+        size = subtree_sizes(flow_dir).ravel()
+        start = preorder(receiver, size)
+        index = cls(start, size, {}, flow_dir.shape)
+        for name, weight in (weights or {}).items():
+            index.add_weight(name, weight)
+        return index
+
+    @property
+    def order(self):
+        """Flat cell index at each preorder position."""
+        if self._order is None:
+            self._order = np.empty_like(self.start)
+            self._order[self.start] = np.arange(self.start.size)
+        return self._order
+
+    def add_weight(self, name, weight):
+        values = np.asarray(weight, dtype=np.float64).ravel()[self.order]
+        self.prefix[name] = np.concatenate([[0.0], np.cumsum(values)])
+
+    def upstream_sum(self, cells, name=None):
+        """Upstream total of a weight (cell count if name is None) for each cell."""
+        cells = np.asarray(cells)
+        if name is None:
+            return self.size[cells]
+        prefix = self.prefix[name]
+        return prefix[self.end[cells]] - prefix[self.start[cells]]
+
+    def union(self, cells):
+        """Disjoint preorder ranges covering the upstream areas of a set of cells.
+
+        Upstream ranges are nested or disjoint, so after sorting by start a
+        range is redundant exactly when it begins before the furthest end seen
+        so far. O(k log k) for k cells. Returns (starts, ends).
+        """
+        cells = np.unique(np.asarray(cells, dtype=np.int64))
+        if cells.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        starts, ends = self.start[cells], self.end[cells]
+        by_start = np.argsort(starts, kind="stable")
+        starts, ends = starts[by_start], ends[by_start]
+        reach = np.r_[-1, np.maximum.accumulate(ends)[:-1]]
+        keep = starts >= reach
+        return starts[keep], ends[keep]
+
+    def capture(self, cells, name=None):
+        """Combined upstream total of a set of cells, nested ones counted once."""
+        starts, ends = self.union(cells)
+        if name is None:
+            return int((ends - starts).sum())
+        prefix = self.prefix[name]
+        return float((prefix[ends] - prefix[starts]).sum())
+
+    def capture_mask(self, cells):
+        """Boolean grid of every cell draining to any of `cells`."""
+        mask = np.zeros(self.start.size, dtype=bool)
+        for s, e in zip(*self.union(cells)):
+            mask[self.order[s:e]] = True
+        return mask.reshape(self.shape)
+
+    def save(self, path):
+        np.savez(path, start=self.start, size=self.size, shape=np.array(self.shape),
+                 **{f"prefix_{name}": p for name, p in self.prefix.items()})
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        prefix = {key[len("prefix_"):]: data[key] for key in data.files
+                  if key.startswith("prefix_")}
+        return cls(data["start"], data["size"], prefix, data["shape"])
+
+
+def load_index(data_dir):
+    """The saved index of an area, or None if it is missing or older than flow_dir."""
+    path = os.path.join(data_dir, INDEX_PATH)
+    flow_path = os.path.join(data_dir, FLOW_DIR_PATH)
+    if not os.path.exists(path):
+        return None
+    if os.path.exists(flow_path) and os.path.getmtime(path) < os.path.getmtime(flow_path):
+        return None
+    return FlowIndex.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Euler-tour upstream index.")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+
+    ds = gdal.Open(os.path.join(data_dir, FLOW_DIR_PATH))
+    flow_dir = ds.GetRasterBand(1).ReadAsArray().astype(np.int8)
+    gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+    ds = None
+    print(f"Flow index ({area}): {flow_dir.shape[1]}x{flow_dir.shape[0]} cells")
+
+    with run_report(os.path.join(data_dir, "derived"), "flow_index", area=area):
+        with stage("weight_stack") as span:
+            names, weights = weight_stack(data_dir, gt, proj, flow_dir.shape, gt[1])
+            span.record(weights=weights)
+        with stage("build_index", cells=flow_dir.size) as span:
+            # The cell count is the subtree size itself; keep prefix sums of the rest
+            index = FlowIndex.build(flow_dir, {name: weights[i] for i, name in enumerate(names)
+                                               if name != "cells"})
+            span.record(start=index.start, size=index.size)
+            span.note(weights=list(index.prefix))
+        print(f"  Largest upstream area: {int(index.size.max()):,} cells; "
+              f"weights: {', '.join(index.prefix) or 'none'}")
+
+        path = os.path.join(data_dir, INDEX_PATH)
+        with stage("save"):
+            index.save(path)
+        print(f"  -> {path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
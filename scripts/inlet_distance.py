@@ -0,0 +1,148 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Distance from every cell to the nearest storm inlet (or storm node) and that
+# ABOUTME: feature's ID, from one Euclidean distance transform of the burned points.
+
+import argparse
+import os
+
+import numpy as np
+from osgeo import gdal, ogr
+from scipy import ndimage
+
+from instrument import run_report, stage
+from rasterize import write_raster
+from study_area import add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+REFERENCE_PATH = os.path.join("dem", "study_area_dem.tif")
+# Point layers: name → (source, distance raster, ID raster)
+POINT_LAYERS = {
+    "inlet": (os.path.join("sewer", "inlets.geojson"),
+              os.path.join("derived", "inlet_distance.tif"),
+              os.path.join("derived", "inlet_id.tif")),
+    "storm_node": (os.path.join("sewer", "storm_nodes.geojson"),
+                   os.path.join("derived", "storm_node_distance.tif"),
+                   os.path.join("derived", "storm_node_id.tif")),
+}
+# Identifier written to the ID rasters, first one present, so cells join back
+# to the city's records; feature ID + 1 (row number) if none is usable
+ID_FIELDS = ["OBJECTID", "OBJECT_ID", "UNITID", "ID"]
+
+
+def load_points(path):
+    """Point (or centroid) coordinates and IDs of a layer, and the ID field used.
+
+    IDs come from the first of ID_FIELDS whose values are all positive
+    integers (0 is the rasters' nodata); otherwise they are feature IDs + 1
+    and the field is None.
+    """
+    ds = ogr.Open(path)
+    layer = ds.GetLayer()
+    defn = layer.GetLayerDefn()
+    names = {defn.GetFieldDefn(i).GetName().upper(): defn.GetFieldDefn(i).GetName()
+             for i in range(defn.GetFieldCount())}
+    fields = [names[f] for f in ID_FIELDS if f in names]
+    xs, ys, fids, values = [], [], [], {f: [] for f in fields}
+    for feat in layer:
+        geom = feat.GetGeometryRef()
+        if geom is None:
+            continue
+        point = geom.Centroid()
+        xs.append(point.GetX())
+        ys.append(point.GetY())
+        fids.append(feat.GetFID() + 1)
+        for f in fields:
+            values[f].append(feat.GetField(f))
+    ds = None
+    for f in fields:
+        try:
+            ids = np.array([int(v) for v in values[f]], dtype=np.int64)
+        except (TypeError, ValueError):
+            continue
+        if (ids > 0).all() and (ids <= np.iinfo(np.int32).max).all():
+            return np.array(xs), np.array(ys), ids.astype(np.int32), f
+    return np.array(xs), np.array(ys), np.array(fids, dtype=np.int32), None
+
+
+def nearest_point(xs, ys, ids, gt, shape):
+    """Distance (ft) to the nearest point and its ID for every cell.
+
+    The points are burned onto the grid (the first point wins a shared cell)
+    and one exact EDT with return_indices finds each cell's nearest burned
+    cell. The distance is then measured from the cell center to that point's
+    true location; where two points are nearly equidistant the grid may pick
+    the farther one, by less than a cell width. Cells get ID 0 and distance
+    inf if no point falls on the grid.
+    """
+    rows, cols = shape
+    col = np.floor((xs - gt[0]) / gt[1]).astype(np.int64)
+    row = np.floor((ys - gt[3]) / gt[5]).astype(np.int64)
+    inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+    if not inside.any():
+        return np.full(shape, np.inf, dtype=np.float32), np.zeros(shape, dtype=np.int32)
+
+    # Index of the point owning each burned cell (reverse order: first point wins)
+    owner = np.full(shape, -1, dtype=np.int64)
+    k = np.flatnonzero(inside)[::-1]
+    owner[row[k], col[k]] = k
+
+    near_r, near_c = ndimage.distance_transform_edt(
+        owner < 0, sampling=(abs(gt[5]), gt[1]), return_distances=False, return_indices=True)
+    nearest = owner[near_r, near_c]
+    del near_r, near_c
+
+    r, c = np.indices(shape, sparse=True)
+    cx = gt[0] + (c + 0.5) * gt[1]
+    cy = gt[3] + (r + 0.5) * gt[5]
+    dist = np.hypot(cx - xs[nearest], cy - ys[nearest]).astype(np.float32)
+    return dist, ids[nearest]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distance to and ID of the nearest inlet.")
+    parser.add_argument("--storm-nodes", action="store_true",
+                        help="Also build distance/ID rasters for sewer storm nodes")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+
+    ds = gdal.Open(os.path.join(data_dir, REFERENCE_PATH))
+    gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+    shape = (ds.RasterYSize, ds.RasterXSize)
+    ds = None
+    print(f"Nearest-point rasters ({area}): {shape[1]}x{shape[0]} cells")
+
+    names = ["inlet", "storm_node"] if args.storm_nodes else ["inlet"]
+    with run_report(os.path.join(data_dir, "derived"), "inlet_distance", area=area):
+        for name in names:
+            src, dist_rel, id_rel = POINT_LAYERS[name]
+            src_path = os.path.join(data_dir, src)
+            if not os.path.exists(src_path):
+                print(f"  {name}: {src} not fetched, skipping")
+                continue
+            xs, ys, ids, id_field = load_points(src_path)
+            with stage(name, cells=shape[0] * shape[1]) as span:
+                dist, nearest_id = nearest_point(xs, ys, ids, gt, shape)
+                span.record(dist=dist, nearest_id=nearest_id)
+                span.note(points=len(ids))
+            dist_path = os.path.join(data_dir, dist_rel)
+            id_path = os.path.join(data_dir, id_rel)
+            write_raster(dist_path, dist, gt, proj)
+            write_raster(id_path, nearest_id, gt, proj, gdal.GDT_Int32, nodata=0)
+            print(f"  {name}: {len(ids):,} points ({id_field or 'feature ID + 1'} IDs), "
+                  f"distance {summarize(dist).describe('.0f')} ft")
+            print(f"  -> {dist_path}")
+            print(f"  -> {id_path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# ABOUTME: Nested stage spans with wall/CPU time, peak RSS, array sizes and throughput,
+# ABOUTME: written as a JSON-lines run report next to each script's outputs.
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+REPORT_NAME = "run_report.jsonl"
+
+# Set BASALT_PROFILE_MS to sample the main thread's stack every N milliseconds;
+# each span then reports the functions it spent most samples in.
+PROFILE_ENV = "BASALT_PROFILE_MS"
+PROFILE_TOP = 10
+
+_run = None
+_stack = []
+# Guards _stack against the sampler thread reading it mid push/pop
+_stack_lock = threading.Lock()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+class Span:
+    """One timed stage. Use through stage(), not directly."""
+
+    def __init__(self, name, cells=None):
+        self.name = name
+        self.path = "/".join([s.name for s in _stack] + [name])
+        self.cells = cells
+        self.arrays = {}
+        self.samples = Counter()
+        self.fields = {}
+
+    def record(self, **arrays):
+        """Record the shape, dtype and size of numpy arrays produced by this stage."""
+        for name, array in arrays.items():
+            self.arrays[name] = {
+                "shape": list(array.shape),
+                "dtype": str(array.dtype),
+                "mb": round(array.nbytes / 1e6, 2),
+            }
+            if self.cells is None:
+                self.cells = int(array.size)
+
+    def note(self, **fields):
+        """Attach extra JSON-serialisable values to the span record."""
+        self.fields.update(fields)
+
+
+class Sampler(threading.Thread):
+    """Samples the main thread's innermost frame into the active span."""
+
+    def __init__(self, interval_s):
+        super().__init__(daemon=True)
+        self.interval_s = interval_s
+        self.main_id = threading.main_thread().ident
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval_s):
+            frame = sys._current_frames().get(self.main_id)
+            if frame is None:
+                continue
+            code = frame.f_code
+            where = f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+            with _stack_lock:
+                if _stack:
+                    _stack[-1].samples[where] += 1
+
+
+def _write(record):
+    if _run is None:
+        return
+    _run["file"].write(json.dumps(record) + "\n")
+    _run["file"].flush()
+
+
+@contextmanager
+def run_report(out_dir, script, **fields):
+    """Collect the spans of one script run into out_dir/run_report.jsonl.
+
+    Reports append, so successive runs can be charted against each other.
+    """
+    global _run
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, REPORT_NAME)
+    run_id = uuid.uuid4().hex[:12]
+    sampler = None
+    if os.environ.get(PROFILE_ENV):
+        sampler = Sampler(float(os.environ[PROFILE_ENV]) / 1000)
+        sampler.start()
+
+    with open(path, "a") as f:
+        _run = {"file": f, "run_id": run_id, "script": script}
+        _write({
+            "type": "run_start",
+            "run_id": run_id,
+            "script": script,
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "argv": sys.argv[1:],
+            **fields,
+        })
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        status = "ok"
+        try:
+            with stage(script):
+                yield
+        except BaseException as exc:
+            status = "".join(traceback.format_exception_only(type(exc), exc)).strip()
+            raise
+        finally:
+            _write({
+                "type": "run_end",
+                "run_id": run_id,
+                "script": script,
+                "status": status,
+                "wall_s": round(time.perf_counter() - wall0, 4),
+                "cpu_s": round(time.process_time() - cpu0, 4),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            })
+            if sampler is not None:
+                sampler.stopped.set()
+            _run = None
+
+
+@contextmanager
+def stage(name, cells=None):
+    """Time a (possibly nested) pipeline stage.
+
+    Yields a Span; call span.record(array=...) to log output array sizes
+    (the first one also sets the cell count for cells/sec throughput).
+    """
+    span = Span(name, cells)
+    with _stack_lock:
+        _stack.append(span)
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    try:
+        yield span
+    finally:
+        wall = time.perf_counter() - wall0
+        cpu = time.process_time() - cpu0
+        with _stack_lock:
+            _stack.pop()
+        record = {
+            "type": "span",
+            "run_id": _run["run_id"] if _run else None,
+            "script": _run["script"] if _run else None,
+            "stage": span.path,
+            "depth": len(_stack),
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        if span.cells is not None:
+            record["cells"] = span.cells
+            record["cells_per_s"] = round(span.cells / wall, 1) if wall > 0 else None
+        if span.arrays:
+            record["arrays"] = span.arrays
+        if span.samples:
+            record["samples"] = dict(span.samples.most_common(PROFILE_TOP))
+        record.update(span.fields)
+        _write(record)
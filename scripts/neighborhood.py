@@ -0,0 +1,151 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Multi-scale neighborhood statistics: box means from one integral image per
+# ABOUTME: layer, plus optional Gaussian-weighted means, written as aligned GeoTIFFs.
+
+import argparse
+import os
+
+import numpy as np
+from osgeo import gdal
+from scipy import ndimage
+
+from instrument import run_report, stage
+from rasterize import write_raster
+from study_area import add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+
+gdal.UseExceptions()
+
+# Window sizes in cells (15/33/63/123 ft at 3 ft); 11 is the FIS impervious window
+DEFAULT_SIZES = [5, 11, 21, 41]
+# Gaussian windows span ±3 sigma
+GAUSS_TRUNCATE = 3.0
+
+# Paths relative to the area data directory
+LAYERS = {
+    "impervious": os.path.join("impervious", "impervious.tif"),
+    "building_coverage": os.path.join("derived", "grids", "building_coverage.tif"),
+}
+OUTPUT_DIR = os.path.join("derived", "neighborhood")
+
+
+def integral_image(arr):
+    """Summed area table with one leading row/col of zeros (float64)."""
+    rows, cols = arr.shape
+    sat = np.zeros((rows + 1, cols + 1), dtype=np.float64)
+    np.cumsum(arr, axis=0, dtype=np.float64, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def window_bounds(n, k):
+    """Clamped [start, stop) of the k-wide window centred on each index."""
+    half = k // 2
+    i = np.arange(n)
+    return np.clip(i - half, 0, n - 1), np.clip(i + half, 0, n - 1) + 1
+
+
+def box_mean_from_sat(sat, k):
+    """k×k box mean from a summed area table, clamping windows at the edges.
+
+    The four-corner lookup is done as two separable 1-D gathers (rows, then
+    columns) instead of four 2-D fancy-index gathers.
+    """
+    rows, cols = sat.shape[0] - 1, sat.shape[1] - 1
+    r1, r2 = window_bounds(rows, k)
+    c1, c2 = window_bounds(cols, k)
+    strips = sat[r2] - sat[r1]                    # column sums over each row window
+    box_sum = strips[:, c2] - strips[:, c1]
+    box_count = np.outer(r2 - r1, c2 - c1)
+    return box_sum / box_count
+
+
+def box_mean(arr, k):
+    """Compute k×k box mean using integral image (summed area table).
+
+    Handles edges by clamping to array bounds.
+    """
+    return box_mean_from_sat(integral_image(arr), k)
+
+
+def gaussian_mean(arr, k):
+    """Gaussian-weighted mean over a k-cell window (sigma = k/6).
+
+    Normalized by the weight that falls inside the grid, so edge cells are
+    averages of real cells only, like the clamped box mean.
+    """
+    sigma = k / (2 * GAUSS_TRUNCATE)
+    arr = arr.astype(np.float64)
+    smooth, weight = arr, np.ones_like(arr)
+    for axis in (0, 1):
+        smooth = ndimage.gaussian_filter1d(smooth, sigma, axis=axis, mode="constant",
+                                           truncate=GAUSS_TRUNCATE)
+        weight = ndimage.gaussian_filter1d(weight, sigma, axis=axis, mode="constant",
+                                           truncate=GAUSS_TRUNCATE)
+    return smooth / weight
+
+
+def neighborhood_stats(layers, sizes=DEFAULT_SIZES, gaussian=False):
+    """Box (and optionally Gaussian) means of every layer at every window size.
+
+    layers maps name → 2-D array. Builds one integral image per layer and
+    reuses it for all sizes. Returns {f"{name}_box{k}" / f"{name}_gauss{k}": float32}.
+    """
+    out = {}
+    for name, arr in layers.items():
+        sat = integral_image(arr)
+        for k in sizes:
+            out[f"{name}_box{k}"] = box_mean_from_sat(sat, k).astype(np.float32)
+        sat = None  # free before the Gaussian pass
+        if gaussian:
+            for k in sizes:
+                out[f"{name}_gauss{k}"] = gaussian_mean(arr, k).astype(np.float32)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-scale neighborhood means of input layers.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help=f"Window sizes in cells (default: {DEFAULT_SIZES})")
+    parser.add_argument("--layers", nargs="+", choices=sorted(LAYERS), default=sorted(LAYERS),
+                        help="Layers to summarize (default: all that exist)")
+    parser.add_argument("--gaussian", action="store_true",
+                        help="Also write Gaussian-weighted means")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    out_dir = os.path.join(data_dir, OUTPUT_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with run_report(out_dir, "neighborhood", area=area):
+        layers = {}
+        gt = proj = None
+        for name in args.layers:
+            path = os.path.join(data_dir, LAYERS[name])
+            if not os.path.exists(path):
+                print(f"  {name}: {LAYERS[name]} missing, skipping")
+                continue
+            ds = gdal.Open(path)
+            layers[name] = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+            gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+            ds = None
+
+        print(f"Neighborhood means ({area}) at {args.sizes} cells...")
+        with stage("neighborhood_stats", cells=sum(a.size for a in layers.values())) as span:
+            stats = neighborhood_stats(layers, args.sizes, args.gaussian)
+            span.note(layers=sorted(layers), sizes=args.sizes, gaussian=args.gaussian)
+
+        for key, array in stats.items():
+            path = os.path.join(out_dir, f"{key}.tif")
+            write_raster(path, array, gt, proj)
+            print(f"  {key}: {summarize(array).describe()}  -> {path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal"]
+# ///
+# ABOUTME: Compact columnar trace of simulate.py runs (particle moves as D8 step codes, fates,
+# ABOUTME: bioswale fill), chunked and compressed; replays it into heatmaps and time series.
+
+import argparse
+import csv
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+from calc_flow import D8_OFFSETS
+from rasterize import write_raster
+from study_area import add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+TRACE_DIR = os.path.join("derived", "simulation", "trace")
+REFERENCE_PATH = os.path.join("derived", "flow_direction.tif")
+
+CHUNK_TICKS = 256
+STAY = len(D8_OFFSETS)  # step code of a particle that did not move
+# Fate codes of particles that leave the simulation
+ESCAPED, CAPTURED = 0, 1
+# Column dtypes; deflate level 1 keeps compression off the simulation's critical path
+COLUMNS = {"births": np.int32, "steps": np.uint8, "ends": np.uint32, "fates": np.uint8}
+COMPRESS_LEVEL = 1
+
+
+def step_deltas(cols):
+    """Flat-index delta of each step code (D8 order, then STAY)."""
+    return np.array([dr * cols + dc for dr, dc in D8_OFFSETS] + [0], dtype=np.int64)
+
+
+class TraceWriter:
+    """Records a Simulation tick by tick into chunk_NNNNN.npz files in a directory.
+
+    Particles are kept in the simulation's own order (survivors keep their
+    order, rain is appended), so per tick the trace needs only:
+      births   flat cells of new particles (int32)
+      steps    one uint8 D8 code per particle alive before the move (delta of
+               its cell index; STAY if it did not move)
+      ends     positions, in that order, of the particles that left, as
+               uint32 gaps from the previous one, plus their fate (uint8)
+      volume   bioswale fill after infiltration (float32)
+    Columns are concatenated over CHUNK_TICKS ticks and deflated together,
+    on a background thread while the simulation continues. Each chunk is an
+    ordinary .npz archive. Chunks of an earlier trace in the directory are
+    removed; close() records the chunk and tick counts in meta.json, so a
+    trace that was not closed cannot be replayed.
+    """
+
+    def __init__(self, path, shape, bioswale_cells, chunk_ticks=CHUNK_TICKS, **meta):
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith("chunk_") or name == "meta.json":
+                os.remove(os.path.join(path, name))
+        self.path = path
+        self.chunk_ticks = chunk_ticks
+        # Step code by delta + cols + 1 (deltas span -cols-1 .. cols+1)
+        self._code = np.full(2 * shape[1] + 3, STAY, dtype=np.uint8)
+        self._code[step_deltas(shape[1]) + shape[1] + 1] = np.arange(STAY + 1)
+        self._offset = shape[1] + 1
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        self.chunks = 0
+        self.ticks = 0
+        self._reset()
+        self.meta = {"shape": list(shape), "bioswale_cells": np.asarray(bioswale_cells).tolist(),
+                     "chunk_ticks": chunk_ticks, **meta}
+
+    def _reset(self):
+        self.columns = {name: [] for name in [*COLUMNS, "volume"]}
+        self.counts = []
+        self.births = 0
+
+    def rain(self, cells):
+        self.columns["births"].append(np.asarray(cells, dtype=np.int32))
+        self.births += len(cells)
+
+    def tick(self, before, after, ended, fates, volume):
+        """before/after: cells of every particle at the start of the tick and
+        after moving; ended: positions of those that left; fates: their codes."""
+        codes = self._code[after - before + self._offset]
+        gaps = np.diff(ended, prepend=0).astype(np.uint32)
+        self.counts.append((self.births, codes.size, ended.size))
+        self.births = 0
+        self.ticks += 1
+        self.columns["steps"].append(codes)
+        self.columns["ends"].append(gaps)
+        self.columns["fates"].append(np.asarray(fates, dtype=np.uint8))
+        self.columns["volume"].append(np.asarray(volume, dtype=np.float32))
+        if len(self.counts) == self.chunk_ticks:
+            self.flush()
+
+    def flush(self):
+        if not self.counts:
+            return
+        data = {name: np.concatenate(self.columns[name] or [np.empty(0, dtype)])
+                for name, dtype in COLUMNS.items()}
+        data["volume"] = np.stack(self.columns["volume"])
+        data["counts"] = np.array(self.counts, dtype=np.int64)
+        path = os.path.join(self.path, f"chunk_{self.chunks:05d}.npz")
+        self._pending.append(self._pool.submit(write_chunk, path, data))
+        self.chunks += 1
+        self._reset()
+
+    def close(self):
+        """Flush the last chunk and wait for every write; re-raises a failure."""
+        self.flush()
+        for future in self._pending:
+            future.result()
+        self._pending = []
+        self._pool.shutdown()
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({**self.meta, "chunks": self.chunks, "ticks": self.ticks}, f)
+
+
+def write_chunk(path, data):
+    """Write arrays as an .npz archive (np.load reads it) at a low deflate level."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as zf:
+        for name, array in data.items():
+            with zf.open(f"{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(array))
+
+
+class TraceReader:
+    """Replays a trace tick by tick without re-simulating.
+
+    Raises ValueError if the trace was not closed or its chunks do not match
+    the counts in meta.json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise ValueError(f"{path}: no meta.json (trace missing or not closed)")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta["shape"])
+        self.bioswale_cells = np.array(self.meta["bioswale_cells"], dtype=np.int64)
+        self.deltas = step_deltas(self.shape[1])
+        self.chunk_files = [f"chunk_{k:05d}.npz" for k in range(self.meta["chunks"])]
+        found = sorted(name for name in os.listdir(path) if name.startswith("chunk_"))
+        if found != self.chunk_files:
+            raise ValueError(f"{path}: expected {len(self.chunk_files)} chunk(s) per meta.json, "
+                             f"found {len(found)}")
+
+    def ticks(self):
+        """Yield (positions after the move, ended positions, fates, volume) per tick.
+
+        Positions are flat cells; ended positions index into them.
+        """
+        position = np.empty(0, dtype=np.int64)
+        replayed = 0
+        for name in self.chunk_files:
+            data = np.load(os.path.join(self.path, name))
+            births, steps, ends, fates = (data[k] for k in ("births", "steps", "ends", "fates"))
+            b = s = e = 0
+            for k, (n_births, n_alive, n_ends) in enumerate(data["counts"]):
+                position = np.concatenate([position, births[b:b + n_births]])
+                b += n_births
+                moved = position + self.deltas[steps[s:s + n_alive]]
+                s += n_alive
+                ended = np.cumsum(ends[e:e + n_ends], dtype=np.int64)
+                yield moved, ended, fates[e:e + n_ends], data["volume"][k]
+                e += n_ends
+                keep = np.ones(moved.size, dtype=bool)
+                keep[ended] = False
+                position = moved[keep]
+                replayed += 1
+        if replayed != self.meta["ticks"]:
+            raise ValueError(f"{self.path}: replayed {replayed} ticks, "
+                             f"meta.json records {self.meta['ticks']}")
+
+    def aggregate(self):
+        """Per-cell traffic (particle-ticks after moving) and per-bioswale series.
+
+        Returns (traffic (rows, cols) int64, captures (ticks, bioswales),
+        volume (ticks, bioswales)).
+        """
+        traffic = np.zeros(self.shape[0] * self.shape[1], dtype=np.int64)
+        swale_of = np.full(traffic.size, -1, dtype=np.int64)
+        swale_of[self.bioswale_cells] = np.arange(len(self.bioswale_cells))
+        captures, volumes = [], []
+        for moved, ended, fates, volume in self.ticks():
+            traffic += np.bincount(moved, minlength=traffic.size)
+            taken = swale_of[moved[ended[fates == CAPTURED]]]
+            captures.append(np.bincount(taken, minlength=len(self.bioswale_cells)))
+            volumes.append(volume)
+        n = len(self.bioswale_cells)
+        return (traffic.reshape(self.shape),
+                np.array(captures).reshape(-1, n), np.array(volumes).reshape(-1, n))
+
+
+def write_timeseries(path, captures, volume):
+    """One row per tick and bioswale: captures that tick and fill after it."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["tick", "bioswale", "captures", "volume"])
+        for t in range(captures.shape[0]):
+            for b in range(captures.shape[1]):
+                writer.writerow([t, b, int(captures[t, b]), round(float(volume[t, b]), 3)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a simulation trace into heatmaps.")
+    parser.add_argument("trace", nargs="?",
+                        help=f"Trace directory (default: the area's {TRACE_DIR}/seed_0)")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    trace_dir = args.trace or os.path.join(data_dir, TRACE_DIR, "seed_0")
+
+    reader = TraceReader(trace_dir)
+    print(f"Replaying {trace_dir}: {len(reader.chunk_files)} chunk(s), "
+          f"{len(reader.bioswale_cells)} bioswales")
+    traffic, captures, volume = reader.aggregate()
+    print(f"  {captures.shape[0]} ticks, {int(traffic.sum()):,} particle-steps, "
+          f"{int(captures.sum()):,} captures")
+
+    ds = gdal.Open(os.path.join(data_dir, REFERENCE_PATH))
+    gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+    ds = None
+    traffic_path = os.path.join(trace_dir, "traffic.tif")
+    series_path = os.path.join(trace_dir, "bioswale_timeseries.csv")
+    write_raster(traffic_path, traffic.astype(np.int32), gt, proj, gdal.GDT_Int32)
+    write_timeseries(series_path, captures, volume)
+    print(f"  -> {traffic_path}")
+    print(f"  -> {series_path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
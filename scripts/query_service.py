@@ -0,0 +1,367 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal"]
+# ///
+# ABOUTME: Local HTTP/CLI query service over the derived FIS and flow layers: point
+# ABOUTME: samples, bbox top-k sites and upstream/capture areas, from memory-mapped arrays.
+
+import argparse
+import json
+import math
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from osgeo import gdal, osr
+
+from flow_index import load_index
+from study_area import TARGET_CRS, add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Layers served, relative to the area data directory (all on the DEM grid)
+LAYERS = {
+    "priority": os.path.join("derived", "fis_priority.tif"),
+    "suitability": os.path.join("derived", "fis_suitability.tif"),
+    "slope_deg": os.path.join("derived", "slope.tif"),
+    "twi": os.path.join("derived", "twi.tif"),
+    "flow_accum": os.path.join("derived", "flow_accumulation.tif"),
+    "impervious_frac": os.path.join("derived", "impervious_fraction.tif"),
+    "hsg": os.path.join("derived", "hsg_raster.tif"),
+    "catchment_id": os.path.join("derived", "catchment_id.tif"),
+    "inlet_dist_ft": os.path.join("derived", "inlet_distance.tif"),
+    "inlet_id": os.path.join("derived", "inlet_id.tif"),
+    "impervious": os.path.join("impervious", "impervious.tif"),
+    "flow_dir": os.path.join("derived", "flow_direction.tif"),
+}
+# Multi-band layers: every band is served under its band description
+BAND_LAYERS = {
+    "upstream": os.path.join("derived", "weighted_accumulation.tif"),
+}
+CACHE_DIR = os.path.join("derived", "query_cache")
+
+# Top-k index block size in cells (96 ft at 3 ft)
+INDEX_BLOCK = 32
+DEFAULT_PORT = 8765
+
+
+# ─── Cache ───────────────────────────────────────────────────────────────────
+
+def build_cache(data_dir):
+    """Convert the derived rasters to .npy files once; reuse until a source changes.
+
+    Layers whose source raster has been removed are dropped from the cache.
+
+    Returns the cache metadata (geotransform, projection, shape, layer → .npy path).
+    """
+    cache_dir = os.path.join(data_dir, CACHE_DIR)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    meta = {"layers": {}, "sources": {}, "source_layers": {}}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            cached = json.load(f)
+        if "source_layers" in cached:
+            meta = cached
+
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = [(name, path, None) for name, path in LAYERS.items()]
+    sources += [(name, path, "bands") for name, path in BAND_LAYERS.items()]
+    changed = False
+    for name, rel_path, kind in sources:
+        path = os.path.join(data_dir, rel_path)
+        exists = os.path.exists(path)
+        if exists and meta["sources"].get(rel_path) == os.path.getmtime(path):
+            continue
+        # Source gone or changed: its old layers (and bands) are never served again
+        for layer in meta["source_layers"].pop(rel_path, []):
+            npy = meta["layers"].pop(layer, None)
+            if npy is not None and os.path.exists(npy):
+                os.remove(npy)
+        changed |= meta["sources"].pop(rel_path, None) is not None
+        if not exists:
+            continue
+        mtime = os.path.getmtime(path)
+        ds = gdal.Open(path)
+        meta["gt"] = list(ds.GetGeoTransform())
+        meta["shape"] = [ds.RasterYSize, ds.RasterXSize]
+        meta["proj"] = ds.GetProjection()
+        for b in range(1, ds.RasterCount + 1):
+            band = ds.GetRasterBand(b)
+            layer = name if kind is None else f"{name}_{band.GetDescription() or b}"
+            npy = os.path.join(cache_dir, f"{layer}.npy")
+            np.save(npy, band.ReadAsArray())
+            meta["layers"][layer] = npy
+            meta["source_layers"].setdefault(rel_path, []).append(layer)
+        ds = None
+        meta["sources"][rel_path] = mtime
+        changed = True
+
+    if changed:
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+    return meta
+
+
+def build_priority_index(priority, block):
+    """Cells grouped by block, each block sorted by priority (descending).
+
+    Returns (order, block_start, block_max): order holds flat cell indices,
+    block b's cells are order[block_start[b]:block_start[b + 1]].
+    """
+    rows, cols = priority.shape
+    r, c = np.divmod(np.arange(priority.size), cols)
+    block_cols = -(-cols // block)
+    block_id = (r // block) * block_cols + c // block
+    values = np.asarray(priority).ravel()
+    # Primary key block id, secondary key priority descending
+    order = np.lexsort((-values, block_id))
+    n_blocks = (-(-rows // block)) * block_cols
+    block_start = np.searchsorted(block_id[order], np.arange(n_blocks + 1))
+    block_max = values[order[block_start[:-1]]]  # first cell of each block is its max
+    return order.astype(np.int64), block_start, block_max
+
+
+# ─── Service ─────────────────────────────────────────────────────────────────
+
+class QueryService:
+    """Warm, in-process query state: memory-mapped layers and the top-k index."""
+
+    def __init__(self, data_dir):
+        meta = build_cache(data_dir)
+        if "priority" not in meta["layers"]:
+            raise FileNotFoundError("no derived/fis_priority.tif; run fis_suitability.py first")
+        self.gt = meta["gt"]
+        self.shape = tuple(meta["shape"])
+        self.cell_area = abs(self.gt[1] * self.gt[5])
+        self.layers = {name: np.load(path, mmap_mode="r")
+                       for name, path in meta["layers"].items()}
+
+        index_path = os.path.join(data_dir, CACHE_DIR, "priority_index.npz")
+        priority_npy = meta["layers"]["priority"]
+        if (os.path.exists(index_path)
+                and os.path.getmtime(index_path) >= os.path.getmtime(priority_npy)):
+            index = np.load(index_path)
+            self.order, self.block_start, self.block_max = (
+                index["order"], index["block_start"], index["block_max"])
+        else:
+            self.order, self.block_start, self.block_max = build_priority_index(
+                self.layers["priority"], INDEX_BLOCK)
+            np.savez(index_path, order=self.order, block_start=self.block_start,
+                     block_max=self.block_max)
+        self.block_cols = -(-self.shape[1] // INDEX_BLOCK)
+        self.flow_index = load_index(data_dir)
+
+        wgs84 = osr.SpatialReference()
+        wgs84.ImportFromEPSG(4326)
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target = osr.SpatialReference()
+        target.SetFromUserInput(TARGET_CRS)
+        self.from_lonlat = osr.CoordinateTransformation(wgs84, target)
+
+    def to_map(self, x, y, lonlat=False):
+        if lonlat:
+            x, y, _ = self.from_lonlat.TransformPoint(x, y)
+        return x, y
+
+    def cell(self, x, y):
+        """(row, col) of a map coordinate, or None outside the grid."""
+        col = math.floor((x - self.gt[0]) / self.gt[1])
+        row = math.floor((y - self.gt[3]) / self.gt[5])
+        if 0 <= row < self.shape[0] and 0 <= col < self.shape[1]:
+            return row, col
+        return None
+
+    def cell_center(self, row, col):
+        return (self.gt[0] + (col + 0.5) * self.gt[1],
+                self.gt[3] + (row + 0.5) * self.gt[5])
+
+    def point(self, x, y, lonlat=False):
+        """Every served layer's value at a point."""
+        x, y = self.to_map(x, y, lonlat)
+        rc = self.cell(x, y)
+        if rc is None:
+            return {"error": "outside study area"}
+        values = {name: float(arr[rc]) for name, arr in self.layers.items()}
+        return {"x": x, "y": y, "row": rc[0], "col": rc[1], **values}
+
+    def upstream(self, x, y, lonlat=False):
+        """Area draining through a point, plus its catchment and upstream weights."""
+        x, y = self.to_map(x, y, lonlat)
+        rc = self.cell(x, y)
+        if rc is None:
+            return {"error": "outside study area"}
+        out = {"x": x, "y": y, "row": rc[0], "col": rc[1]}
+        if "flow_accum" in self.layers:
+            cells = float(self.layers["flow_accum"][rc])
+            out["upstream_cells"] = cells
+            out["upstream_area_ft2"] = cells * self.cell_area
+        if "catchment_id" in self.layers:
+            out["catchment_id"] = int(self.layers["catchment_id"][rc])
+        for name, arr in self.layers.items():
+            if name.startswith("upstream_"):
+                out[name] = float(arr[rc])
+        if self.flow_index is not None:
+            cell = rc[0] * self.shape[1] + rc[1]
+            out["upstream_cells"] = float(self.flow_index.upstream_sum(cell))
+            out["upstream_area_ft2"] = out["upstream_cells"] * self.cell_area
+            for name in self.flow_index.prefix:
+                out[f"upstream_{name}"] = float(self.flow_index.upstream_sum(cell, name))
+        return out
+
+    def capture(self, points, lonlat=False):
+        """Combined area draining to any of a set of points (e.g. bioswale sites).
+
+        Needs the flow index (flow_index.py). Nested sites are counted once.
+        """
+        if self.flow_index is None:
+            return {"error": "no derived/flow_index.npz; run flow_index.py first"}
+        cells = []
+        for x, y in points:
+            rc = self.cell(*self.to_map(x, y, lonlat))
+            if rc is not None:
+                cells.append(rc[0] * self.shape[1] + rc[1])
+        out = {"sites": len(points), "sites_inside": len(cells)}
+        out["capture_cells"] = self.flow_index.capture(cells)
+        out["capture_area_ft2"] = out["capture_cells"] * self.cell_area
+        for name in self.flow_index.prefix:
+            out[f"capture_{name}"] = self.flow_index.capture(cells, name)
+        return out
+
+    def top(self, xmin, ymin, xmax, ymax, k=20, lonlat=False):
+        """The k highest-priority cells in a bbox, best first.
+
+        Blocks are visited in descending order of their maximum priority and
+        the search stops once no remaining block can beat the current k-th best.
+        """
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        xmin, ymin = self.to_map(xmin, ymin, lonlat)
+        xmax, ymax = self.to_map(xmax, ymax, lonlat)
+        rows, cols = self.shape
+        c0 = max(0, math.floor((xmin - self.gt[0]) / self.gt[1]))
+        c1 = min(cols, math.floor((xmax - self.gt[0]) / self.gt[1]) + 1)
+        r0 = max(0, math.floor((ymax - self.gt[3]) / self.gt[5]))
+        r1 = min(rows, math.floor((ymin - self.gt[3]) / self.gt[5]) + 1)
+        if r0 >= r1 or c0 >= c1:
+            return {"candidates": []}
+
+        b = INDEX_BLOCK
+        brow, bcol = np.meshgrid(np.arange(r0 // b, (r1 - 1) // b + 1),
+                                 np.arange(c0 // b, (c1 - 1) // b + 1), indexing="ij")
+        blocks = (brow * self.block_cols + bcol).ravel()
+        blocks = blocks[np.argsort(-self.block_max[blocks], kind="stable")]
+
+        priority = self.layers["priority"].ravel()
+        best_cells = np.empty(0, dtype=np.int64)
+        best_vals = np.empty(0)
+        for block in blocks:
+            if len(best_vals) >= k and self.block_max[block] < best_vals[-1]:
+                break
+            cells = self.order[self.block_start[block]:self.block_start[block + 1]]
+            r, c = np.divmod(cells, cols)
+            cells = cells[(r >= r0) & (r < r1) & (c >= c0) & (c < c1)][:k]
+            best_cells = np.concatenate([best_cells, cells])
+            best_vals = np.concatenate([best_vals, priority[cells]])
+            keep = np.lexsort((best_cells, -best_vals))[:k]
+            best_cells, best_vals = best_cells[keep], best_vals[keep]
+
+        candidates = []
+        for rank, (cell, value) in enumerate(zip(best_cells, best_vals), start=1):
+            r, c = divmod(int(cell), cols)
+            x, y = self.cell_center(r, c)
+            candidates.append({"rank": rank, "x": x, "y": y, "row": r, "col": c,
+                               "priority": float(value)})
+        return {"candidates": candidates}
+
+
+# ─── HTTP / CLI ──────────────────────────────────────────────────────────────
+
+def dispatch(service, command, params):
+    """Run one query; params are floats (pts: x,y pairs) plus optional k / lonlat."""
+    start = time.perf_counter()
+    lonlat = bool(params.get("lonlat"))
+    if command == "point":
+        result = service.point(params["x"], params["y"], lonlat)
+    elif command == "upstream":
+        result = service.upstream(params["x"], params["y"], lonlat)
+    elif command == "capture":
+        pts = params["pts"]
+        if isinstance(pts, str):
+            pts = [float(v) for v in pts.split(",")]
+        if len(pts) % 2:
+            raise ValueError("pts needs x,y pairs")
+        result = service.capture(list(zip(pts[::2], pts[1::2])), lonlat)
+    elif command == "top":
+        result = service.top(params["xmin"], params["ymin"], params["xmax"], params["ymax"],
+                             int(params.get("k", 20)), lonlat)
+    else:
+        raise KeyError(command)
+    result["ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            try:
+                params = {k: v[0] if k == "pts" else float(v[0])
+                          for k, v in parse_qs(url.query).items()}
+                body, status = dispatch(service, url.path.strip("/"), params), 200
+            except KeyError as exc:
+                body, status = {"error": f"unknown query or missing parameter {exc}"}, 400
+            except ValueError as exc:
+                body, status = {"error": f"bad parameter: {exc}"}, 400
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the derived FIS and flow layers.")
+    add_area_arguments(parser)
+    parser.add_argument("--lonlat", action="store_true",
+                        help="Coordinates are WGS84 lon/lat instead of EPSG:2913 feet")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Serve queries over HTTP")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    for name in ["point", "upstream"]:
+        p = sub.add_parser(name, help=f"{name} query at X Y")
+        p.add_argument("x", type=float)
+        p.add_argument("y", type=float)
+    capture = sub.add_parser("capture", help="Combined catchment of sites X Y [X Y ...]")
+    capture.add_argument("pts", type=float, nargs="+")
+    top = sub.add_parser("top", help="Top-k priority cells in a bbox")
+    for coord in ["xmin", "ymin", "xmax", "ymax"]:
+        top.add_argument(coord, type=float)
+    top.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+
+    service = QueryService(area_data_dir(area))
+    if args.command == "serve":
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(service))
+        print(f"Serving {area} on http://127.0.0.1:{args.port} "
+              "(/point?x=&y=, /upstream?x=&y=, /capture?pts=x1,y1,x2,y2, "
+              "/top?xmin=&ymin=&xmax=&ymax=&k=)")
+        server.serve_forever()
+        return
+
+    params = {k: v for k, v in vars(args).items()
+              if k in ("x", "y", "pts", "xmin", "ymin", "xmax", "ymax", "k")}
+    params["lonlat"] = args.lonlat
+    print(json.dumps(dispatch(service, args.command, params), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal"]
+# ///
+# ABOUTME: Burns fetched vector layers onto the reference grid in one gdal.Rasterize
+# ABOUTME: pass (attribute values, coverage fractions, counts or feature IDs), cached.
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from instrument import run_report, stage
+from study_area import DATA_DIR, add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Rasterized arrays are cached by layer content hash + grid + request, so a
+# layer is only burned once per grid no matter how many stages ask for it.
+CACHE_DIR = os.path.join(DATA_DIR, "cache", "rasterize")
+# Least recently used entries are evicted once the cache grows past this
+CACHE_MAX_MB = 2048
+
+# Sub-cells per side when estimating polygon coverage fractions
+COVERAGE_SUPERSAMPLE = 4
+
+# Paths relative to the area data directory
+REFERENCE_PATH = os.path.join("dem", "study_area_dem.tif")
+GRID_DIR = os.path.join("derived", "grids")
+
+# Fetched layers gridded by main(): (name, path, kind)
+# "ids" layers also get an id → attributes lookup table.
+LAYERS = [
+    ("zoning", os.path.join("zoning", "zoning.geojson"), "ids"),
+    ("combined_sewer_basins", os.path.join("stormwater", "combined_sewer_basins.geojson"), "ids"),
+    ("building_coverage", os.path.join("impervious", "building_footprints.geojson"), "coverage"),
+    ("street_tree_count", os.path.join("trees", "street_trees.geojson"), "count"),
+]
+
+
+# ─── Cache ───────────────────────────────────────────────────────────────────
+
+def layer_hash(path):
+    """SHA-1 of a vector file's bytes."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_path(path, gt, proj, shape, request):
+    """Cache file for one rasterization of a layer onto a grid."""
+    key = json.dumps([layer_hash(path), list(gt), proj, list(shape), request], sort_keys=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, f"{name}_{hashlib.sha1(key.encode()).hexdigest()[:16]}.npy")
+
+
+def save_entry(out, array):
+    """Write a cache entry atomically, so a killed run never leaves a truncated hit."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".npy.part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, out)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def prune_cache(max_mb=CACHE_MAX_MB):
+    """Evict least recently used entries until the cache fits in max_mb."""
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".npy"):
+            st = os.stat(os.path.join(CACHE_DIR, name))
+            entries.append((st.st_mtime, st.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_mb * 1024 * 1024:
+            break
+        os.remove(os.path.join(CACHE_DIR, name))
+        total -= size
+
+
+def cached(func):
+    """Serve func(path, gt, proj, shape, ...) from the cache when cache=True."""
+    def wrapper(path, gt, proj, shape, *args, cache=True, **kwargs):
+        if not cache:
+            return func(path, gt, proj, shape, *args, **kwargs)
+        out = cache_path(path, gt, proj, shape, [func.__name__, args, sorted(kwargs.items())])
+        if os.path.exists(out):
+            os.utime(out)
+            return np.load(out)
+        array = func(path, gt, proj, shape, *args, **kwargs)
+        save_entry(out, array)
+        prune_cache()
+        return array
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+# ─── Rasterization ───────────────────────────────────────────────────────────
+
+def layer_name(path):
+    ds = ogr.Open(path)
+    name = ds.GetLayer(0).GetName()
+    ds = None
+    return name
+
+
+def burn(path, gt, proj, shape, dtype, init, sql=None, **options):
+    """One gdal.Rasterize pass of a vector file onto a fresh in-memory grid."""
+    rows, cols = shape
+    out_ds = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, dtype)
+    out_ds.SetGeoTransform(gt)
+    out_ds.SetProjection(proj)
+    band = out_ds.GetRasterBand(1)
+    band.Fill(init)
+    if sql is not None:
+        options.update(SQLStatement=sql, SQLDialect="SQLITE")
+    gdal.Rasterize(out_ds, path, options=gdal.RasterizeOptions(**options))
+    array = band.ReadAsArray()
+    out_ds = None
+    return array
+
+
+@cached
+def rasterize_values(path, gt, proj, shape, expression, default=0):
+    """Burn a per-feature SQL expression (SQLite dialect) as float64 values.
+
+    Cells outside every feature get default.
+    """
+    sql = f'SELECT *, ({expression}) AS burn_value FROM "{layer_name(path)}"'
+    return burn(path, gt, proj, shape, gdal.GDT_Float64, default,
+                sql=sql, attribute="burn_value").astype(np.float64)
+
+
+@cached
+def rasterize_coverage(path, gt, proj, shape, supersample=COVERAGE_SUPERSAMPLE):
+    """Fraction of each cell covered by the layer's polygons (float32, 0–1)."""
+    rows, cols = shape
+    fine_gt = (gt[0], gt[1] / supersample, gt[2], gt[3], gt[4], gt[5] / supersample)
+    fine = burn(path, fine_gt, proj, (rows * supersample, cols * supersample),
+                gdal.GDT_Byte, 0, burnValues=[1])
+    blocks = fine.reshape(rows, supersample, cols, supersample)
+    return (blocks.sum(axis=(1, 3), dtype=np.int32) / supersample ** 2).astype(np.float32)
+
+
+@cached
+def rasterize_count(path, gt, proj, shape):
+    """Number of features (e.g. tree points) falling in each cell (int32)."""
+    return burn(path, gt, proj, shape, gdal.GDT_Int32, 0,
+                burnValues=[1], add=True).astype(np.int32)
+
+
+@cached
+def rasterize_ids(path, gt, proj, shape):
+    """Feature ID + 1 of the feature covering each cell, 0 where uncovered (int32).
+
+    Features are burned in reverse order so that where polygons overlap the
+    first one in the layer wins, matching a first-match point-in-polygon test.
+    """
+    sql = f'SELECT *, ROWID + 1 AS burn_id FROM "{layer_name(path)}" ORDER BY ROWID DESC'
+    return burn(path, gt, proj, shape, gdal.GDT_Int32, 0,
+                sql=sql, attribute="burn_id").astype(np.int32)
+
+
+def feature_attributes(path, fields=None):
+    """Map feature ID + 1 (as burned by rasterize_ids) to its attribute dict."""
+    ds = ogr.Open(path)
+    table = {}
+    for feat in ds.GetLayer():
+        props = feat.items()
+        if fields is not None:
+            props = {k: props.get(k) for k in fields}
+        table[feat.GetFID() + 1] = props
+    ds = None
+    return table
+
+
+class FeatureGrid:
+    """Feature-ID raster plus attribute table: O(1) vector lookups by location."""
+
+    def __init__(self, path, gt, proj, shape, fields=None, cache=True):
+        self.ids = rasterize_ids(path, gt, proj, shape, cache=cache)
+        self.table = feature_attributes(path, fields)
+        self.gt = gt
+
+    def lookup(self, x, y):
+        """Attributes of the feature covering map point (x, y), or None."""
+        col = int((x - self.gt[0]) / self.gt[1])
+        row = int((y - self.gt[3]) / self.gt[5])
+        if not (0 <= row < self.ids.shape[0] and 0 <= col < self.ids.shape[1]):
+            return None
+        return self.table.get(int(self.ids[row, col]))
+
+
+def write_raster(path, array, gt, proj, dtype=gdal.GDT_Float32, nodata=None):
+    """Write a numpy array as a single-band GeoTIFF."""
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(path, array.shape[1], array.shape[0], 1, dtype,
+                       options=["COMPRESS=LZW"])
+    ds.SetGeoTransform(gt)
+    ds.SetProjection(proj)
+    band = ds.GetRasterBand(1)
+    band.WriteArray(array)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.FlushCache()
+    ds = None
+
+
+# ─── Main ────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Grid fetched vector layers onto the DEM grid.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Re-rasterize even when a cached grid exists")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    grid_dir = os.path.join(data_dir, GRID_DIR)
+    os.makedirs(grid_dir, exist_ok=True)
+
+    ref_ds = gdal.Open(os.path.join(data_dir, REFERENCE_PATH))
+    gt = ref_ds.GetGeoTransform()
+    proj = ref_ds.GetProjection()
+    shape = (ref_ds.RasterYSize, ref_ds.RasterXSize)
+    ref_ds = None
+    print(f"Reference grid ({area}): {shape[1]}x{shape[0]}, pixel={gt[1]}ft")
+
+    with run_report(grid_dir, "rasterize", area=area):
+        for name, rel_path, kind in LAYERS:
+            path = os.path.join(data_dir, rel_path)
+            if not os.path.exists(path):
+                print(f"  {name}: {rel_path} not fetched, skipping")
+                continue
+            out_path = os.path.join(grid_dir, f"{name}.tif")
+            with stage(name) as span:
+                if kind == "ids":
+                    array = rasterize_ids(path, gt, proj, shape, cache=not args.no_cache)
+                    write_raster(out_path, array, gt, proj, gdal.GDT_Int32, nodata=0)
+                    table_path = os.path.join(grid_dir, f"{name}_ids.json")
+                    with open(table_path, "w") as f:
+                        json.dump(feature_attributes(path), f)
+                    detail = f"{len(np.unique(array)) - (array == 0).any():,} features"
+                elif kind == "coverage":
+                    array = rasterize_coverage(path, gt, proj, shape, cache=not args.no_cache)
+                    write_raster(out_path, array, gt, proj)
+                    detail = f"{array.mean() * 100:.1f}% covered"
+                else:
+                    array = rasterize_count(path, gt, proj, shape, cache=not args.no_cache)
+                    write_raster(out_path, array, gt, proj, gdal.GDT_Int32)
+                    detail = f"{int(array.sum()):,} features"
+                span.record(**{name: array})
+            print(f"  {name}: {detail} -> {out_path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,120 +2,277 @@
 # requires-python = ">=3.10"
 # dependencies = [
 #     "requests",
+#     "gdal",
 # ]
 # ///
-# ABOUTME: Fetches all GIS layers for the study area and reprojects to EPSG:2913.
-# ABOUTME: Hawthorne to Division, SE 20th to Cesar Chavez (SE 39th).
+# ABOUTME: Fetches all GIS layers for a study area and reprojects to EPSG:2913.
+# ABOUTME: Areas come from study_area.py (default: Hawthorne to Division corridor).
 
+import argparse
 import json
 import os
-import subprocess
-import requests
-
-TARGET_CRS = "EPSG:2913"
-
-# Canonical study area extent in EPSG:2913 (Oregon North State Plane, ft).
-# This is the single source of truth — matches clip_dem.py.
-STUDY_EXTENT_2913 = {
-    "xmin": 7650146,
-    "ymin": 675893,
-    "xmax": 7658210,
-    "ymax": 680660,
-}
+from functools import lru_cache
 
-# WGS84 query bbox — intentionally slightly oversized so the ArcGIS spatial
-# query returns all features that touch the study area.  The actual clip to
-# a clean EPSG:2913 rectangle happens in ogr2ogr with -clipdst.
-QUERY_BBOX_WGS84 = {
-    "xmin": -122.655,
-    "ymin": 45.500,
-    "xmax": -122.620,
-    "ymax": 45.515,
-}
+import requests
+from osgeo import gdal, ogr, osr
 
-CLIP_EXTENT = (
-    STUDY_EXTENT_2913["xmin"],
-    STUDY_EXTENT_2913["ymin"],
-    STUDY_EXTENT_2913["xmax"],
-    STUDY_EXTENT_2913["ymax"],
+from instrument import run_report, stage
+from study_area import (
+    TARGET_CRS, add_area_arguments, area_from_args, area_data_dir, query_bbox_wgs84,
 )
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+gdal.UseExceptions()
 
 
-def reproject_geojson(in_path, out_path, target_crs):
-    """Reproject a GeoJSON file using ogr2ogr and clip to study area."""
-    subprocess.run(
-        [
-            "ogr2ogr", "-f", "GeoJSON",
-            "-t_srs", target_crs,
-            "-clipdst", *[str(v) for v in CLIP_EXTENT],
-            out_path, in_path,
-        ],
-        check=True,
-    )
+# ArcGIS field types → OGR field types for the output schema
+ESRI_FIELD_TYPES = {
+    "esriFieldTypeOID": ogr.OFTInteger64,
+    "esriFieldTypeSmallInteger": ogr.OFTInteger,
+    "esriFieldTypeInteger": ogr.OFTInteger64,
+    "esriFieldTypeSingle": ogr.OFTReal,
+    "esriFieldTypeDouble": ogr.OFTReal,
+    "esriFieldTypeDate": ogr.OFTInteger64,  # epoch milliseconds in f=geojson
+}
+# Not attributes: the shape is the feature geometry, the others never appear in f=geojson
+ESRI_NON_ATTRIBUTE_TYPES = {
+    "esriFieldTypeGeometry", "esriFieldTypeBlob", "esriFieldTypeRaster",
+}
+
 
+@lru_cache(maxsize=None)
+def wgs84_to_target(target_crs):
+    """Cached WGS84 (lon/lat order) → target CRS transformation."""
+    src = osr.SpatialReference()
+    src.ImportFromEPSG(4326)
+    src.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dst = osr.SpatialReference()
+    dst.SetFromUserInput(target_crs)
+    dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return osr.CoordinateTransformation(src, dst), dst
 
-def fetch_arcgis_layer(url, out_name, out_dir, method="post"):
-    """Fetch all features from an ArcGIS REST service layer as GeoJSON with pagination."""
-    os.makedirs(out_dir, exist_ok=True)
-    all_features = []
-    offset = 0
-    batch = 2000
-
-    while True:
-        params = {
-            "where": "1=1",
-            "geometry": json.dumps(QUERY_BBOX_WGS84),
-            "geometryType": "esriGeometryEnvelope",
-            "inSR": "4326",
-            "spatialRel": "esriSpatialRelIntersects",
-            "outFields": "*",
-            "returnGeometry": "true",
-            "f": "geojson",
-            "resultRecordCount": batch,
-            "resultOffset": offset,
-        }
 
-        if method == "post":
-            resp = requests.post(url, data=params, timeout=60)
-        else:
-            resp = requests.get(url, params=params, timeout=60)
+def layer_fields(url):
+    """Output schema from the service's field metadata: [(name, OGR type)].
 
+    Returns None if the metadata cannot be read; the schema is then taken
+    from the first page of features.
+    """
+    meta_url = url[:-len("/query")] if url.endswith("/query") else url
+    try:
+        resp = requests.get(meta_url, params={"f": "json"}, timeout=60)
         resp.raise_for_status()
-        data = resp.json()
-
-        if "error" in data:
-            print(f"  ERROR: {data['error']}")
+        fields = resp.json().get("fields")
+    except (requests.RequestException, ValueError):
+        return None
+    if not fields:
+        return None
+    return [(f["name"], ESRI_FIELD_TYPES.get(f["type"], ogr.OFTString)) for f in fields
+            if f["type"] not in ESRI_NON_ATTRIBUTE_TYPES]
+
+
+class ClippedLayerWriter:
+    """Streams GeoJSON feature pages into a reprojected, clipped output layer.
+
+    Matches ogr2ogr -t_srs ... -clipdst: features are transformed, kept as-is
+    when inside the clip rectangle, dropped when outside, and otherwise
+    intersected with it, dropping lower-dimension leftovers and empty results.
+    Features go to a temporary file that close() renames over out_path, so an
+    interrupted download never leaves a partial layer behind; abort()
+    discards it instead.
+    """
+
+    def __init__(self, out_path, extent, target_crs, fields=None, driver="GeoJSON"):
+        self.out_path = out_path
+        self.tmp_path = out_path + ".part"
+        self.fields = fields
+        self.driver = driver
+        self.transform, self.srs = wgs84_to_target(target_crs)
+        self.clip = ogr.CreateGeometryFromWkt(
+            "POLYGON (({xmin} {ymin}, {xmax} {ymin}, {xmax} {ymax}, {xmin} {ymax}, {xmin} {ymin}))"
+            .format(**extent))
+        self.clip_env = (extent["xmin"], extent["xmax"], extent["ymin"], extent["ymax"])
+        self.ds = None
+        self.layer = None
+        self.count = 0
+
+    def open(self, page_layer=None):
+        """Create the output on the first page, using the service schema if known.
+
+        Without a page (no features returned) the layer is created empty.
+        """
+        drv = ogr.GetDriverByName(self.driver)
+        if os.path.exists(self.tmp_path):
+            drv.DeleteDataSource(self.tmp_path)
+        self.ds = drv.CreateDataSource(self.tmp_path)
+        self.layer = self.ds.CreateLayer(
+            os.path.splitext(os.path.basename(self.out_path))[0], self.srs,
+            page_layer.GetGeomType() if page_layer is not None else ogr.wkbUnknown,
+        )
+        if self.fields is None and page_layer is None:
+            self.fields = []
+        elif self.fields is None:
+            defn = page_layer.GetLayerDefn()
+            self.fields = [(defn.GetFieldDefn(i).GetName(), defn.GetFieldDefn(i).GetType())
+                           for i in range(defn.GetFieldCount())]
+        for name, field_type in self.fields:
+            self.layer.CreateField(ogr.FieldDefn(name, field_type))
+
+    def clip_geometry(self, geom):
+        """Clip a target-CRS geometry to the extent; None if nothing is left."""
+        minx, maxx, miny, maxy = geom.GetEnvelope()
+        cx0, cx1, cy0, cy1 = self.clip_env
+        if minx >= cx0 and maxx <= cx1 and miny >= cy0 and maxy <= cy1:
+            return geom
+        if maxx < cx0 or minx > cx1 or maxy < cy0 or miny > cy1:
             return None
-
-        features = data.get("features", [])
-        if not features:
-            break
-
-        all_features.extend(features)
-        print(f"  Fetched {len(features)} (total: {len(all_features)})")
-
-        if len(features) < batch:
-            break
-        offset += batch
-
-    result = {"type": "FeatureCollection", "features": all_features}
-
-    # Write WGS84 temp file, then reproject
-    tmp_path = os.path.join(out_dir, f"{out_name}_wgs84.geojson")
+        clipped = geom.Intersection(self.clip)
+        if clipped is None or clipped.IsEmpty():
+            return None
+        if clipped.GetGeometryType() == ogr.wkbGeometryCollection:
+            # Keep only parts of the input's dimension (as ogr2ogr does)
+            dim = geom.GetDimension()
+            parts = [clipped.GetGeometryRef(i).Clone() for i in range(clipped.GetGeometryCount())
+                     if clipped.GetGeometryRef(i).GetDimension() == dim]
+            if not parts:
+                return None
+            merged = parts[0]
+            for part in parts[1:]:
+                merged = merged.Union(part)
+            clipped = merged
+        elif clipped.GetDimension() < geom.GetDimension():
+            return None
+        return clipped
+
+    def write_page(self, page):
+        """Transform, clip and write one page of GeoJSON features."""
+        src = ogr.Open(json.dumps(page))
+        page_layer = src.GetLayer()
+        if self.layer is None:
+            self.open(page_layer)
+        out_defn = self.layer.GetLayerDefn()
+        for feat in page_layer:
+            geom = feat.GetGeometryRef()
+            if geom is None:
+                continue
+            geom = geom.Clone()
+            geom.Transform(self.transform)
+            geom = self.clip_geometry(geom)
+            if geom is None:
+                continue
+            out = ogr.Feature(out_defn)
+            for name, _ in self.fields:
+                idx = feat.GetFieldIndex(name)
+                if idx >= 0 and feat.IsFieldSetAndNotNull(idx):
+                    out.SetField(name, feat.GetField(idx))
+            out.SetGeometry(geom)
+            self.layer.CreateFeature(out)
+            self.count += 1
+        src = None
+
+    def close(self):
+        """Finish the output (an empty FeatureCollection if nothing was written)."""
+        if self.layer is None:
+            self.open()
+        self.layer = None
+        self.ds = None
+        os.replace(self.tmp_path, self.out_path)
+
+    def abort(self):
+        """Discard the partial output, leaving any previous out_path untouched."""
+        self.layer = None
+        self.ds = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def download_pages(url, query_bbox, writer, method="post", batch=2000):
+    """Page through an ArcGIS REST query into writer.
+
+    Returns the number of features fetched, or None if the service reports
+    an error.
+    """
+    fetched = 0
+    offset = 0
+    with stage("download") as span:
+        while True:
+            params = {
+                "where": "1=1",
+                "geometry": json.dumps(query_bbox),
+                "geometryType": "esriGeometryEnvelope",
+                "inSR": "4326",
+                "spatialRel": "esriSpatialRelIntersects",
+                "outFields": "*",
+                "returnGeometry": "true",
+                "f": "geojson",
+                "resultRecordCount": batch,
+                "resultOffset": offset,
+            }
+
+            if method == "post":
+                resp = requests.post(url, data=params, timeout=60)
+            else:
+                resp = requests.get(url, params=params, timeout=60)
+
+            resp.raise_for_status()
+            data = resp.json()
+
+            if "error" in data:
+                print(f"  ERROR: {data['error']}")
+                return None
+
+            features = data.get("features", [])
+            if not features:
+                break
+
+            with stage("reproject_clip"):
+                writer.write_page({"type": "FeatureCollection", "features": features})
+            fetched += len(features)
+            print(f"  Fetched {len(features)} (total: {fetched})")
+
+            if len(features) < batch:
+                break
+            offset += batch
+        span.note(features=fetched, kept=writer.count)
+    return fetched
+
+
+def fetch_arcgis_layer(url, out_name, out_dir, extent, method="post"):
+    """Fetch all features from an ArcGIS REST service layer as GeoJSON with pagination.
+
+    The query uses an oversized WGS84 bbox; each page is reprojected and
+    clipped to the EPSG:2913 extent in-process as it arrives. The output is
+    always a complete FeatureCollection, empty if nothing was returned; on a
+    service error or an exception any previous file is left as it was.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    query_bbox = query_bbox_wgs84(extent)
     out_path = os.path.join(out_dir, f"{out_name}.geojson")
-    with open(tmp_path, "w") as f:
-        json.dump(result, f)
-
-    reproject_geojson(tmp_path, out_path, TARGET_CRS)
-    os.remove(tmp_path)
-
-    print(f"  Saved {len(all_features)} features to {out_path} ({TARGET_CRS})")
+    writer = ClippedLayerWriter(out_path, extent, TARGET_CRS, fields=layer_fields(url))
+    try:
+        fetched = download_pages(url, query_bbox, writer, method)
+    except BaseException:
+        writer.abort()
+        raise
+    if fetched is None:
+        writer.abort()
+        return None
+
+    writer.close()
+    if fetched == 0:
+        print(f"  No features returned for {out_name}; wrote an empty layer to {out_path}")
+    else:
+        print(f"  Saved {writer.count} features to {out_path} ({TARGET_CRS})")
     return out_path
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Fetch GIS layers for a study area.")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, extent = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    print(f"Study area: {area} {extent}")
+
     swsp_url = "https://www.portlandmaps.com/arcgis/rest/services/Public/Stormwater_System_Plan/MapServer"
     sewer_url = "https://www.portlandmaps.com/arcgis/rest/services/Public/Utilities_Sewer/MapServer"
     trees_url = "https://services.arcgis.com/quVN97tn06YNGj9s/arcgis/rest/services/Street_Tree_Inventory_Second_Edition_2024/FeatureServer/297/query"
@@ -125,12 +282,12 @@ def main():
     streets_url = "https://www.portlandmaps.com/arcgis/rest/services/Public/Street_Centerlines/MapServer"
     zoning_url = "https://www.portlandmaps.com/arcgis/rest/services/Public/Zoning/MapServer"
 
-    stormwater_dir = os.path.join(DATA_DIR, "stormwater")
-    sewer_dir = os.path.join(DATA_DIR, "sewer")
-    trees_dir = os.path.join(DATA_DIR, "trees")
-    impervious_dir = os.path.join(DATA_DIR, "impervious")
-    streets_dir = os.path.join(DATA_DIR, "streets")
-    zoning_dir = os.path.join(DATA_DIR, "zoning")
+    stormwater_dir = os.path.join(data_dir, "stormwater")
+    sewer_dir = os.path.join(data_dir, "sewer")
+    trees_dir = os.path.join(data_dir, "trees")
+    impervious_dir = os.path.join(data_dir, "impervious")
+    streets_dir = os.path.join(data_dir, "streets")
+    zoning_dir = os.path.join(data_dir, "zoning")
 
     # Stormwater System Plan layers
     # Note: Layer 5 (depth to groundwater) and Layer 11 (slope) are RASTER layers
@@ -144,39 +301,46 @@ def main():
         "combined_sewer_basins": 16,
     }
 
-    for name, layer_id in swsp_layers.items():
-        print(f"Fetching {name}...")
-        fetch_arcgis_layer(f"{swsp_url}/{layer_id}/query", name, stormwater_dir, method="get")
-
-    # Sewer layers
-    sewer_layers = {
-        "storm_nodes": 6,
-        "storm_pipes": 7,
-        "inlets": 19,
-    }
-
-    for name, layer_id in sewer_layers.items():
-        print(f"Fetching {name}...")
-        fetch_arcgis_layer(f"{sewer_url}/{layer_id}/query", name, sewer_dir, method="get")
-
-    # Street trees
-    print("Fetching street_trees...")
-    fetch_arcgis_layer(trees_url, "street_trees", trees_dir, method="post")
-
-    # Building footprints
-    print("Fetching building_footprints...")
-    fetch_arcgis_layer(buildings_url, "building_footprints", impervious_dir, method="post")
-
-    # Street centerlines (CRITICAL for network segmentation)
-    # Layer 0 = Geocoding Streets from Street_Centerlines MapServer
-    # Has STREETNAME, FTYPE, PREFIX, SUFFIX, TYPE, address ranges
-    print("Fetching streets...")
-    fetch_arcgis_layer(f"{streets_url}/0/query", "streets", streets_dir, method="get")
+    with run_report(data_dir, "refetch_layers", area=area):
+        for name, layer_id in swsp_layers.items():
+            print(f"Fetching {name}...")
+            with stage(name):
+                fetch_arcgis_layer(f"{swsp_url}/{layer_id}/query", name, stormwater_dir, extent, method="get")
+
+        # Sewer layers
+        sewer_layers = {
+            "storm_nodes": 6,
+            "storm_pipes": 7,
+            "inlets": 19,
+        }
 
-    # Zoning (for placement constraints)
-    # Layer 0 = Base zoning
-    print("Fetching zoning...")
-    fetch_arcgis_layer(f"{zoning_url}/0/query", "zoning", zoning_dir, method="get")
+        for name, layer_id in sewer_layers.items():
+            print(f"Fetching {name}...")
+            with stage(name):
+                fetch_arcgis_layer(f"{sewer_url}/{layer_id}/query", name, sewer_dir, extent, method="get")
+
+        # Street trees
+        print("Fetching street_trees...")
+        with stage("street_trees"):
+            fetch_arcgis_layer(trees_url, "street_trees", trees_dir, extent, method="post")
+
+        # Building footprints
+        print("Fetching building_footprints...")
+        with stage("building_footprints"):
+            fetch_arcgis_layer(buildings_url, "building_footprints", impervious_dir, extent, method="post")
+
+        # Street centerlines (CRITICAL for network segmentation)
+        # Layer 0 = Geocoding Streets from Street_Centerlines MapServer
+        # Has STREETNAME, FTYPE, PREFIX, SUFFIX, TYPE, address ranges
+        print("Fetching streets...")
+        with stage("streets"):
+            fetch_arcgis_layer(f"{streets_url}/0/query", "streets", streets_dir, extent, method="get")
+
+        # Zoning (for placement constraints)
+        # Layer 0 = Base zoning
+        print("Fetching zoning...")
+        with stage("zoning"):
+            fetch_arcgis_layer(f"{zoning_url}/0/query", "zoning", zoning_dir, extent, method="get")
 
 
 if __name__ == "__main__":
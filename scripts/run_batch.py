@@ -0,0 +1,142 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy", "requests"]
+# ///
+# ABOUTME: Runs the full pipeline for many study areas in parallel, one process per
+# ABOUTME: area with isolated output directories, then writes a consolidated summary.
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from osgeo import gdal
+
+from study_area import (
+    AREAS_DIR, NAMED_AREAS, area_arguments, area_data_dir, areas_from_layer,
+)
+
+gdal.UseExceptions()
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pipeline stages in run order (see README "Generate the data")
+STAGES = [
+    "warp",  # DEM + impervious, concurrently
+    "refetch_layers",
+    "rasterize",
+    "calc_flow",
+    "fis_suitability",
+]
+
+SUMMARY_CSV = os.path.join(AREAS_DIR, "batch_summary.csv")
+SUMMARY_JSON = os.path.join(AREAS_DIR, "batch_summary.json")
+PRIORITY_PATH = os.path.join("derived", "fis_priority.tif")
+LOG_NAME = "batch.log"
+
+
+def run_area(name, extent, stages):
+    """Run the pipeline stages for one area, logging to its own directory.
+
+    Stops at the first failing stage. Returns a summary row.
+    """
+    data_dir = area_data_dir(name)
+    os.makedirs(data_dir, exist_ok=True)
+    log_path = os.path.join(data_dir, LOG_NAME)
+    row = {"area": name, **extent, "status": "ok", "failed_stage": "", "seconds": 0.0}
+
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        for stage in stages:
+            cmd = [sys.executable, os.path.join(SCRIPTS_DIR, f"{stage}.py"),
+                   *area_arguments(name, extent)]
+            log.write(f"$ {' '.join(cmd)}\n")
+            log.flush()
+            result = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT)
+            if result.returncode != 0:
+                row["status"] = "failed"
+                row["failed_stage"] = stage
+                break
+    row["seconds"] = round(time.perf_counter() - start, 1)
+    row.update(priority_summary(os.path.join(data_dir, PRIORITY_PATH)))
+    return row
+
+
+def priority_summary(path):
+    """Headline priority statistics for an area, empty if it has no output."""
+    if not os.path.exists(path):
+        return {}
+    ds = gdal.Open(path)
+    priority = ds.GetRasterBand(1).ReadAsArray()
+    ds = None
+    return {
+        "cells": int(priority.size),
+        "priority_mean": round(float(priority.mean()), 4),
+        "priority_max": round(float(priority.max()), 4),
+        # Share of cells in the high-priority band (>= 0.6)
+        "high_priority_pct": round(float(np.mean(priority >= 0.6)) * 100, 2),
+    }
+
+
+def write_summary(rows):
+    """Write the consolidated per-area summary as CSV and JSON."""
+    os.makedirs(AREAS_DIR, exist_ok=True)
+    fields = []
+    for row in rows:
+        fields.extend(k for k in row if k not in fields)
+    with open(SUMMARY_CSV, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(SUMMARY_JSON, "w") as f:
+        json.dump(rows, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline for many study areas.")
+    parser.add_argument("--areas", nargs="+", choices=sorted(NAMED_AREAS),
+                        help="Named study areas to run")
+    parser.add_argument("--areas-layer",
+                        help="Polygon layer (neighbourhoods, sewersheds); one area per "
+                             "feature, covering the feature's bounding envelope")
+    parser.add_argument("--name-field", default="NAME",
+                        help="Attribute naming each polygon in --areas-layer (default: NAME)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="Stages to run, in pipeline order (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Areas processed in parallel (default: CPU count)")
+    args = parser.parse_args()
+
+    areas = [(name, NAMED_AREAS[name]) for name in args.areas or []]
+    if args.areas_layer:
+        areas.extend(areas_from_layer(args.areas_layer, args.name_field))
+    if not areas:
+        parser.error("give --areas and/or --areas-layer")
+    stages = [s for s in STAGES if s in args.stages]
+
+    print(f"Running {len(stages)} stages for {len(areas)} areas on {args.workers} workers")
+    rows = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(run_area, name, extent, stages): name for name, extent in areas}
+        for i, future in enumerate(as_completed(futures), start=1):
+            row = future.result()
+            rows.append(row)
+            detail = f"failed at {row['failed_stage']}" if row["failed_stage"] else "ok"
+            print(f"  {i}/{len(areas)} {row['area']}: {detail} ({row['seconds']}s)")
+
+    rows.sort(key=lambda r: r["area"])
+    write_summary(rows)
+
+    n_failed = sum(r["status"] != "ok" for r in rows)
+    print(f"\n{len(rows) - n_failed} ok, {n_failed} failed")
+    print(f"  -> {SUMMARY_CSV}")
+    print(f"  -> {SUMMARY_JSON}")
+
+
+if __name__ == "__main__":
+    main()
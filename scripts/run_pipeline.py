@@ -0,0 +1,226 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Runs DEM → terrain → routing → FIS → zonal stats → validation in one process,
+# ABOUTME: passing arrays in memory. Outputs are written in the background, not re-read.
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal, ogr
+
+import calc_flow
+import extract_attributes
+import fis_suitability
+from instrument import run_report, stage
+from neighborhood import box_mean
+from study_area import add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+from terrain import PRODUCTS, terrain
+
+gdal.UseExceptions()
+
+# Background GeoTIFF writers; GDAL encodes outside the GIL
+WRITE_WORKERS = 2
+
+
+class Writer:
+    """Runs output writes on a thread pool, or inline when sync=True.
+
+    Arrays handed to submit() must not be modified afterwards.
+    """
+
+    def __init__(self, sync=False, workers=WRITE_WORKERS):
+        self.pool = None if sync else ThreadPoolExecutor(max_workers=workers)
+        self.pending = []
+
+    def submit(self, func, path, *args, after=None, **kwargs):
+        """Queue func(path, ...); after: path of an earlier submit() it reads."""
+        if self.pool is None:
+            func(path, *args, **kwargs)
+            print(f"  -> {path}")
+            return
+        job = func
+        if after is not None:
+            # Submitted earlier, so the pool starts it first and this cannot deadlock
+            before = dict(self.pending)[after]
+
+            def job(*a, **kw):
+                before.result()
+                return func(*a, **kw)
+        self.pending.append((path, self.pool.submit(job, path, *args, **kwargs)))
+
+    def wait(self):
+        """Block until every queued write is on disk; re-raises the first failure."""
+        for path, future in self.pending:
+            future.result()
+            print(f"  -> {path}")
+        self.pending = []
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def write_ascii_grid(asc_path, tif_path):
+    """NetLogo's UTM ASCII grid of a written GeoTIFF, output path first for Writer."""
+    fis_suitability.write_ascii_grid_utm(tif_path, asc_path, verbose=False)
+
+
+def run(data_dir, writer, intermediates=False, rain_in=calc_flow.DESIGN_STORM_IN):
+    """The whole raster pipeline for one area; returns the arrays it produced."""
+    derived_dir = os.path.join(data_dir, calc_flow.DERIVED_DIR)
+    os.makedirs(derived_dir, exist_ok=True)
+
+    def in_area(rel_path):
+        return os.path.join(data_dir, rel_path)
+
+    print("Reading inputs...")
+    with stage("read_inputs") as span:
+        elev, gt, proj, pixel_size, _ = calc_flow.read_dem(in_area(calc_flow.DEM_PATH))
+        ds = gdal.Open(in_area(fis_suitability.IMPERVIOUS_PATH))
+        imp_raw = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+        ds = None
+        span.record(elev=elev, imp_raw=imp_raw)
+    shape = elev.shape
+
+    # ── Terrain and routing ─────────────────────────────────────────────────
+    print("Terrain derivatives...")
+    products = PRODUCTS if intermediates else ["slope_deg", "tan_slope"]
+    with stage("terrain", cells=elev.size) as span:
+        derivs = terrain(elev, pixel_size, products)
+        span.record(**derivs)
+    slope, tan_slope = derivs["slope_deg"], derivs["tan_slope"]
+
+    print("D8 flow direction and accumulation...")
+    with stage("d8_flow_direction", cells=elev.size) as span:
+        flow_dir = calc_flow.calc_d8_flow_direction(elev, pixel_size)
+        span.record(flow_dir=flow_dir)
+    with stage("weight_stack") as span:
+        names, weights = calc_flow.weight_stack(data_dir, gt, proj, shape, pixel_size,
+                                                rain_in, imp=imp_raw)
+        span.record(weights=weights)
+    with stage("flow_accumulation", cells=elev.size) as span:
+        weighted = calc_flow.accumulate_weights(flow_dir, weights)
+        accum = weighted[0]
+        span.record(weighted=weighted)
+        span.note(bands=names)
+    with stage("twi", cells=elev.size) as span:
+        twi = calc_flow.calc_twi(accum, tan_slope, pixel_size)
+        span.record(twi=twi)
+
+    if intermediates:
+        for name, filename in calc_flow.TERRAIN_OUTPUTS.items():
+            writer.submit(calc_flow.write_raster, os.path.join(derived_dir, filename),
+                          derivs[name], gt, proj)
+        writer.submit(calc_flow.write_raster, os.path.join(derived_dir, "flow_direction.tif"),
+                      flow_dir.astype(np.float32), gt, proj, nodata=-1)
+        writer.submit(calc_flow.write_raster, os.path.join(derived_dir, "flow_accumulation.tif"),
+                      accum.astype(np.float32), gt, proj)
+        writer.submit(calc_flow.write_bands, in_area(calc_flow.WEIGHTED_ACCUM_PATH),
+                      weighted, names, gt, proj)
+        writer.submit(calc_flow.write_raster, os.path.join(derived_dir, "twi.tif"),
+                      twi.astype(np.float32), gt, proj)
+
+    # ── FIS ─────────────────────────────────────────────────────────────────
+    print("\nFIS inputs...")
+    with stage("rasterize_hsg") as span:
+        hsg = fis_suitability.rasterize_hsg(gt, proj, shape, in_area(fis_suitability.HSG_PATH))
+        span.record(hsg=hsg)
+    with stage("box_mean") as span:
+        imp_frac = box_mean(imp_raw, 11)
+        span.record(imp_frac=imp_frac)
+    if intermediates:
+        writer.submit(fis_suitability.write_raster, in_area(fis_suitability.HSG_RASTER_PATH),
+                      hsg, gt, proj)
+        writer.submit(fis_suitability.write_raster, in_area(fis_suitability.IMP_FRAC_PATH),
+                      imp_frac, gt, proj)
+
+    print("=== Stage 1: Physical Suitability (slope × HSG) ===")
+    with stage("fis_stage1") as span:
+        suitability = fis_suitability.evaluate_fis(
+            rules=fis_suitability.STAGE1_RULES,
+            mf_dicts=[fis_suitability.SLOPE_MF, fis_suitability.HSG_MF],
+            inputs=[slope, hsg],
+            rule_input_keys=None,
+        )
+        span.record(suitability=suitability)
+    writer.submit(fis_suitability.write_raster, in_area(fis_suitability.SUIT_PATH),
+                  suitability, gt, proj)
+    print(f"  Suitability: {summarize(suitability, lo=0.0, hi=1.0).describe()}")
+
+    print("=== Stage 2: Capture Priority (suitability × impervious × TWI) ===")
+    with stage("fis_stage2") as span:
+        priority = fis_suitability.evaluate_fis(
+            rules=fis_suitability.STAGE2_RULES,
+            mf_dicts=[fis_suitability.SUIT_IN_MF, fis_suitability.IMP_MF, fis_suitability.TWI_MF],
+            inputs=[suitability, imp_frac, twi],
+            rule_input_keys=None,
+        )
+        span.record(priority=priority)
+    writer.submit(fis_suitability.write_raster, in_area(fis_suitability.PRIORITY_PATH),
+                  priority, gt, proj)
+    # The UTM ASCII grids NetLogo loads, from the GeoTIFFs once they are on disk
+    for tif, asc in [(fis_suitability.SUIT_PATH, fis_suitability.SUIT_ASC_PATH),
+                     (fis_suitability.PRIORITY_PATH, fis_suitability.PRIORITY_ASC_PATH)]:
+        writer.submit(write_ascii_grid, in_area(asc), in_area(tif), after=in_area(tif))
+    print(f"  Priority: {summarize(priority, lo=0.0, hi=1.0).describe()}")
+
+    # ── Zonal statistics ────────────────────────────────────────────────────
+    print("\nZonal statistics per street segment...")
+    with stage("zonal_stats") as span:
+        layers = {"slope_deg": slope, "flow_accum": accum, "twi": twi, "impervious": imp_raw}
+        readers = {name: extract_attributes.RasterReader.from_array(array, gt, proj)
+                   for name, array in layers.items()}
+        inlet_points = extract_attributes.load_inlets(in_area(extract_attributes.INLETS_PATH))
+        hsg_grid = extract_attributes.load_hsg_grid(
+            in_area(extract_attributes.HSG_PATH), readers["slope_deg"])
+        ds = ogr.Open(in_area(extract_attributes.STREETS_PATH))
+        segments = extract_attributes.process_segments(ds.GetLayer(), readers, hsg_grid,
+                                                       inlet_points)
+        ds = None
+        span.note(segments=len(segments))
+    writer.submit(extract_attributes.write_segments, in_area(extract_attributes.OUTPUT_PATH),
+                  segments)
+    print(f"  {len(segments)} segments processed")
+
+    # ── Validation ──────────────────────────────────────────────────────────
+    with stage("validation"):
+        fis_suitability.validate_against_gsi(suitability, priority, gt)
+
+    return {"suitability": suitability, "priority": priority, "segments": segments}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run terrain, routing, FIS, zonal stats and validation in one process.")
+    parser.add_argument("--intermediates", action="store_true",
+                        help="Also write slope, flow direction, accumulation, TWI, HSG and "
+                             "impervious fraction rasters")
+    parser.add_argument("--sync-writes", action="store_true",
+                        help="Write outputs inline instead of in background threads")
+    parser.add_argument("--rain-in", type=float, default=calc_flow.DESIGN_STORM_IN,
+                        help=f"Design storm depth (inches) for the runoff band "
+                             f"(default: {calc_flow.DESIGN_STORM_IN})")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    print(f"Study area: {area}")
+
+    with run_report(os.path.join(data_dir, calc_flow.DERIVED_DIR), "run_pipeline", area=area):
+        writer = Writer(sync=args.sync_writes)
+        try:
+            results = run(data_dir, writer, args.intermediates, args.rain_in)
+        finally:
+            print("\nWaiting for writes...")
+            with stage("wait_writes"):
+                writer.wait()
+
+    extract_attributes.print_summary(results["segments"])
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
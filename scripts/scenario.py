@@ -0,0 +1,313 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Land-use scenarios by dirty-region recomputation: applies a sparse polygon
+# ABOUTME: edit and recomputes only the affected windows and flow paths. Writes diffs.
+
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from calc_flow import (
+    D8_OFFSETS, DESIGN_STORM_IN, IMPERVIOUS_RUNOFF_C, PERVIOUS_RUNOFF_C,
+)
+from fis_suitability import (
+    HSG_MAP, HSG_MF, IMP_MF, SLOPE_MF, STAGE1_RULES, STAGE2_RULES, SUIT_IN_MF, TWI_MF,
+    evaluate_fis,
+)
+from neighborhood import box_mean
+from query_service import build_cache
+from rasterize import rasterize_values
+from study_area import add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Impervious neighborhood window used by the FIS (see fis_suitability.main)
+IMP_WINDOW = 11
+SCENARIO_DIR = os.path.join("derived", "scenarios")
+
+# Edit layer attributes: new impervious fraction (0–1) and/or new soil group
+EDIT_FIELDS = {"impervious": "impervious", "hsg": "hsg"}
+NO_EDIT = -1
+
+
+class Window:
+    """Row/col bounds of a grid window, clamped to the grid."""
+
+    def __init__(self, r0, r1, c0, c1, shape):
+        self.r0, self.r1 = max(0, r0), min(shape[0], r1)
+        self.c0, self.c1 = max(0, c0), min(shape[1], c1)
+
+    def grow(self, n, shape):
+        return Window(self.r0 - n, self.r1 + n, self.c0 - n, self.c1 + n, shape)
+
+    @property
+    def slices(self):
+        return slice(self.r0, self.r1), slice(self.c0, self.c1)
+
+    @property
+    def shape(self):
+        return self.r1 - self.r0, self.c1 - self.c0
+
+    def within(self, outer):
+        """Slices selecting this window from an array covering `outer`."""
+        return (slice(self.r0 - outer.r0, self.r1 - outer.r0),
+                slice(self.c0 - outer.c0, self.c1 - outer.c0))
+
+    def geotransform(self, gt):
+        return (gt[0] + self.c0 * gt[1], gt[1], 0, gt[3] + self.r0 * gt[5], 0, gt[5])
+
+
+# ─── Edit ────────────────────────────────────────────────────────────────────
+
+def burn_edit(edit_path, gt, proj, shape):
+    """Rasterize an edit layer over its own envelope only.
+
+    An edit layer in another CRS than the grid is reprojected to it first.
+    Returns (window, {"impervious": array, "hsg": array}) with NO_EDIT where
+    the edit leaves a cell unchanged, or (None, {}) if it misses the grid.
+    """
+    ds = ogr.Open(edit_path)
+    edit_srs = ds.GetLayer().GetSpatialRef()
+    ds = None
+    grid_srs = osr.SpatialReference(wkt=proj)
+    if edit_srs is None or edit_srs.IsSame(grid_srs):
+        return burn_edit_window(edit_path, gt, proj, shape)
+    tmp_path = "/vsimem/scenario_edit.geojson"
+    gdal.VectorTranslate(tmp_path, edit_path, format="GeoJSON", dstSRS=proj, reproject=True)
+    try:
+        return burn_edit_window(tmp_path, gt, proj, shape)
+    finally:
+        gdal.Unlink(tmp_path)
+
+
+def burn_edit_window(edit_path, gt, proj, shape):
+    """burn_edit() for an edit layer already in the grid CRS."""
+    ds = ogr.Open(edit_path)
+    layer = ds.GetLayer()
+    xmin, xmax, ymin, ymax = layer.GetExtent()
+    defn = layer.GetLayerDefn()
+    fields = {defn.GetFieldDefn(i).GetName() for i in range(defn.GetFieldCount())}
+    ds = None
+
+    # Same cell assignment as query_service.top: floor, not truncation toward zero
+    window = Window(math.floor((ymax - gt[3]) / gt[5]), math.floor((ymin - gt[3]) / gt[5]) + 1,
+                    math.floor((xmin - gt[0]) / gt[1]), math.floor((xmax - gt[0]) / gt[1]) + 1,
+                    shape)
+    if window.r0 >= window.r1 or window.c0 >= window.c1:
+        return None, {}
+
+    expressions = {}
+    if EDIT_FIELDS["impervious"] in fields:
+        expressions["impervious"] = f"COALESCE({EDIT_FIELDS['impervious']}, {NO_EDIT})"
+    if EDIT_FIELDS["hsg"] in fields:
+        cases = " ".join(f"WHEN '{g}' THEN {v}" for g, v in HSG_MAP.items())
+        expressions["hsg"] = f"CASE {EDIT_FIELDS['hsg']} {cases} ELSE {NO_EDIT} END"
+    if not expressions:
+        raise ValueError(f"{edit_path} has neither an 'impervious' nor an 'hsg' attribute")
+
+    win_gt = window.geotransform(gt)
+    return window, {
+        name: rasterize_values(edit_path, win_gt, proj, window.shape, expr,
+                               default=NO_EDIT, cache=False)
+        for name, expr in expressions.items()
+    }
+
+
+def runoff_coefficient(imp, hsg):
+    """Rational-method C from impervious fraction and HSG code (as in calc_flow)."""
+    code_to_c = {code: PERVIOUS_RUNOFF_C[g] for g, code in HSG_MAP.items()}
+    pervious = np.vectorize(lambda code: code_to_c.get(int(code), PERVIOUS_RUNOFF_C["D"]))(hsg)
+    return imp * IMPERVIOUS_RUNOFF_C + (1 - imp) * pervious
+
+
+def sum_by(inverse, vals, n):
+    """Sum the rows of vals that share an index in inverse."""
+    out = np.zeros((n, vals.shape[1]))
+    np.add.at(out, inverse, vals)
+    return out
+
+
+def route_deltas(flow_dir, cells, deltas):
+    """Push per-cell weight changes, shape (n, bands), down their D8 paths.
+
+    Returns (cells, summed deltas) for every cell on the paths below the
+    edit. The rest of the accumulation grid is unchanged by construction.
+    """
+    rows, cols = flow_dir.shape
+    offsets = np.array(D8_OFFSETS)
+    flat_dir = flow_dir.reshape(-1)
+    out_cells, out_vals = [cells], [deltas]
+    cur, vals = cells, deltas
+    while cur.size:
+        d = flat_dir[cur].astype(np.int64)
+        flowing = d >= 0
+        cur, vals, d = cur[flowing], vals[flowing], d[flowing]
+        r, c = np.divmod(cur, cols)
+        r, c = r + offsets[d, 0], c + offsets[d, 1]
+        inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+        cur, vals = r[inside] * cols + c[inside], vals[inside]
+        # Merge paths that have joined so each step stays small
+        cur, inverse = np.unique(cur, return_inverse=True)
+        vals = sum_by(inverse, vals, cur.size)
+        out_cells.append(cur)
+        out_vals.append(vals)
+    cells, inverse = np.unique(np.concatenate(out_cells), return_inverse=True)
+    return cells, sum_by(inverse, np.concatenate(out_vals), cells.size)
+
+
+# ─── Scenario ────────────────────────────────────────────────────────────────
+
+def run_scenario(data_dir, edit_path, rain_in=DESIGN_STORM_IN):
+    """Evaluate one edit against the baseline layers. Returns diffs and a summary."""
+    meta = build_cache(data_dir)
+    layers = {name: np.load(path, mmap_mode="r") for name, path in meta["layers"].items()}
+    needed = ["impervious", "impervious_frac", "slope_deg", "hsg", "twi", "suitability", "priority"]
+    missing = [n for n in needed if n not in layers]
+    if missing:
+        raise FileNotFoundError(f"baseline layers missing: {missing}; run the pipeline first")
+    gt, proj, shape = meta["gt"], meta["proj"], tuple(meta["shape"])
+    cell_area = abs(gt[1] * gt[5])
+
+    edit_win, edits = burn_edit(edit_path, gt, proj, shape)
+    if edit_win is None:
+        return None
+    es = edit_win.slices
+    old_imp = np.asarray(layers["impervious"][es], dtype=np.float64)
+    old_hsg = np.asarray(layers["hsg"][es], dtype=np.float64)
+    new_imp = old_imp.copy()
+    new_hsg = old_hsg.copy()
+    if "impervious" in edits:
+        new_imp = np.where(edits["impervious"] != NO_EDIT, edits["impervious"], old_imp)
+    if "hsg" in edits:
+        new_hsg = np.where(edits["hsg"] != NO_EDIT, edits["hsg"], old_hsg)
+    imp_changed = new_imp != old_imp
+    hsg_changed = new_hsg != old_hsg
+    changed = imp_changed | hsg_changed
+    if not changed.any():
+        return None
+
+    # Dirty region: changed cells, dilated by the box-mean halo for imp_frac
+    rr, cc = np.nonzero(changed)
+    dirty = Window(edit_win.r0 + rr.min(), edit_win.r0 + rr.max() + 1,
+                   edit_win.c0 + cc.min(), edit_win.c0 + cc.max() + 1, shape)
+    half = IMP_WINDOW // 2
+    out_win = dirty.grow(half, shape)
+    # Box means at the window edge need another halo of input cells
+    ctx_win = out_win.grow(half, shape)
+
+    # Changed cells in grid coordinates; they all lie inside the dirty window
+    gr, gc = edit_win.r0 + rr, edit_win.c0 + cc
+    imp_ctx = np.array(layers["impervious"][ctx_win.slices], dtype=np.float64)
+    imp_ctx[gr - ctx_win.r0, gc - ctx_win.c0] = new_imp[changed]
+    imp_frac = box_mean(imp_ctx, IMP_WINDOW)[out_win.within(ctx_win)]
+
+    ws = out_win.slices
+    hsg = np.array(layers["hsg"][ws], dtype=np.float64)
+    hsg[gr - out_win.r0, gc - out_win.c0] = new_hsg[changed]
+    if hsg_changed.any():
+        suitability = evaluate_fis(STAGE1_RULES, [SLOPE_MF, HSG_MF],
+                                   [np.asarray(layers["slope_deg"][ws], dtype=np.float64), hsg],
+                                   None)
+    else:
+        suitability = np.asarray(layers["suitability"][ws], dtype=np.float64)
+    priority = evaluate_fis(STAGE2_RULES, [SUIT_IN_MF, IMP_MF, TWI_MF],
+                            [suitability, imp_frac,
+                             np.asarray(layers["twi"][ws], dtype=np.float64)],
+                            None)
+    diffs = {
+        "imp_frac_diff": (out_win, imp_frac - layers["impervious_frac"][ws]),
+        "suitability_diff": (out_win, suitability - layers["suitability"][ws]),
+        "priority_diff": (out_win, priority - layers["priority"][ws]),
+    }
+
+    # Downstream accumulation: route each changed cell's weight delta down its path
+    summary_flow = {}
+    if "flow_dir" in layers:
+        cells = (gr * shape[1] + gc).astype(np.int64)
+        d_imp = (new_imp - old_imp)[changed] * cell_area
+        d_runoff = ((runoff_coefficient(new_imp[changed], new_hsg[changed])
+                     - runoff_coefficient(old_imp[changed], old_hsg[changed]))
+                    * cell_area * rain_in / 12)
+        path_cells, path_deltas = route_deltas(
+            layers["flow_dir"], cells, np.stack([d_imp, d_runoff], axis=1))
+        pr, pc = np.divmod(path_cells, shape[1])
+        path_win = Window(pr.min(), pr.max() + 1, pc.min(), pc.max() + 1, shape)
+        for band, name in enumerate(["upstream_impervious_ft2_diff", "upstream_runoff_ft3_diff"]):
+            grid = np.zeros(path_win.shape)
+            grid[pr - path_win.r0, pc - path_win.c0] = path_deltas[:, band]
+            diffs[name] = (path_win, grid)
+        summary_flow = {
+            "downstream_cells": int(path_cells.size),
+            "max_upstream_impervious_change_ft2": round(float(np.abs(path_deltas[:, 0]).max()), 1),
+            "max_upstream_runoff_change_ft3": round(float(np.abs(path_deltas[:, 1]).max()), 1),
+        }
+
+    p = diffs["priority_diff"][1]
+    summary = {
+        "edited_cells": int(changed.sum()),
+        "recomputed_cells": int(np.prod(out_win.shape)),
+        "priority_mean_change": round(float(p.mean()), 5),
+        "priority_max_gain": round(float(p.max()), 4),
+        "priority_max_loss": round(float(p.min()), 4),
+        **summary_flow,
+    }
+    return diffs, summary
+
+
+def write_diff(path, array, window, gt, proj):
+    """Write a diff layer covering only its window."""
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(path, array.shape[1], array.shape[0], 1, gdal.GDT_Float32,
+                       options=["COMPRESS=LZW"])
+    ds.SetGeoTransform(window.geotransform(gt))
+    ds.SetProjection(proj)
+    band = ds.GetRasterBand(1)
+    band.WriteArray(np.asarray(array, dtype=np.float32))
+    band.FlushCache()
+    ds = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a land-use edit incrementally.")
+    parser.add_argument("edit", help="Polygon layer with 'impervious' (0–1) and/or 'hsg' (A–D)")
+    parser.add_argument("--scenario", help="Scenario name (default: edit file name)")
+    parser.add_argument("--rain-in", type=float, default=DESIGN_STORM_IN,
+                        help=f"Design storm depth for runoff changes (default: {DESIGN_STORM_IN})")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    name = args.scenario or os.path.splitext(os.path.basename(args.edit))[0]
+
+    start = time.perf_counter()
+    result = run_scenario(data_dir, args.edit, args.rain_in)
+    elapsed = time.perf_counter() - start
+    if result is None:
+        print("Edit changes no cells in the study area.")
+        return
+    diffs, summary = result
+    summary["seconds"] = round(elapsed, 3)
+
+    out_dir = os.path.join(data_dir, SCENARIO_DIR, name)
+    os.makedirs(out_dir, exist_ok=True)
+    meta = build_cache(data_dir)
+    for key, (window, array) in diffs.items():
+        write_diff(os.path.join(out_dir, f"{key}.tif"), array, window, meta["gt"], meta["proj"])
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Scenario {name} ({area}) evaluated in {elapsed:.3f}s")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+    print(f"  -> {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Street-segment drainage network: D8 routing of each segment's buffer cells gives
+# ABOUTME: fractional links to downstream segments and inlets; steady-state runoff per node.
+
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+from osgeo import gdal, ogr
+from scipy import sparse
+from scipy.sparse import linalg
+
+from calc_flow import downstream_index, weight_stack
+from catchments import jump, label_outlets, point_cells, receiver_array
+from extract_attributes import BUFFER_DIST, INLETS_PATH, OUTPUT_PATH as SEGMENTS_PATH
+from instrument import run_report, stage
+from rasterize import rasterize_ids
+from study_area import add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+FLOW_DIR_PATH = os.path.join("derived", "flow_direction.tif")
+NETWORK_PATH = os.path.join("derived", "segment_network.npz")
+FLOWS_PATH = os.path.join("derived", "segment_flows.geojson")
+INLET_LOADS_PATH = os.path.join("derived", "inlet_loads.csv")
+
+# Routed weight, first of these that weight_stack() provides
+WEIGHT_PREFERENCE = ["runoff_ft3", "impervious_ft2", "cells"]
+
+
+# ─── Network ─────────────────────────────────────────────────────────────────
+
+def segment_grid(segments_path, gt, proj, shape):
+    """Segment index + 1 of the street buffer covering each cell, 0 elsewhere.
+
+    Buffers overlap at intersections; there the first segment in the layer
+    wins, as in rasterize_ids().
+    """
+    src = ogr.Open(segments_path)
+    layer = src.GetLayer()
+    tmp_path = "/vsimem/segment_buffers.geojson"
+    dst = ogr.GetDriverByName("GeoJSON").CreateDataSource(tmp_path)
+    out = dst.CreateLayer("buffers", layer.GetSpatialRef(), ogr.wkbPolygon)
+    for feat in layer:
+        buffered = ogr.Feature(out.GetLayerDefn())
+        buffered.SetGeometry(feat.GetGeometryRef().Buffer(BUFFER_DIST))
+        out.CreateFeature(buffered)
+    dst = src = None
+    try:
+        return rasterize_ids(tmp_path, gt, proj, shape, cache=False).ravel()
+    finally:
+        gdal.Unlink(tmp_path)
+
+
+class SegmentNetwork:
+    """Segments, inlets and one outfall, linked by the share of runoff passed on.
+
+    Nodes are numbered segments first (0..S-1), then inlets (S..S+I-1), then
+    the outfall (S+I), which collects water reaching sinks and the grid edge.
+    Edges run from segments only; `fraction` of each segment's throughflow
+    goes along each of its edges, and fractions from a segment sum to 1.
+    """
+
+    def __init__(self, n_segments, inlet_cells, local, src, dst, fraction, weight="cells"):
+        self.n_segments = n_segments
+        self.weight = weight
+        self.inlet_cells = inlet_cells
+        self.local = local
+        self.src, self.dst, self.fraction = src, dst, fraction
+
+    @property
+    def n_nodes(self):
+        return self.n_segments + len(self.inlet_cells) + 1
+
+    @property
+    def outfall(self):
+        return self.n_nodes - 1
+
+    @classmethod
+    def build(cls, flow_dir, seg_label, inlet_cells, weight, weight_name="cells",
+              n_segments=None):
+        """Link segments from the D8 grid.
+
+        Every cell's weight is credited to the first buffer cell or inlet its
+        water reaches. Within a buffer, water follows D8 to the cell where it
+        leaves the buffer. It then goes to whichever other segment or inlet it
+        reaches next, or to the outfall; water that re-enters its own buffer
+        is followed on to its next exit, so no segment links to itself. A
+        segment's links are weighted by the water leaving through each exit.
+        n_segments defaults to the highest label.
+        """
+        n = seg_label.size
+        if n_segments is None:
+            n_segments = int(seg_label.max())
+        n_inlets = len(inlet_cells)
+        weight = np.asarray(weight, dtype=np.float64).ravel()
+        is_inlet = np.zeros(n, dtype=bool)
+        is_inlet[inlet_cells] = True
+        receiver = downstream_index(flow_dir)
+
+        # Node of every cell that can stop water: segment, inlet (wins) or outfall
+        node = np.full(n, n_segments + n_inlets, dtype=np.int64)
+        node[seg_label > 0] = seg_label[seg_label > 0] - 1
+        node[inlet_cells] = n_segments + np.arange(n_inlets)
+
+        # First buffer or inlet cell downstream of every cell, and what arrives there
+        is_terminal = (seg_label > 0) | is_inlet
+        first_hit = label_outlets(receiver_array(flow_dir, np.flatnonzero(is_terminal)))
+        inflow = np.bincount(first_hit, weights=weight, minlength=n)
+        local = np.bincount(node, weights=np.where(is_terminal, inflow, 0.0),
+                            minlength=n_segments + n_inlets + 1)
+        local[-1] = weight[~is_terminal[first_hit]].sum()
+
+        # Where water leaves each buffer cell's own segment
+        cells = np.flatnonzero((seg_label > 0) & ~is_inlet)
+        down = receiver[cells]
+        stays = down >= 0
+        stays[stays] = (seg_label[down[stays]] == seg_label[cells[stays]]) & ~is_inlet[down[stays]]
+        pointer = np.arange(n)
+        pointer[cells[stays]] = down[stays]
+        exit_cell = np.arange(n)
+        exit_cell[cells] = jump(pointer, cells)[cells]
+        hit = np.full(n, -1, dtype=np.int64)
+        after = receiver[exit_cell[cells]]
+        hit[cells[after >= 0]] = first_hit[after[after >= 0]]
+
+        # Re-entries into the own buffer chain on to the next exit (flow is acyclic)
+        back = hit[cells] >= 0
+        back[back] = ((seg_label[hit[cells[back]]] == seg_label[cells[back]])
+                      & ~is_inlet[hit[cells[back]]])
+        onward = np.arange(n)
+        onward[cells[back]] = hit[cells[back]]
+        last_hit = hit[jump(onward, cells)[cells]]
+        target = np.full(cells.size, n_segments + n_inlets, dtype=np.int64)
+        target[last_hit >= 0] = node[last_hit[last_hit >= 0]]
+
+        # Aggregate to links; segments with no weight split by cell count instead
+        src_seg = seg_label[cells] - 1
+        keys, inverse = np.unique(src_seg * (n_segments + n_inlets + 1) + target,
+                                  return_inverse=True)
+        link_weight = np.bincount(inverse, weights=inflow[cells])
+        link_cells = np.bincount(inverse).astype(np.float64)
+        src, dst = np.divmod(keys, n_segments + n_inlets + 1)
+        seg_weight = np.bincount(src, weights=link_weight, minlength=n_segments)
+        seg_cells = np.bincount(src, weights=link_cells, minlength=n_segments)
+        fraction = np.where(seg_weight[src] > 0,
+                            link_weight / np.where(seg_weight[src] > 0, seg_weight[src], 1),
+                            link_cells / seg_cells[src])
+        return cls(n_segments, np.asarray(inlet_cells), local, src, dst, fraction, weight_name)
+
+    def steady_state(self, capture=None):
+        """Throughflow of every node in steady state.
+
+        capture: {segment index: fraction of its throughflow retained} for
+        bioswales or other controls. Solves Q = local + Fᵀ Q over segments
+        (sparse, ~10³ unknowns); inlets and the outfall just sum what arrives.
+        Returns (throughflow per node, captured volume per segment).
+        """
+        s = self.n_segments
+        keep = np.ones(s)
+        for seg, frac in (capture or {}).items():
+            keep[seg] = 1 - frac
+        passed = self.fraction * keep[self.src]
+
+        to_seg = self.dst < s
+        transfer = sparse.csr_matrix((passed[to_seg], (self.dst[to_seg], self.src[to_seg])),
+                                     shape=(s, s))
+        through = np.array(self.local, dtype=np.float64)
+        if s:
+            through[:s] = linalg.spsolve((sparse.identity(s, format="csr") - transfer).tocsc(),
+                                         self.local[:s])
+        np.add.at(through, self.dst[~to_seg], passed[~to_seg] * through[self.src[~to_seg]])
+        return through, through[:s] * (1 - keep)
+
+    def main_outlet(self):
+        """Node taking the largest share of each segment's outflow."""
+        best = np.full(self.n_segments, self.outfall, dtype=np.int64)
+        order = np.lexsort((self.fraction, self.src))
+        last = np.r_[self.src[order][1:] != self.src[order][:-1], True]
+        best[self.src[order][last]] = self.dst[order][last]
+        return best
+
+    def save(self, path):
+        np.savez(path, n_segments=self.n_segments, inlet_cells=self.inlet_cells,
+                 local=self.local, src=self.src, dst=self.dst, fraction=self.fraction,
+                 weight=self.weight)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(int(data["n_segments"]), data["inlet_cells"], data["local"],
+                   data["src"], data["dst"], data["fraction"], str(data["weight"]))
+
+
+# ─── I/O ─────────────────────────────────────────────────────────────────────
+
+def node_name(network, node, objectids):
+    if node < network.n_segments:
+        return f"segment:{objectids[node]}"
+    if node < network.outfall:
+        return f"inlet:{node - network.n_segments + 1}"
+    return "outfall"
+
+
+def write_flows(path, segments, network, through, captured, unit):
+    """Segment layer with local inflow, throughflow and main outlet per segment."""
+    objectids = [f["properties"].get("objectid") for f in segments["features"]]
+    outlet = network.main_outlet()
+    features = []
+    for k, feat in enumerate(segments["features"]):
+        props = {
+            "objectid": objectids[k],
+            "full_name": feat["properties"].get("full_name"),
+            f"local_{unit}": round(float(network.local[k]), 1),
+            f"through_{unit}": round(float(through[k]), 1),
+            "drains_to": node_name(network, outlet[k], objectids),
+        }
+        if captured[k]:
+            props[f"captured_{unit}"] = round(float(captured[k]), 1)
+        features.append({"type": "Feature", "geometry": feat["geometry"], "properties": props})
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def write_inlet_loads(path, network, through, gt, shape, unit):
+    """One row per inlet: location and the water that reaches it."""
+    rows, cols = np.divmod(network.inlet_cells, shape[1])
+    loads = through[network.n_segments:network.outfall]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["inlet", "row", "col", "x", "y", f"load_{unit}"])
+        for k in range(len(loads)):
+            writer.writerow([k + 1, rows[k], cols[k],
+                             round(gt[0] + (cols[k] + 0.5) * gt[1], 1),
+                             round(gt[3] + (rows[k] + 0.5) * gt[5], 1),
+                             round(float(loads[k]), 1)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment-level runoff network.")
+    parser.add_argument("--capture", nargs="+", type=int, default=[], metavar="OBJECTID",
+                        help="Segments (by OBJECTID) with a bioswale capturing their throughflow")
+    parser.add_argument("--capture-fraction", type=float, default=1.0,
+                        help="Share of throughflow each capture retains (default: 1.0)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild the network even if a saved one is up to date")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    derived_dir = os.path.join(data_dir, "derived")
+
+    segments_path = os.path.join(data_dir, SEGMENTS_PATH)
+    flow_path = os.path.join(data_dir, FLOW_DIR_PATH)
+    network_path = os.path.join(data_dir, NETWORK_PATH)
+    with open(segments_path) as f:
+        segments = json.load(f)
+    objectids = [feat["properties"].get("objectid") for feat in segments["features"]]
+
+    ds = gdal.Open(flow_path)
+    gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+    shape = (ds.RasterYSize, ds.RasterXSize)
+
+    with run_report(derived_dir, "segment_network", area=area):
+        fresh = (os.path.exists(network_path)
+                 and os.path.getmtime(network_path) >= max(os.path.getmtime(flow_path),
+                                                           os.path.getmtime(segments_path)))
+        if fresh and not args.rebuild:
+            network = SegmentNetwork.load(network_path)
+            print(f"Segment network ({area}): reusing {network_path}")
+        else:
+            flow_dir = ds.GetRasterBand(1).ReadAsArray().astype(np.int8)
+            print(f"Segment network ({area}): {len(objectids)} segments, "
+                  f"{shape[1]}x{shape[0]} cells")
+            with stage("weight_stack") as span:
+                names, weights = weight_stack(data_dir, gt, proj, shape, gt[1])
+                unit = next(name for name in WEIGHT_PREFERENCE if name in names)
+                span.note(weight=unit)
+            with stage("segment_grid", cells=flow_dir.size) as span:
+                seg_label = segment_grid(segments_path, gt, proj, shape)
+                inlet_cells = point_cells(os.path.join(data_dir, INLETS_PATH), gt, shape)
+                span.record(seg_label=seg_label)
+            with stage("build_network", cells=flow_dir.size) as span:
+                network = SegmentNetwork.build(flow_dir, seg_label, inlet_cells,
+                                               weights[names.index(unit)], unit,
+                                               n_segments=len(objectids))
+                span.note(nodes=network.n_nodes, links=len(network.src))
+            network.save(network_path)
+            print(f"  {network.n_nodes:,} nodes ({network.n_segments} segments, "
+                  f"{len(network.inlet_cells)} inlets, outfall), {len(network.src):,} links")
+            print(f"  -> {network_path}")
+        ds = None
+
+        index = {oid: k for k, oid in enumerate(objectids)}
+        missing = [oid for oid in args.capture if oid not in index]
+        if missing:
+            print(f"  Unknown OBJECTIDs ignored: {missing}")
+        capture = {index[oid]: args.capture_fraction for oid in args.capture if oid in index}
+        with stage("steady_state") as span:
+            through, captured = network.steady_state(capture)
+            span.note(captures=len(capture))
+
+        unit = network.weight
+        to_inlets = through[network.n_segments:network.outfall].sum()
+        print(f"  Routed {unit}: {network.local.sum():,.0f} total, {to_inlets:,.0f} to inlets, "
+              f"{through[network.outfall]:,.0f} to sinks/edge, {captured.sum():,.0f} captured")
+        if capture:
+            base, _ = network.steady_state()
+            saved = base[network.n_segments:network.outfall].sum() - to_inlets
+            print(f"  {len(capture)} capture site(s) cut inlet load by {saved:,.0f} {unit}")
+
+        flows_path = os.path.join(data_dir, FLOWS_PATH)
+        loads_path = os.path.join(data_dir, INLET_LOADS_PATH)
+        write_flows(flows_path, segments, network, through, captured, unit)
+        write_inlet_loads(loads_path, network, through, gt, shape, unit)
+        print(f"  -> {flows_path}")
+        print(f"  -> {loads_path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Headless, vectorized version of the NetLogo rain/go water-agent model, with
+# ABOUTME: Monte Carlo runs whose escaped water is routed through the storm pipe network.
+
+import argparse
+import json
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from calc_flow import downstream_index
+from catchments import point_cells
+from constraints import CONSTRAINTS_PATH, DEFAULT_FORBID, RIGHT_OF_WAY, feasible, load_flags
+from fis_suitability import PRIORITY_PATH, SUIT_PATH
+from instrument import run_report, stage
+from particle_trace import CAPTURED, ESCAPED, TRACE_DIR, TraceWriter
+from storm_network import (
+    INLETS_PATH, PIPES_PATH, TICK_SECONDS, drain_nodes, load_network, load_pipes,
+)
+from study_area import add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+FLOW_DIR_PATH = os.path.join("derived", "flow_direction.tif")
+OUTPUT_DIR = os.path.join("derived", "simulation")
+
+# NetLogo model defaults (netlogo/test_dem.nlogox)
+BIOSWALE_CAPACITY = 10
+INFILTRATION_SCALE = 0.5  # infiltration-rate = suitability × 0.5 per tick
+RAIN_INTENSITY = 100
+NUM_BIOSWALES = 50
+# NetLogo spacing is in ~5 m patches: bioswale-spacing 10 and min-gap 3
+BIOSWALE_SPACING_FT = 164.0
+MIN_GAP_FT = 49.0
+# D8 code (E, SE, S, SW, W, NW, N, NE) → NetLogo heading in degrees
+D8_HEADINGS = np.array([90, 135, 180, 225, 270, 315, 0, 45])
+
+DEFAULT_TICKS = 500
+DEFAULT_RAIN_TICKS = 10
+DEFAULT_PARTICLE_FT3 = 1.0
+
+
+# ─── Placement ───────────────────────────────────────────────────────────────
+
+def place_bioswales(priority, flow_dir, n, spacing_cells, min_gap_cells, candidates=None,
+                    allowed=None):
+    """place-bioswales: greedy by priority with direction-aware spacing.
+
+    A candidate is skipped if it is within min_gap of a placed bioswale, or
+    within spacing of one that drains in a similar direction (headings less
+    than 90° apart, i.e. the same side of the street). candidates: flat cells
+    to consider, by default every cell with priority > 0. allowed: boolean
+    grid (e.g. constraints.feasible()); other cells are dropped before sorting.
+    Returns flat cells.
+    """
+    values = priority.ravel()
+    if candidates is None:
+        keep = values > 0
+        if allowed is not None:
+            keep &= allowed.ravel()
+        candidates = np.flatnonzero(keep)
+    elif allowed is not None:
+        candidates = candidates[allowed.ravel()[candidates]]
+    candidates = candidates[np.argsort(-values[candidates], kind="stable")]
+    heading = np.where(flow_dir.ravel() >= 0, D8_HEADINGS[flow_dir.ravel() % 8], -1)
+    cols = flow_dir.shape[1]
+
+    placed = []
+    rows_p, cols_p, head_p = [], [], []
+    for cell in candidates:
+        if len(placed) >= n:
+            break
+        r, c = divmod(int(cell), cols)
+        if placed:
+            d = np.hypot(np.array(rows_p) - r, np.array(cols_p) - c)
+            h = np.array(head_p)
+            diff = np.abs(h - heading[cell])
+            diff = np.minimum(diff, 360 - diff)
+            same_side = (h >= 0) & (heading[cell] >= 0) & (diff < 90)
+            if (d < min_gap_cells).any() or ((d < spacing_cells) & same_side).any():
+                continue
+        placed.append(int(cell))
+        rows_p.append(r)
+        cols_p.append(c)
+        head_p.append(heading[cell])
+    return np.array(placed, dtype=np.int64)
+
+
+# ─── Simulation ──────────────────────────────────────────────────────────────
+
+class Simulation:
+    """Water particles on the D8 grid, bioswales with capacity and infiltration.
+
+    step() follows the NetLogo `go` procedure: every particle moves to its
+    cell's receiver; particles on a bioswale with room are captured (one unit
+    each, until current volume reaches capacity); particles on a drain cell
+    escape; then every bioswale infiltrates. Drains are the D8 sinks, plus
+    any extra cells given (e.g. storm inlets). A recorder (TraceWriter) sees
+    every rain and tick.
+    """
+
+    def __init__(self, flow_dir, bioswale_cells, infiltration_rate,
+                 capacity=BIOSWALE_CAPACITY, drains=None, seed=0, recorder=None):
+        self.receiver = downstream_index(flow_dir)
+        n = self.receiver.size
+        self.is_drain = self.receiver < 0
+        if drains is not None:
+            self.is_drain[drains] = True
+        self.bioswale_of = np.full(n, -1, dtype=np.int64)
+        self.bioswale_cells = np.asarray(bioswale_cells, dtype=np.int64)
+        self.bioswale_of[self.bioswale_cells] = np.arange(len(self.bioswale_cells))
+        self.capacity = float(capacity)
+        self.infiltration_rate = np.asarray(infiltration_rate, dtype=np.float64)
+        self.volume = np.zeros(len(self.bioswale_cells))
+        self.captures = np.zeros(len(self.bioswale_cells), dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        self.position = np.empty(0, dtype=np.int64)
+        self.total_captured = 0
+        self.total_escaped = 0
+        self.total_infiltrated = 0.0
+        self.ticks = 0
+        self.recorder = recorder
+
+    def rain(self, n):
+        """Add one particle on each of n distinct random cells."""
+        cells = self.rng.choice(self.receiver.size, size=min(n, self.receiver.size),
+                                replace=False)
+        self.position = np.concatenate([self.position, cells])
+        if self.recorder is not None:
+            self.recorder.rain(cells)
+
+    def step(self):
+        """One tick; returns the cells where particles escaped this tick."""
+        pos = self.position
+        before = pos.copy() if self.recorder is not None else None
+        moves = ~self.is_drain[pos]
+        pos[moves] = self.receiver[pos[moves]]
+
+        # Capture: arrivals at each bioswale, in random order, while it has room
+        swale = self.bioswale_of[pos]
+        on = np.flatnonzero(swale >= 0)
+        captured = np.zeros(pos.size, dtype=bool)
+        if on.size:
+            on = on[np.lexsort((self.rng.random(on.size), swale[on]))]
+            group = swale[on]
+            first = np.r_[True, group[1:] != group[:-1]]
+            rank = np.arange(on.size) - np.flatnonzero(first)[np.cumsum(first) - 1]
+            room = np.ceil(self.capacity - self.volume[group])
+            take = on[rank < room]
+            captured[take] = True
+            n_take = np.bincount(swale[take], minlength=len(self.volume))
+            self.volume += n_take
+            self.captures += n_take
+            self.total_captured += int(take.size)
+
+        escaped = ~captured & self.is_drain[pos]
+        escaped_cells = pos[escaped]
+        self.total_escaped += int(escaped_cells.size)
+        self.position = pos[~captured & ~escaped]
+
+        drained = np.minimum(self.volume, self.infiltration_rate)
+        self.volume -= drained
+        self.total_infiltrated += float(drained.sum())
+        self.ticks += 1
+        if self.recorder is not None:
+            ended = np.flatnonzero(captured | escaped)
+            self.recorder.tick(before, pos, ended,
+                               np.where(captured[ended], CAPTURED, ESCAPED), self.volume)
+        return escaped_cells
+
+    @property
+    def capture_pct(self):
+        resolved = self.total_captured + self.total_escaped
+        return 100 * self.total_captured / resolved if resolved else 0.0
+
+
+def run(sim, ticks, rain_intensity, rain_ticks, drain_cells=None, drain_node=None,
+        n_nodes=0, particle_ft3=DEFAULT_PARTICLE_FT3):
+    """Rain for the first rain_ticks ticks, then run to `ticks`.
+
+    With drain_cells (sorted) and drain_node, also returns the escaped volume
+    entering each storm node per tick, (ticks, n_nodes).
+    """
+    inflow = np.zeros((ticks, n_nodes)) if drain_node is not None else None
+    for t in range(ticks):
+        if t < rain_ticks:
+            sim.rain(rain_intensity)
+        escaped = sim.step()
+        if inflow is not None and escaped.size:
+            nodes = drain_node[np.searchsorted(drain_cells, escaped)]
+            inflow[t] = np.bincount(nodes, minlength=n_nodes) * particle_ft3
+    return inflow
+
+
+# ─── I/O ─────────────────────────────────────────────────────────────────────
+
+def read_raster(path):
+    ds = gdal.Open(path)
+    array = ds.GetRasterBand(1).ReadAsArray()
+    gt = ds.GetGeoTransform()
+    ds = None
+    return array, gt
+
+
+def write_pipe_loads(path, geometries, network, stats):
+    """Pipe layer with per-pipe load statistics over the Monte Carlo runs."""
+    features = []
+    for k, pid in enumerate(network.pipe_id):
+        props = {"pipe": int(pid), "capacity_ft3": round(float(network.capacity[k]), 1)}
+        props.update({name: round(float(values[k]), 3) for name, values in stats.items()})
+        features.append({"type": "Feature", "geometry": json.loads(geometries[pid]),
+                         "properties": props})
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bioswale water-agent simulation.")
+    parser.add_argument("--runs", type=int, default=1, help="Monte Carlo runs (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first run")
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS,
+                        help=f"Ticks per run (default: {DEFAULT_TICKS})")
+    parser.add_argument("--rain-intensity", type=int, default=RAIN_INTENSITY,
+                        help=f"Particles per rain call (default: {RAIN_INTENSITY})")
+    parser.add_argument("--rain-ticks", type=int, default=DEFAULT_RAIN_TICKS,
+                        help=f"Rain on each of the first N ticks (default: {DEFAULT_RAIN_TICKS})")
+    parser.add_argument("--bioswales", type=int, default=NUM_BIOSWALES,
+                        help=f"Bioswales to place by priority (default: {NUM_BIOSWALES})")
+    parser.add_argument("--inlets-drain", action="store_true",
+                        help="Particles also escape at storm inlet cells, not just D8 sinks")
+    parser.add_argument("--pipes", action="store_true",
+                        help="Route escaped water through the storm pipe network")
+    parser.add_argument("--particle-ft3", type=float, default=DEFAULT_PARTICLE_FT3,
+                        help=f"Water volume per particle for pipe routing "
+                             f"(default: {DEFAULT_PARTICLE_FT3})")
+    parser.add_argument("--trace", action="store_true",
+                        help=f"Record each bioswale run to {TRACE_DIR}/seed_N for replay")
+    parser.add_argument("--constraints", action="store_true",
+                        help=f"Never place bioswales on buildings or excluded zones "
+                             f"({CONSTRAINTS_PATH})")
+    parser.add_argument("--row-only", action="store_true",
+                        help="With --constraints, place bioswales only in the street right-of-way")
+    parser.add_argument("--compare", action="store_true",
+                        help="With --pipes, also run without bioswales and report pipe relief")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    out_dir = os.path.join(data_dir, OUTPUT_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with run_report(out_dir, "simulate", area=area, runs=args.runs, seed=args.seed):
+        with stage("load_inputs"):
+            flow_dir, gt = read_raster(os.path.join(data_dir, FLOW_DIR_PATH))
+            flow_dir = flow_dir.astype(np.int8)
+            priority = read_raster(os.path.join(data_dir, PRIORITY_PATH))[0]
+            suitability = read_raster(os.path.join(data_dir, SUIT_PATH))[0].ravel()
+        inlets = None
+        if args.inlets_drain or args.pipes:
+            inlets = point_cells(os.path.join(data_dir, INLETS_PATH), gt, flow_dir.shape)
+
+        allowed = None
+        if args.constraints:
+            with stage("constraints") as span:
+                require = RIGHT_OF_WAY if args.row_only else 0
+                allowed = feasible(load_flags(data_dir), DEFAULT_FORBID, require)
+                span.note(feasible=int(allowed.sum()))
+            print(f"Constraints: {allowed.mean() * 100:.1f}% of cells feasible")
+
+        with stage("place_bioswales") as span:
+            cells = place_bioswales(priority, flow_dir, args.bioswales,
+                                    BIOSWALE_SPACING_FT / gt[1], MIN_GAP_FT / gt[1],
+                                    allowed=allowed)
+            span.note(bioswales=len(cells))
+        print(f"Simulation ({area}): {len(cells)} bioswales, {args.runs} run(s) of "
+              f"{args.ticks} ticks, {args.rain_intensity} particles × {args.rain_ticks} rains")
+
+        network = drain_cells = drain_node = None
+        if args.pipes:
+            with stage("storm_network") as span:
+                network = load_network(data_dir)
+                drain_cells, drain_node, _ = drain_nodes(
+                    network, flow_dir, gt, inlets if args.inlets_drain else ())
+                span.note(nodes=network.n_nodes, pipes=len(network.src))
+
+        drains = inlets if args.inlets_drain else None
+        scenarios = {"bioswales": cells}
+        if args.pipes and args.compare:
+            scenarios["baseline"] = cells[:0]
+        inflows = {name: [] for name in scenarios}
+        summary = {name: [] for name in scenarios}
+        for name, sites in scenarios.items():
+            with stage(f"simulate_{name}") as span:
+                for k in range(args.runs):
+                    recorder = None
+                    if args.trace and name == "bioswales":
+                        recorder = TraceWriter(
+                            os.path.join(data_dir, TRACE_DIR, f"seed_{args.seed + k}"),
+                            flow_dir.shape, sites, seed=args.seed + k)
+                    sim = Simulation(flow_dir, sites, suitability[sites] * INFILTRATION_SCALE,
+                                     drains=drains, seed=args.seed + k, recorder=recorder)
+                    inflow = run(sim, args.ticks, args.rain_intensity, args.rain_ticks,
+                                 drain_cells, drain_node,
+                                 network.n_nodes if network is not None else 0,
+                                 args.particle_ft3)
+                    if recorder is not None:
+                        recorder.close()
+                    inflows[name].append(inflow)
+                    summary[name].append({"seed": args.seed + k,
+                                          "captured": sim.total_captured,
+                                          "escaped": sim.total_escaped,
+                                          "in_flight": int(sim.position.size),
+                                          "capture_pct": round(sim.capture_pct, 2)})
+                span.note(runs=args.runs)
+            pct = [s["capture_pct"] for s in summary[name]]
+            print(f"  {name}: capture {np.mean(pct):.1f}% (range {min(pct):.1f} – {max(pct):.1f}%)")
+
+        summary_path = os.path.join(out_dir, "summary.json")
+        with open(summary_path, "w") as f:
+            json.dump({"ticks": args.ticks, "rain_intensity": args.rain_intensity,
+                       "rain_ticks": args.rain_ticks, "bioswale_cells": cells.tolist(),
+                       "runs": summary}, f, indent=2)
+        print(f"  -> {summary_path}")
+
+        if network is not None:
+            with stage("route_pipes") as span:
+                routed = {name: network.route(np.stack(inflows[name])) for name in scenarios}
+                span.note(pipes=len(network.src), runs=args.runs)
+            peak = routed["bioswales"]["peak_util"]
+            stats = {"peak_util": peak.mean(axis=0),
+                     "p_overloaded": (peak > 1).mean(axis=0),
+                     "overloaded_ticks": routed["bioswales"]["overloaded_ticks"].mean(axis=0)}
+            print(f"  Pipes over capacity: {int((stats['p_overloaded'] > 0).sum())} of "
+                  f"{len(network.src)} in at least one run ({TICK_SECONDS:g} s ticks)")
+            if "baseline" in routed:
+                base = routed["baseline"]["peak_util"]
+                stats["baseline_peak_util"] = base.mean(axis=0)
+                stats["relief"] = stats["baseline_peak_util"] - stats["peak_util"]
+                relieved = ((base > 1) & (peak <= 1)).any(axis=0)
+                print(f"  Bioswales bring {int(relieved.sum())} overloaded pipe(s) "
+                      f"back within capacity")
+            _, _, geometries = load_pipes(os.path.join(data_dir, PIPES_PATH))
+            pipes_path = os.path.join(out_dir, "pipe_loads.geojson")
+            write_pipe_loads(pipes_path, geometries, network, stats)
+            print(f"  -> {pipes_path}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["numpy", "gdal", "scipy"]
+# ///
+# ABOUTME: Storm sewer graph from the fetched nodes and pipes (CSR), with D8 sinks and inlets
+# ABOUTME: snapped to nodes, and vectorized per-tick routing of escaped water with capacity.
+
+import argparse
+import os
+
+import numpy as np
+from osgeo import gdal, ogr
+from scipy.spatial import cKDTree
+
+from calc_flow import downstream_index
+from catchments import point_cells
+from instrument import run_report, stage
+from study_area import add_area_arguments, area_from_args, area_data_dir
+from summary_stats import summarize
+
+gdal.UseExceptions()
+
+# Paths relative to the area data directory
+NODES_PATH = os.path.join("sewer", "storm_nodes.geojson")
+PIPES_PATH = os.path.join("sewer", "storm_pipes.geojson")
+INLETS_PATH = os.path.join("sewer", "inlets.geojson")
+FLOW_DIR_PATH = os.path.join("derived", "flow_direction.tif")
+NETWORK_PATH = os.path.join("derived", "storm_network.npz")
+
+# Pipe ends within this distance of a storm node are joined to it
+SNAP_TOLERANCE_FT = 10.0
+# Pipe diameter attribute (inches), first one present; else DEFAULT_DIAMETER_IN
+DIAMETER_FIELDS = ["PIPESIZE", "PIPE_SIZE", "DIAMETER", "DIAM"]
+DEFAULT_DIAMETER_IN = 12.0
+# Full-flow Manning capacity; no inverts are fetched, so one nominal slope
+MANNING_N = 0.013
+NOMINAL_SLOPE = 0.01
+# Seconds per simulation tick (one D8 step of a water particle)
+TICK_SECONDS = 10.0
+
+
+def full_flow_cfs(diameter_in, slope=NOMINAL_SLOPE, n=MANNING_N):
+    """Manning full-pipe capacity (ft³/s) of circular pipes."""
+    d = np.asarray(diameter_in, dtype=np.float64) / 12
+    area = np.pi * d * d / 4
+    return 1.486 / n * area * (d / 4) ** (2 / 3) * np.sqrt(slope)
+
+
+# ─── Network ─────────────────────────────────────────────────────────────────
+
+def load_nodes(path):
+    """Storm node coordinates, (n, 2)."""
+    ds = ogr.Open(path)
+    xy = []
+    for feat in ds.GetLayer():
+        geom = feat.GetGeometryRef()
+        if geom is not None:
+            point = geom.Centroid()
+            xy.append((point.GetX(), point.GetY()))
+    ds = None
+    return np.array(xy, dtype=np.float64).reshape(-1, 2)
+
+
+def load_pipes(path):
+    """Pipe end points (upstream, downstream as digitized), diameters in inches and
+    GeoJSON geometries."""
+    ds = ogr.Open(path)
+    layer = ds.GetLayer()
+    defn = layer.GetLayerDefn()
+    names = [defn.GetFieldDefn(i).GetName().upper() for i in range(defn.GetFieldCount())]
+    field = next((defn.GetFieldDefn(names.index(f)).GetName()
+                  for f in DIAMETER_FIELDS if f in names), None)
+    ends, diameters, geometries = [], [], []
+    for feat in layer:
+        geom = feat.GetGeometryRef()
+        if geom is None:
+            continue
+        parts = [geom.GetGeometryRef(i) for i in range(geom.GetGeometryCount())] \
+            if geom.GetGeometryCount() else [geom]
+        first, last = parts[0].GetPoint(0), parts[-1].GetPoint(parts[-1].GetPointCount() - 1)
+        ends.append((first[0], first[1], last[0], last[1]))
+        size = feat.GetField(field) if field else None
+        diameters.append(float(size) if size else DEFAULT_DIAMETER_IN)
+        geometries.append(geom.ExportToJson())
+    ds = None
+    return np.array(ends, dtype=np.float64).reshape(-1, 4), np.array(diameters), geometries
+
+
+class StormNetwork:
+    """Directed pipe graph in CSR form.
+
+    Pipes leaving node v are pipe_order[indptr[v]:indptr[v + 1]]; pipe p runs
+    src[p] → dst[p] and carries at most capacity[p] ft³ per tick. Nodes with
+    incoming but no outgoing pipes are outfalls; nodes with no pipe at all are
+    ignored by snap(). pipe_id maps pipes back to the pipe layer.
+    """
+
+    def __init__(self, xy, src, dst, capacity, pipe_id=None):
+        self.xy = xy
+        self.src, self.dst, self.capacity = src, dst, capacity
+        self.pipe_id = np.arange(len(src)) if pipe_id is None else pipe_id
+        self.pipe_order = np.argsort(src, kind="stable")
+        self.indptr = np.searchsorted(src[self.pipe_order], np.arange(len(xy) + 1))
+        indegree = np.bincount(dst, minlength=len(xy))
+        self.outfall = (np.diff(self.indptr) == 0) & (indegree > 0)
+        self.connected = (np.diff(self.indptr) > 0) | (indegree > 0)
+        # Each node's outflow splits over its pipes in proportion to capacity
+        node_cap = np.bincount(src, weights=capacity, minlength=len(xy))
+        self.share = capacity / node_cap[src] if len(src) else capacity
+        self._tree = None
+
+    @property
+    def n_nodes(self):
+        return len(self.xy)
+
+    @classmethod
+    def build(cls, node_xy, pipe_ends, diameters, tick_seconds=TICK_SECONDS,
+              tolerance=SNAP_TOLERANCE_FT):
+        """Join pipe ends to storm nodes; ends with no node nearby become new nodes."""
+        ends = pipe_ends.reshape(-1, 2)
+        nearest = np.full(len(ends), -1, dtype=np.int64)
+        if len(node_xy):
+            dist, idx = cKDTree(node_xy).query(ends, distance_upper_bound=tolerance)
+            nearest[np.isfinite(dist)] = idx[np.isfinite(dist)]
+        # Unmatched ends: merge those within tolerance of each other
+        loose = np.flatnonzero(nearest < 0)
+        xy = node_xy
+        if loose.size:
+            key = np.round(ends[loose] / tolerance).astype(np.int64)
+            _, first, inverse = np.unique(key, axis=0, return_index=True, return_inverse=True)
+            nearest[loose] = len(node_xy) + inverse.ravel()
+            xy = np.vstack([node_xy, ends[loose][first]])
+        src, dst = nearest[0::2], nearest[1::2]
+        keep = src != dst
+        capacity = full_flow_cfs(diameters[keep]) * tick_seconds
+        return cls(xy, src[keep], dst[keep], capacity, np.flatnonzero(keep))
+
+    def snap(self, points):
+        """Nearest piped node of each (x, y) point, and the distance to it."""
+        nodes = np.flatnonzero(self.connected)
+        if self._tree is None:
+            self._tree = cKDTree(self.xy[nodes])
+        dist, idx = self._tree.query(points)
+        return nodes[idx], dist
+
+    def route(self, inflow):
+        """Route per-tick inflows through the pipes.
+
+        inflow: (ticks, nodes) or (runs, ticks, nodes) ft³ entering each node
+        per tick (e.g. escaped water). Each tick a node sends its stored water
+        down its pipes, split by capacity and capped at each pipe's capacity;
+        the rest stays (surcharges) at the node. Water takes one tick per pipe
+        and leaves at outfalls. All runs are routed together, one array
+        operation per tick. Routing continues after the last inflow until the
+        network drains or as many ticks again have passed.
+
+        Returns dict of (runs, …) arrays: peak_util and overloaded_ticks per
+        pipe, peak_storage per node, outfall volume per tick, and the volume
+        still stored at the end.
+        """
+        inflow = np.asarray(inflow, dtype=np.float64)
+        single = inflow.ndim == 2
+        if single:
+            inflow = inflow[None]
+        runs, ticks, n = inflow.shape
+        pipes = len(self.src)
+        offsets = (np.arange(runs) * n)[:, None]
+        src_idx = (offsets + self.src).ravel()
+        dst_idx = (offsets + self.dst).ravel()
+
+        storage = np.zeros((runs, n))
+        in_pipe = np.zeros((runs, pipes))
+        peak_util = np.zeros((runs, pipes))
+        overloaded = np.zeros((runs, pipes), dtype=np.int64)
+        peak_storage = np.zeros((runs, n))
+        outfall = []
+        t = 0
+        while t < ticks or (t < 2 * ticks and (storage.any() or in_pipe.any())):
+            if t < ticks:
+                storage += inflow[:, t]
+            # Pipe arrivals from the previous tick
+            storage += np.bincount(dst_idx, weights=in_pipe.ravel(),
+                                   minlength=runs * n).reshape(runs, n)
+            outfall.append((storage * self.outfall).sum(axis=1))
+            storage[:, self.outfall] = 0
+
+            demand = storage[:, self.src] * self.share
+            in_pipe = np.minimum(demand, self.capacity)
+            storage -= np.bincount(src_idx, weights=in_pipe.ravel(),
+                                   minlength=runs * n).reshape(runs, n)
+            util = demand / self.capacity
+            np.maximum(peak_util, util, out=peak_util)
+            overloaded += util > 1
+            np.maximum(peak_storage, storage, out=peak_storage)
+            t += 1
+
+        out = {
+            "peak_util": peak_util,
+            "overloaded_ticks": overloaded,
+            "peak_storage": peak_storage,
+            "outfall": np.array(outfall).T,
+            "remaining": storage.sum(axis=1) + in_pipe.sum(axis=1),
+        }
+        if single:
+            out = {k: v[0] for k, v in out.items()}
+        return out
+
+    def save(self, path):
+        np.savez(path, xy=self.xy, src=self.src, dst=self.dst, capacity=self.capacity,
+                 pipe_id=self.pipe_id)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["xy"], data["src"], data["dst"], data["capacity"], data["pipe_id"])
+
+
+def drain_nodes(network, flow_dir, gt, inlet_cells=()):
+    """Storm node of every drain cell: D8 sinks plus any inlet cells.
+
+    Returns (cells, nodes, distances ft), cells sorted.
+    """
+    cells = np.union1d(np.flatnonzero(downstream_index(flow_dir) < 0), inlet_cells)
+    rows, cols = np.divmod(cells, flow_dir.shape[1])
+    xy = np.column_stack([gt[0] + (cols + 0.5) * gt[1], gt[3] + (rows + 0.5) * gt[5]])
+    nodes, dist = network.snap(xy)
+    return cells, nodes, dist
+
+
+def load_network(data_dir, tick_seconds=TICK_SECONDS):
+    """Network of an area from the fetched layers, cached in NETWORK_PATH."""
+    path = os.path.join(data_dir, NETWORK_PATH)
+    sources = [os.path.join(data_dir, p) for p in (NODES_PATH, PIPES_PATH)]
+    missing = [rel for rel, p in zip((NODES_PATH, PIPES_PATH), sources) if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"storm network layers not fetched: {', '.join(missing)}; "
+                                f"run refetch_layers.py first")
+    if (os.path.exists(path) and tick_seconds == TICK_SECONDS
+            and os.path.getmtime(path) >= max(os.path.getmtime(p) for p in sources)):
+        return StormNetwork.load(path)
+    ends, diameters, _ = load_pipes(sources[1])
+    network = StormNetwork.build(load_nodes(sources[0]), ends, diameters, tick_seconds)
+    if tick_seconds == TICK_SECONDS:
+        network.save(path)
+    return network
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the storm pipe network. Water is routed through it by "
+                    "simulate.py --pipes, which supplies the per-tick inflows.")
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    area, _ = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+
+    with run_report(os.path.join(data_dir, "derived"), "storm_network", area=area):
+        with stage("build_network") as span:
+            network = load_network(data_dir)
+            span.note(nodes=network.n_nodes, pipes=len(network.src))
+        print(f"Storm network ({area}): {network.n_nodes} nodes, {len(network.src)} pipes, "
+              f"{int(network.outfall.sum())} outfalls")
+
+        ds = gdal.Open(os.path.join(data_dir, FLOW_DIR_PATH))
+        flow_dir = ds.GetRasterBand(1).ReadAsArray().astype(np.int8)
+        gt = ds.GetGeoTransform()
+        ds = None
+        with stage("snap_drains") as span:
+            inlets = point_cells(os.path.join(data_dir, INLETS_PATH), gt, flow_dir.shape)
+            cells, nodes, dist = drain_nodes(network, flow_dir, gt, inlets)
+            span.note(drains=len(cells))
+        print(f"  {len(cells):,} sink/inlet cells snapped to {len(np.unique(nodes))} nodes; "
+              f"snap distance {summarize(dist).describe('.0f')} ft")
+        print(f"  Pipe capacity: {network.capacity.min():.0f} – {network.capacity.max():.0f} "
+              f"ft³ per {TICK_SECONDS:g} s tick")
+        print(f"  -> {os.path.join(data_dir, NETWORK_PATH)}")
+
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
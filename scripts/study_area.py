@@ -0,0 +1,152 @@
+# ABOUTME: Study area extents as run parameters: named areas, EPSG:2913 bboxes, or
+# ABOUTME: polygon layers. Maps each area to its own data directory under data/.
+
+import math
+import os
+import re
+
+TARGET_CRS = "EPSG:2913"
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+AREAS_DIR = os.path.join(DATA_DIR, "areas")
+
+# Named study area extents in EPSG:2913 (Oregon North State Plane, ft).
+# This is the single source of truth for every area boundary.
+NAMED_AREAS = {
+    # Hawthorne to Division, SE 20th to Cesar Chavez (SE 39th)
+    "hawthorne_division": {
+        "xmin": 7650146,
+        "ymin": 675893,
+        "xmax": 7658210,
+        "ymax": 680660,
+    },
+}
+DEFAULT_AREA = "hawthorne_division"
+
+# Padding (degrees) added to the WGS84 query bbox so the ArcGIS spatial query
+# returns all features that touch the area. The clean EPSG:2913 clip happens
+# after reprojection.
+QUERY_PAD_DEG = 0.002
+
+
+def add_area_arguments(parser):
+    """Add --area / --bbox / --name options to an argparse parser."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--area", choices=sorted(NAMED_AREAS), default=DEFAULT_AREA,
+        help=f"Named study area (default: {DEFAULT_AREA})",
+    )
+    group.add_argument(
+        "--bbox", nargs=4, type=float, metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+        help="Study area extent in EPSG:2913 feet",
+    )
+    parser.add_argument("--name", help="Name (and output directory) for a --bbox area")
+
+
+def area_from_args(args, parser=None):
+    """Return (name, extent) for the options added by add_area_arguments().
+
+    Invalid combinations are reported through parser.error() when a parser is
+    given, else raised as ValueError.
+    """
+    def fail(message):
+        if parser is not None:
+            parser.error(message)
+        raise ValueError(message)
+
+    if args.bbox is None:
+        if args.name is not None:
+            fail("--name only applies to a --bbox area")
+        return args.area, NAMED_AREAS[args.area]
+    xmin, ymin, xmax, ymax = args.bbox
+    if xmin >= xmax or ymin >= ymax:
+        fail(f"Empty bbox: {args.bbox}")
+    extent = {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax}
+    name = args.name or f"bbox_{xmin:.0f}_{ymin:.0f}_{xmax:.0f}_{ymax:.0f}"
+    return slugify(name), extent
+
+
+def area_arguments(name, extent):
+    """Command-line options that select this area in any pipeline script."""
+    if NAMED_AREAS.get(name) == extent:
+        return ["--area", name]
+    return ["--bbox", *[str(extent[k]) for k in ("xmin", "ymin", "xmax", "ymax")],
+            "--name", name]
+
+
+def area_data_dir(name):
+    """Data directory for an area. The default area keeps the top-level layout."""
+    if name == DEFAULT_AREA:
+        return DATA_DIR
+    return os.path.join(AREAS_DIR, name)
+
+
+def slugify(name):
+    """Filesystem-safe lowercase area name."""
+    return re.sub(r"[^a-z0-9]+", "_", str(name).lower()).strip("_") or "area"
+
+
+def query_bbox_wgs84(extent):
+    """Oversized WGS84 bbox covering an EPSG:2913 extent, for ArcGIS queries."""
+    from osgeo import osr
+
+    src = osr.SpatialReference()
+    src.ImportFromEPSG(2913)
+    dst = osr.SpatialReference()
+    dst.ImportFromEPSG(4326)
+    dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src, dst)
+    # TransformBounds densifies the edges, so the curved outline is covered
+    xmin, ymin, xmax, ymax = transform.TransformBounds(
+        extent["xmin"], extent["ymin"], extent["xmax"], extent["ymax"], 21,
+    )
+    return {
+        "xmin": round(xmin - QUERY_PAD_DEG, 6),
+        "ymin": round(ymin - QUERY_PAD_DEG, 6),
+        "xmax": round(xmax + QUERY_PAD_DEG, 6),
+        "ymax": round(ymax + QUERY_PAD_DEG, 6),
+    }
+
+
+def areas_from_layer(path, name_field):
+    """Read (name, extent) pairs from the polygons of a vector layer.
+
+    Each feature's bounding envelope in EPSG:2913 becomes one study area,
+    named by `name_field` (neighbourhood, sewershed, ...). Areas are
+    rectangles: cells inside the envelope but outside the polygon are
+    processed and counted too.
+    """
+    from osgeo import ogr, osr
+
+    ds = ogr.Open(path)
+    if ds is None:
+        raise FileNotFoundError(f"Cannot open {path}")
+    layer = ds.GetLayer()
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(2913)
+    target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    source = layer.GetSpatialRef()
+    transform = None
+    if source is not None and not source.IsSame(target):
+        source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(source, target)
+
+    areas = []
+    seen = set()
+    for feat in layer:
+        geom = feat.GetGeometryRef().Clone()
+        if transform is not None:
+            geom.Transform(transform)
+        env = geom.GetEnvelope()  # (minX, maxX, minY, maxY)
+        name = slugify(feat.GetField(name_field))
+        if name in seen:
+            name = f"{name}_{feat.GetFID()}"
+        seen.add(name)
+        areas.append((name, {
+            "xmin": math.floor(env[0]),
+            "ymin": math.floor(env[2]),
+            "xmax": math.ceil(env[1]),
+            "ymax": math.ceil(env[3]),
+        }))
+    ds = None
+    return areas
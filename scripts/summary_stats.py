@@ -0,0 +1,120 @@
+# ABOUTME: Streaming summary statistics for diagnostics: min/max/mean/std and histogram
+# ABOUTME: quantiles in one bounded-memory pass over tiles, mergeable across tiles.
+
+import numpy as np
+
+HIST_BINS = 4096  # quantiles resolve to (max - min) / HIST_BINS or better
+TILE_ROWS = 1024
+
+
+class Summary:
+    """Running min/max/mean/std and an equal-width histogram for quantiles.
+
+    Give lo/hi when the value range is known (e.g. 0–1 FIS outputs). Otherwise
+    the histogram starts on the first values seen and doubles its range,
+    merging bins pairwise, whenever later values fall outside it.
+    NaN and infinite values are ignored.
+    """
+
+    def __init__(self, lo=None, hi=None, bins=HIST_BINS):
+        self.bins = bins
+        self.lo, self.hi = lo, hi
+        self.hist = np.zeros(bins, dtype=np.int64)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Add an array (any shape) of values."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        n = values.size
+        if n == 0:
+            return self
+        vmin, vmax = float(values.min()), float(values.max())
+        mean = float(values.mean())
+        m2 = float(np.square(values - mean).sum())
+        self._combine(n, mean, m2, vmin, vmax)
+        self._fit_range(vmin, vmax)
+        idx = ((values - self.lo) * (self.bins / (self.hi - self.lo))).astype(np.int64)
+        self.hist += np.bincount(np.clip(idx, 0, self.bins - 1), minlength=self.bins)
+        return self
+
+    def merge(self, other):
+        """Fold in another Summary (e.g. from another tile or worker)."""
+        if other.count == 0:
+            return self
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        self._fit_range(other.lo, other.hi)
+        # Re-bin other's counts at their bin centers
+        width = (other.hi - other.lo) / other.bins
+        centers = other.lo + (np.arange(other.bins) + 0.5) * width
+        idx = ((centers - self.lo) * (self.bins / (self.hi - self.lo))).astype(np.int64)
+        self.hist += np.bincount(np.clip(idx, 0, self.bins - 1), weights=other.hist,
+                                 minlength=self.bins).astype(np.int64)
+        return self
+
+    def _combine(self, n, mean, m2, vmin, vmax):
+        """Chan et al. parallel update of count, mean and M2."""
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    def _fit_range(self, vmin, vmax):
+        """Make the histogram range cover [vmin, vmax]."""
+        if self.lo is None:
+            self.lo, self.hi = vmin, vmax if vmax > vmin else vmin + 1.0
+            return
+        while vmin < self.lo or vmax > self.hi:
+            half = self.bins // 2
+            merged = self.hist.reshape(half, 2).sum(axis=1)
+            span = self.hi - self.lo
+            if vmin < self.lo:
+                self.hist = np.concatenate([np.zeros(half, dtype=np.int64), merged])
+                self.lo -= span
+            else:
+                self.hist = np.concatenate([merged, np.zeros(half, dtype=np.int64)])
+                self.hi += span
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.count)) if self.count else np.nan
+
+    def quantile(self, q):
+        """Approximate q-quantile (0–1), linear within the histogram bin."""
+        if self.count == 0:
+            return np.nan
+        target = q * self.count
+        cum = np.cumsum(self.hist)
+        b = int(np.searchsorted(cum, target, side="left"))
+        b = min(b, self.bins - 1)
+        before = cum[b - 1] if b > 0 else 0
+        frac = (target - before) / self.hist[b] if self.hist[b] else 0.0
+        width = (self.hi - self.lo) / self.bins
+        return float(np.clip(self.lo + (b + frac) * width, self.min, self.max))
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    def describe(self, fmt=".3f"):
+        """One-line min/max/mean/median/std for printing."""
+        return (f"min={self.min:{fmt}}  max={self.max:{fmt}}  mean={self.mean:{fmt}}  "
+                f"median={self.median:{fmt}}  std={self.std:{fmt}}")
+
+
+def summarize(array, lo=None, hi=None, bins=HIST_BINS, tile_rows=TILE_ROWS):
+    """Summary of an array, fed one tile of rows at a time."""
+    array = np.asarray(array)
+    summary = Summary(lo, hi, bins)
+    if array.ndim < 2:
+        return summary.update(array)
+    for r0 in range(0, array.shape[0], tile_rows):
+        summary.update(array[r0:r0 + tile_rows])
+    return summary
@@ -0,0 +1,110 @@
+# ABOUTME: Terrain derivatives from one 3×3 pass per tile: Horn slope, aspect, plan and
+# ABOUTME: profile curvature, hillshade, written into preallocated float32 buffers.
+
+import numpy as np
+
+# Rows per tile; temporaries are tile-sized, outputs are written in place
+TILE_ROWS = 256
+
+PRODUCTS = ["slope_deg", "tan_slope", "aspect", "plan_curv", "profile_curv", "hillshade"]
+
+# Gradients below this are treated as flat (no aspect, zero curvature)
+FLAT_GRADIENT = 1e-6
+
+# Hillshade light source (degrees clockwise from north, above horizon)
+SUN_AZIMUTH = 315.0
+SUN_ALTITUDE = 45.0
+
+
+def allocate(shape, products=PRODUCTS):
+    """Preallocated float32 output buffers, one per product."""
+    return {name: np.empty(shape, dtype=np.float32) for name in products}
+
+
+def padded_window(elev, r0, r1):
+    """Rows r0..r1 of elev with a one-cell halo on every side.
+
+    Halo cells beyond the grid are extrapolated linearly from the edge, so
+    border cells keep their slope instead of flattening toward it.
+    """
+    rows, cols = elev.shape
+    win = np.empty((r1 - r0 + 2, cols + 2), dtype=np.float64)
+    lo, hi = max(r0 - 1, 0), min(r1 + 1, rows)
+    top = 1 if r0 == 0 else 0
+    win[top:top + hi - lo, 1:-1] = elev[lo:hi]
+    if r0 == 0:
+        win[0, 1:-1] = 2 * elev[0] - elev[1]
+    if r1 == rows:
+        win[-1, 1:-1] = 2 * elev[-1] - elev[-2]
+    win[:, 0] = 2 * win[:, 1] - win[:, 2]
+    win[:, -1] = 2 * win[:, -2] - win[:, -3]
+    return win
+
+
+def stencil(win, pixel_size, out):
+    """All requested derivatives of one padded window, written into out views.
+
+    Neighbours are named row by row:  a b c / d e f / g h i  (north up).
+    x is east, y is north. Curvature signs: plan < 0 where flow converges
+    (gutters, swales); profile < 0 where the slope flattens downhill.
+    """
+    a, b, c = win[:-2, :-2], win[:-2, 1:-1], win[:-2, 2:]
+    d, e, f = win[1:-1, :-2], win[1:-1, 1:-1], win[1:-1, 2:]
+    g, h, i = win[2:, :-2], win[2:, 1:-1], win[2:, 2:]
+
+    # Horn (1981) first derivatives
+    p = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * pixel_size)
+    q = ((a + 2 * b + c) - (g + 2 * h + i)) / (8 * pixel_size)
+    grad2 = p * p + q * q
+    tan_slope = np.sqrt(grad2)
+
+    if "tan_slope" in out:
+        out["tan_slope"][...] = tan_slope
+    if "slope_deg" in out:
+        np.degrees(np.arctan(tan_slope), out=out["slope_deg"], casting="unsafe")
+    flat = tan_slope < FLAT_GRADIENT
+    if "aspect" in out:
+        # Compass direction the slope faces (downhill), -1 for flat cells
+        aspect = np.degrees(np.arctan2(-p, -q)) % 360
+        aspect[flat] = -1
+        out["aspect"][...] = aspect
+    if "hillshade" in out:
+        zenith = np.radians(90 - SUN_ALTITUDE)
+        azimuth = np.radians(SUN_AZIMUTH)
+        lx, ly = np.sin(zenith) * np.sin(azimuth), np.sin(zenith) * np.cos(azimuth)
+        shade = (np.cos(zenith) - p * lx - q * ly) / np.sqrt(1 + grad2)
+        np.multiply(np.maximum(shade, 0), 255, out=out["hillshade"], casting="unsafe")
+
+    if "plan_curv" in out or "profile_curv" in out:
+        # Zevenbergen & Thorne (1987) second derivatives
+        res2 = pixel_size * pixel_size
+        zxx = (d + f - 2 * e) / res2
+        zyy = (b + h - 2 * e) / res2
+        zxy = (c + g - a - i) / (4 * res2)
+        safe = np.where(flat, 1.0, grad2)
+        if "plan_curv" in out:
+            plan = -(zxx * q * q - 2 * zxy * p * q + zyy * p * p) / safe ** 1.5
+            plan[flat] = 0
+            out["plan_curv"][...] = plan
+        if "profile_curv" in out:
+            profile = -(zxx * p * p + 2 * zxy * p * q + zyy * q * q) / (safe * (1 + grad2) ** 1.5)
+            profile[flat] = 0
+            out["profile_curv"][...] = profile
+
+
+def terrain(elev, pixel_size, products=PRODUCTS, out=None, tile_rows=TILE_ROWS):
+    """Terrain derivatives of a DEM in one 3×3 pass per tile of rows.
+
+    products: names from PRODUCTS. out: optional preallocated buffers (see
+    allocate()); missing ones are created. Returns {name: float32 array}.
+    """
+    out = dict(out or {})
+    for name in products:
+        if name not in out:
+            out[name] = np.empty(elev.shape, dtype=np.float32)
+    rows = elev.shape[0]
+    for r0 in range(0, rows, tile_rows):
+        r1 = min(r0 + tile_rows, rows)
+        views = {name: out[name][r0:r1] for name in products}
+        stencil(padded_window(elev, r0, r1), pixel_size, views)
+    return {name: out[name] for name in products}
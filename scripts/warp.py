@@ -0,0 +1,199 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["gdal"]
+# ///
+# ABOUTME: In-process warp stage: VRT mosaic of source rasters (zips read via /vsizip/),
+# ABOUTME: multithreaded gdal.Warp straight to a tiled GeoTIFF on the study grid, with stats.
+
+import argparse
+import fnmatch
+import glob
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from osgeo import gdal
+
+from instrument import run_report, stage
+from study_area import TARGET_CRS, DATA_DIR, add_area_arguments, area_from_args, area_data_dir
+
+gdal.UseExceptions()
+
+PIXEL_SIZE = 3  # feet
+# Warp buffer per layer; GDAL splits the output into chunks that fit
+WARP_MEMORY_MB = 512
+
+# Shared sources (used by every study area)
+SOURCE_DEM_DIR = os.path.join(DATA_DIR, "dem")
+IMPERV_DIR = os.path.join(DATA_DIR, "impervious")
+ZIP_FILE = os.path.join(IMPERV_DIR, "or_2021_ccap_v2_hires_impervious_20231024.zip")
+ZIP_URL = ("https://coastalimagery.blob.core.windows.net/ccap-landcover/"
+           "CCAP_bulk_download/High_Resolution_Land_Cover/Phase_1_Initial_Layers/"
+           "Impervious/or_2021_ccap_v2_hires_impervious_20231024.zip")
+
+# Outputs relative to the area data directory
+OUTPUT_DEM = os.path.join("dem", "study_area_dem.tif")
+OUTPUT_IMPERVIOUS = os.path.join("impervious", "impervious.tif")
+
+
+# ─── Sources ─────────────────────────────────────────────────────────────────
+
+def dem_sources():
+    """USGS 3DEP 1 m source tiles."""
+    return sorted(glob.glob(os.path.join(SOURCE_DEM_DIR, "USGS_1M_*.tif")))
+
+
+def impervious_sources():
+    """C-CAP impervious raster: an extracted copy if present, else read inside the zip."""
+    tifs = glob.glob(os.path.join(IMPERV_DIR, "or_*impervious*.tif"))
+    if tifs:
+        return tifs[:1]
+    if not os.path.exists(ZIP_FILE):
+        print(f"Zip file not found: {ZIP_FILE}")
+        print(f"Download from: {ZIP_URL}")
+        return []
+    return zip_members(ZIP_FILE, "*.tif")
+
+
+def zip_members(zip_path, pattern):
+    """/vsizip/ paths of the members of a zip matching pattern (nothing is extracted)."""
+    with zipfile.ZipFile(zip_path) as zf:
+        names = [n for n in zf.namelist() if fnmatch.fnmatch(os.path.basename(n), pattern)]
+    return [f"/vsizip/{os.path.abspath(zip_path)}/{n}" for n in sorted(names)]
+
+
+# (sources, output path, resampling); nearest keeps the binary impervious classes
+LAYERS = {
+    "dem": (dem_sources, OUTPUT_DEM, "bilinear"),
+    "impervious": (impervious_sources, OUTPUT_IMPERVIOUS, "near"),
+}
+
+
+# ─── Warp ────────────────────────────────────────────────────────────────────
+
+def warp_layer(name, sources, out_path, ext, resample, memory_mb=WARP_MEMORY_MB,
+               threads="ALL_CPUS"):
+    """Mosaic sources as a VRT and warp it onto the study grid as a tiled GeoTIFF.
+
+    The warper writes the output chunk by chunk, so memory stays within
+    memory_mb plus GDAL's block cache. Statistics are then computed from the
+    written file and stored with it. Returns a stats dict.
+    """
+    start = time.perf_counter()
+    # gdal.Warp would warp into an existing file rather than replace it
+    for path in (out_path, out_path + ".aux.xml"):
+        if os.path.exists(path):
+            os.remove(path)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    vrt_path = f"/vsimem/{name}_mosaic.vrt"
+    gdal.BuildVRT(vrt_path, sources)
+    warped = gdal.Warp(
+        out_path, vrt_path,
+        options=gdal.WarpOptions(
+            format="GTiff",
+            creationOptions=["COMPRESS=LZW", "TILED=YES", f"NUM_THREADS={threads}"],
+            dstSRS=TARGET_CRS,
+            outputBounds=(ext["xmin"], ext["ymin"], ext["xmax"], ext["ymax"]),
+            xRes=PIXEL_SIZE, yRes=PIXEL_SIZE,
+            resampleAlg=resample,
+            multithread=True,
+            warpMemoryLimit=memory_mb,
+            warpOptions=[f"NUM_THREADS={threads}"],
+        ),
+    )
+    gdal.Unlink(vrt_path)
+
+    band = warped.GetRasterBand(1)
+    smin, smax, smean, sstd = band.ComputeStatistics(False)
+    band.SetStatistics(smin, smax, smean, sstd)
+    stats = {
+        "layer": name,
+        "sources": len(sources),
+        "size": [warped.RasterXSize, warped.RasterYSize],
+        "type": gdal.GetDataTypeName(band.DataType),
+        "min": smin, "max": smax, "mean": smean, "std": sstd,
+        "wall_s": round(time.perf_counter() - start, 3),
+    }
+    warped = None
+    return stats
+
+
+def thread_share(threads, n_layers):
+    """Threads for each of n_layers concurrent warps out of a total budget."""
+    total = (os.cpu_count() or 1) if threads == "ALL_CPUS" else int(threads)
+    return max(total // max(n_layers, 1), 1)
+
+
+def warp_layers(names, data_dir, ext, memory_mb=WARP_MEMORY_MB, threads="ALL_CPUS"):
+    """Warp several layers concurrently onto the identical target grid.
+
+    GDAL releases the GIL while warping, so threads overlap I/O and compute.
+    The thread budget is split evenly across the layers. Layers without
+    sources are skipped. Returns {name: stats}.
+    """
+    jobs = {}
+    for name in names:
+        find_sources, rel_path, resample = LAYERS[name]
+        sources = find_sources()
+        if not sources:
+            print(f"  {name}: no sources found, skipping")
+            continue
+        print(f"  {name}: {len(sources)} source(s)")
+        for s in sources:
+            print(f"    {os.path.basename(s)}")
+        jobs[name] = (sources, os.path.join(data_dir, rel_path), resample)
+
+    per_layer = thread_share(threads, len(jobs))
+    with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as pool:
+        futures = {
+            name: pool.submit(warp_layer, name, sources, out_path, ext, resample,
+                              memory_mb, per_layer)
+            for name, (sources, out_path, resample) in jobs.items()
+        }
+        return {name: f.result() for name, f in futures.items()}
+
+
+def print_stats(stats, out_path):
+    print(f"  {stats['layer']}: {stats['size'][0]}x{stats['size'][1]} {stats['type']}  "
+          f"min={stats['min']:.3f} max={stats['max']:.3f} "
+          f"mean={stats['mean']:.3f} std={stats['std']:.3f}  ({stats['wall_s']}s)")
+    print(f"  -> {out_path}")
+
+
+def add_warp_arguments(parser):
+    parser.add_argument("--warp-memory-mb", type=int, default=WARP_MEMORY_MB,
+                        help=f"Warp buffer per layer in MB (default: {WARP_MEMORY_MB})")
+    parser.add_argument("--threads", default="ALL_CPUS",
+                        help="Warp/compression threads, split across the layers "
+                             "(default: ALL_CPUS)")
+
+
+def run(names, script, args, parser=None):
+    """Shared entry point for warp.py, clip_dem.py and clip_impervious.py."""
+    area, ext = area_from_args(args, parser)
+    data_dir = area_data_dir(area)
+    print(f"Warping {', '.join(names)} ({area}) to {TARGET_CRS}, {PIXEL_SIZE}ft pixels")
+
+    with run_report(data_dir, script, area=area):
+        with stage("warp") as span:
+            results = warp_layers(names, data_dir, ext, args.warp_memory_mb, args.threads)
+            span.note(layers=results, warp_memory_mb=args.warp_memory_mb, threads=args.threads)
+        for name, stats in results.items():
+            print_stats(stats, os.path.join(data_dir, LAYERS[name][1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warp DEM and impervious sources onto the study grid.")
+    parser.add_argument("--layers", nargs="+", choices=sorted(LAYERS), default=sorted(LAYERS),
+                        help="Layers to warp (default: all)")
+    add_warp_arguments(parser)
+    add_area_arguments(parser)
+    args = parser.parse_args()
+    run(args.layers, "warp", args, parser)
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+# ABOUTME: Pytest setup: puts scripts/ on the import path so tests import the
+# ABOUTME: pipeline modules the same way the scripts import each other.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
@@ -0,0 +1,55 @@
+# ABOUTME: Tests for fis_suitability: the pyramid-screened top-k ranking must equal
+# ABOUTME: the ranking of the full-resolution priority grid, with and without a mask.
+
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter
+
+import fis_suitability as fis
+
+
+def synthetic_inputs(seed, rows=120, cols=170):
+    """Smooth random slope / HSG / impervious / TWI grids with plenty of ties."""
+    rng = np.random.default_rng(seed)
+    slope = np.abs(gaussian_filter(rng.normal(size=(rows, cols)), 3)) * 15
+    hsg = np.where(gaussian_filter(rng.normal(size=(rows, cols)), 8) > 0, 3.0, 1.0)
+    imp_frac = fis.box_mean((rng.random((rows, cols)) < 0.6).astype(float), 11)
+    twi = 2 + np.abs(gaussian_filter(rng.normal(size=(rows, cols)), 2)) * 20
+    return slope, hsg, imp_frac, twi
+
+
+def full_priority(slope, hsg, imp_frac, twi):
+    suit = fis.evaluate_fis(fis.STAGE1_RULES, [fis.SLOPE_MF, fis.HSG_MF], [slope, hsg], None)
+    pri = fis.evaluate_fis(fis.STAGE2_RULES, [fis.SUIT_IN_MF, fis.IMP_MF, fis.TWI_MF],
+                           [suit, imp_frac, twi], None)
+    return pri, suit
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("k", [1, 25, 500])
+def test_screened_ranking_matches_full_ranking(seed, k):
+    inputs = synthetic_inputs(seed)
+    pri, suit = full_priority(*inputs)
+
+    cells, priority, suitability = fis.screen_top_candidates(*inputs, k)
+
+    expected = fis.top_candidates(pri, k)
+    np.testing.assert_array_equal(cells, expected)
+    np.testing.assert_array_equal(priority, pri.ravel()[expected])
+    np.testing.assert_array_equal(suitability, suit.ravel()[expected])
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("k", [1, 25, 500])
+def test_screened_ranking_matches_full_ranking_with_allowed_mask(seed, k):
+    inputs = synthetic_inputs(seed)
+    pri, _ = full_priority(*inputs)
+    rng = np.random.default_rng(seed + 100)
+    allowed = gaussian_filter(rng.normal(size=pri.shape), 4) > 0
+
+    cells, priority, _ = fis.screen_top_candidates(*inputs, k, allowed=allowed)
+
+    expected = fis.top_candidates(pri, k, allowed=allowed)
+    np.testing.assert_array_equal(cells, expected)
+    np.testing.assert_array_equal(priority, pri.ravel()[expected])
+    assert allowed.ravel()[cells].all()
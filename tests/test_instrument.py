@@ -0,0 +1,51 @@
+# ABOUTME: Tests for instrument: span records in the run report, and the stack
+# ABOUTME: sampler running safely while stages are pushed and popped.
+
+import json
+import time
+
+import numpy as np
+
+import instrument
+from instrument import run_report, stage
+
+
+def read_report(out_dir):
+    with open(out_dir / instrument.REPORT_NAME) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_spans_are_reported_with_nested_paths(tmp_path):
+    with run_report(tmp_path, "test"):
+        with stage("outer") as span:
+            span.record(grid=np.zeros((4, 5)))
+            with stage("inner"):
+                pass
+
+    spans = [r for r in read_report(tmp_path) if r["type"] == "span"]
+    assert [s["stage"] for s in spans] == ["test/outer/inner", "test/outer", "test"]
+    assert spans[1]["cells"] == 20
+    assert spans[1]["arrays"]["grid"]["shape"] == [4, 5]
+
+
+def test_sampler_survives_stage_boundaries(tmp_path, monkeypatch):
+    monkeypatch.setenv(instrument.PROFILE_ENV, "0.01")
+    errors = []
+    original_run = instrument.Sampler.run
+
+    def checked_run(self):
+        try:
+            original_run(self)
+        except Exception as exc:
+            errors.append(exc)
+
+    monkeypatch.setattr(instrument.Sampler, "run", checked_run)
+
+    with run_report(tmp_path, "test"):
+        deadline = time.perf_counter() + 0.5
+        while time.perf_counter() < deadline:
+            with stage("short"):
+                pass
+
+    assert errors == []
+    assert not instrument._stack
@@ -0,0 +1,74 @@
+# ABOUTME: Tests for particle_trace: a recorded simulation replays to the same
+# ABOUTME: captures, volumes and positions, and stale or unclosed traces are rejected.
+
+import os
+
+import numpy as np
+import pytest
+
+import calc_flow
+from particle_trace import TraceReader, TraceWriter
+from simulate import Simulation, place_bioswales
+
+SHAPE = (40, 50)
+
+
+@pytest.fixture(scope="module")
+def model():
+    rng = np.random.default_rng(3)
+    elev = (rng.random(SHAPE) * 0.3
+            + np.add.outer(np.arange(SHAPE[0]) * 0.05, np.sin(np.arange(SHAPE[1]) / 6) * 2))
+    flow_dir = calc_flow.calc_d8_flow_direction(elev, 3.0)
+    bioswales = place_bioswales(rng.random(SHAPE), flow_dir, 8, 5, 2)
+    rates = rng.random(len(bioswales)) * 0.5
+    return flow_dir, bioswales, rates
+
+
+def simulate(model, trace_dir, ticks, seed, chunk_ticks=16):
+    flow_dir, bioswales, rates = model
+    writer = TraceWriter(trace_dir, SHAPE, bioswales, chunk_ticks=chunk_ticks)
+    sim = Simulation(flow_dir, bioswales, rates, seed=seed, recorder=writer)
+    for t in range(ticks):
+        if t < 10:
+            sim.rain(500)
+        sim.step()
+    return sim, writer
+
+
+def test_trace_replays_the_simulation(model, tmp_path):
+    sim, writer = simulate(model, tmp_path, ticks=70, seed=1)
+    writer.close()
+
+    reader = TraceReader(tmp_path)
+    _, captures, volume = reader.aggregate()
+
+    assert captures.shape[0] == 70
+    assert captures.sum() == sim.total_captured
+    np.testing.assert_array_equal(captures.sum(axis=0), sim.captures)
+    np.testing.assert_allclose(volume[-1], sim.volume, rtol=1e-6)
+    for moved, ended, _, _ in reader.ticks():
+        keep = np.ones(moved.size, dtype=bool)
+        keep[ended] = False
+        last = moved[keep]
+    np.testing.assert_array_equal(last, sim.position)
+
+
+def test_shorter_trace_replaces_stale_chunks(model, tmp_path):
+    simulate(model, tmp_path, ticks=70, seed=1)[1].close()
+    sim, writer = simulate(model, tmp_path, ticks=20, seed=2)
+
+    with pytest.raises(ValueError, match="not closed"):
+        TraceReader(tmp_path)
+    writer.close()
+
+    _, captures, _ = TraceReader(tmp_path).aggregate()
+    assert captures.shape[0] == 20
+    assert captures.sum() == sim.total_captured
+
+
+def test_stray_chunk_is_rejected(model, tmp_path):
+    simulate(model, tmp_path, ticks=20, seed=2)[1].close()
+    open(os.path.join(tmp_path, "chunk_00007.npz"), "w").close()
+
+    with pytest.raises(ValueError, match="chunk"):
+        TraceReader(tmp_path)
@@ -0,0 +1,92 @@
+# ABOUTME: Tests for query_service: bbox top-k against a brute-force sort, k validation,
+# ABOUTME: and dropping cached layers whose source raster has been removed.
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import query_service
+from query_service import QueryService, build_priority_index, dispatch
+
+
+@pytest.fixture
+def service():
+    """A service over an in-memory priority grid (no data directory needed)."""
+    priority = np.round(np.random.default_rng(0).random((300, 257)), 3)
+    svc = QueryService.__new__(QueryService)
+    svc.gt = [1000.0, 3.0, 0.0, 5000.0, 0.0, -3.0]
+    svc.shape = priority.shape
+    svc.layers = {"priority": priority}
+    svc.order, svc.block_start, svc.block_max = build_priority_index(
+        priority, query_service.INDEX_BLOCK)
+    svc.block_cols = -(-priority.shape[1] // query_service.INDEX_BLOCK)
+    return svc
+
+
+def test_top_matches_sorted_bbox(service):
+    rng = np.random.default_rng(1)
+    priority = service.layers["priority"]
+    for _ in range(30):
+        c0, c1 = sorted(rng.integers(0, 257, 2))
+        r0, r1 = sorted(rng.integers(0, 300, 2))
+        k = int(rng.integers(1, 40))
+        result = service.top(1000 + c0 * 3 + 0.1, 5000 - r1 * 3 - 0.1,
+                             1000 + c1 * 3 + 0.1, 5000 - r0 * 3 - 0.1, k)
+        got = [c["priority"] for c in result["candidates"]]
+        expected = np.sort(priority[r0:r1 + 1, c0:c1 + 1].ravel())[::-1][:k]
+        np.testing.assert_allclose(got, expected)
+
+
+@pytest.mark.parametrize("k", [0, -3])
+def test_top_rejects_k_below_one(service, k):
+    params = {"xmin": 1000, "ymin": 4000, "xmax": 1300, "ymax": 5000, "k": k}
+    with pytest.raises(ValueError, match="k must be at least 1"):
+        dispatch(service, "top", params)
+
+
+class FakeDataset:
+    """Stands in for gdal.Open: one 2×2 band per source, or `bands` bands."""
+
+    def __init__(self, bands):
+        self.RasterCount, self.RasterYSize, self.RasterXSize = bands, 2, 2
+
+    def GetGeoTransform(self):
+        return (0.0, 1.0, 0.0, 0.0, 0.0, -1.0)
+
+    def GetProjection(self):
+        return ""
+
+    def GetRasterBand(self, b):
+        band = type("Band", (), {})()
+        band.GetDescription = lambda: f"b{b}"
+        band.ReadAsArray = lambda: np.full((2, 2), b)
+        return band
+
+
+def test_build_cache_drops_layers_of_removed_sources(tmp_path, monkeypatch):
+    derived = tmp_path / "derived"
+    derived.mkdir()
+    for name in ("priority.tif", "slope.tif", "upstream.tif"):
+        (derived / name).touch()
+    bands = {"upstream.tif": 2}
+    monkeypatch.setattr(query_service, "LAYERS", {"priority": "derived/priority.tif",
+                                                  "slope": "derived/slope.tif"})
+    monkeypatch.setattr(query_service, "BAND_LAYERS", {"upstream": "derived/upstream.tif"})
+    monkeypatch.setattr(query_service.gdal, "Open",
+                        lambda path: FakeDataset(bands.get(os.path.basename(path), 1)))
+
+    meta = query_service.build_cache(str(tmp_path))
+    assert sorted(meta["layers"]) == ["priority", "slope", "upstream_b1", "upstream_b2"]
+
+    (derived / "slope.tif").unlink()
+    bands["upstream.tif"] = 1
+    os.utime(derived / "upstream.tif", (1, 1))
+    meta = query_service.build_cache(str(tmp_path))
+
+    assert sorted(meta["layers"]) == ["priority", "upstream_b1"]
+    cache_dir = derived / "query_cache"
+    assert sorted(os.listdir(cache_dir)) == ["meta.json", "priority.npy", "upstream_b1.npy"]
+    with open(cache_dir / "meta.json") as f:
+        assert json.load(f)["layers"] == meta["layers"]
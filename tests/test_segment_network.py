@@ -0,0 +1,58 @@
+# ABOUTME: Tests for segment_network: water re-entering its own segment's buffer is
+# ABOUTME: followed to the next exit (no self links) and steady state conserves mass.
+
+import numpy as np
+import pytest
+
+import calc_flow
+from segment_network import SegmentNetwork
+
+NO_INLETS = np.array([], dtype=np.int64)
+
+
+def test_reentry_into_own_buffer_links_to_next_segment():
+    # One row flowing east: segment 1 | gap | segment 1 again | gap | segment 2 | edge
+    flow_dir = np.zeros((1, 7), dtype=np.int8)
+    seg_label = np.array([1, 1, 0, 1, 0, 2, 0])
+
+    net = SegmentNetwork.build(flow_dir, seg_label, NO_INLETS, np.ones(7))
+
+    assert list(zip(net.src, net.dst)) == [(0, 1), (1, net.outfall)]
+    np.testing.assert_allclose(net.fraction, [1.0, 1.0])
+    np.testing.assert_allclose(net.local, [4, 2, 1])
+
+    through, captured = net.steady_state()
+    np.testing.assert_allclose(through, [4, 6, 7])
+    np.testing.assert_allclose(captured, [0, 0])
+
+    through, captured = net.steady_state({0: 0.5})
+    np.testing.assert_allclose(through, [4, 4, 5])
+    np.testing.assert_allclose(captured, [2, 0])
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_buffers_have_no_self_links_and_conserve_mass(seed):
+    rng = np.random.default_rng(seed)
+    rows, cols = 60, 70
+    elev = (rng.random((rows, cols)) * 2
+            + np.add.outer(np.arange(rows) * 0.1, np.sin(np.arange(cols) / 5) * 2))
+    flow_dir = calc_flow.calc_d8_flow_direction(elev, 3.0)
+    seg_label = np.zeros((rows, cols), dtype=np.int32)
+    for k in range(10):
+        r, c = rng.integers(0, 55), rng.integers(0, 60)
+        if rng.random() < 0.5:
+            seg_label[r:r + 3, c:c + 12] = k + 1
+        else:
+            seg_label[r:r + 12, c:c + 3] = k + 1
+    seg_label = seg_label.ravel()
+    inlets = rng.choice(np.flatnonzero(seg_label > 0), 5, replace=False)
+    weight = rng.random(rows * cols)
+
+    net = SegmentNetwork.build(flow_dir, seg_label, inlets, weight, n_segments=10)
+
+    assert not (net.src == net.dst).any()
+    sources = np.unique(net.src)
+    np.testing.assert_allclose(np.bincount(net.src, net.fraction)[sources], 1)
+    through, captured = net.steady_state({3: 0.5})
+    assert captured[3] == pytest.approx(0.5 * through[3])
+    assert through[net.n_segments:].sum() + captured.sum() == pytest.approx(weight.sum())
@@ -0,0 +1,43 @@
+# ABOUTME: Tests for storm_network: outfalls need an incoming pipe, drains snap to
+# ABOUTME: piped nodes only, routing conserves water, and missing layers are named.
+
+import numpy as np
+import pytest
+
+import storm_network
+from storm_network import StormNetwork
+
+
+@pytest.fixture
+def network():
+    # 0 → 1 → 2 along a line, plus node 3 with no pipes
+    xy = np.array([[0.0, 0.0], [10.0, 0.0], [20.0, 0.0], [500.0, 500.0]])
+    return StormNetwork(xy, np.array([0, 1]), np.array([1, 2]), np.array([5.0, 5.0]))
+
+
+def test_isolated_node_is_not_an_outfall(network):
+    assert network.outfall.tolist() == [False, False, True, False]
+
+
+def test_snap_skips_nodes_without_pipes(network):
+    nodes, dist = network.snap(np.array([[490.0, 490.0], [1.0, 0.0]]))
+
+    assert nodes.tolist() == [2, 0]
+    assert dist[1] == pytest.approx(1.0)
+
+
+def test_route_delivers_all_water_to_the_outfall(network):
+    inflow = np.zeros((4, 4))
+    inflow[0, 0] = 3.0
+    inflow[1, 0] = 9.0
+
+    out = network.route(inflow)
+
+    assert out["outfall"].sum() + out["remaining"] == pytest.approx(12.0)
+    assert out["peak_util"][0] == pytest.approx(9.0 / 5.0)
+    assert out["overloaded_ticks"][0] >= 1
+
+
+def test_load_network_names_missing_layers(tmp_path):
+    with pytest.raises(FileNotFoundError, match="storm_nodes.geojson, .*storm_pipes.geojson"):
+        storm_network.load_network(str(tmp_path))
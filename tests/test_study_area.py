@@ -0,0 +1,47 @@
+# ABOUTME: Tests for study_area: --area / --bbox / --name parsing, including the
+# ABOUTME: errors for --name without --bbox and for an empty bbox.
+
+import argparse
+
+import pytest
+
+import study_area
+
+
+@pytest.fixture
+def parser():
+    parser = argparse.ArgumentParser()
+    study_area.add_area_arguments(parser)
+    return parser
+
+
+def test_default_area(parser):
+    args = parser.parse_args([])
+
+    assert study_area.area_from_args(args, parser) == (
+        study_area.DEFAULT_AREA, study_area.NAMED_AREAS[study_area.DEFAULT_AREA])
+
+
+def test_named_bbox(parser):
+    args = parser.parse_args(["--bbox", "0", "0", "10", "20", "--name", "Mt Tabor"])
+
+    name, extent = study_area.area_from_args(args, parser)
+
+    assert name == "mt_tabor"
+    assert extent == {"xmin": 0, "ymin": 0, "xmax": 10, "ymax": 20}
+
+
+@pytest.mark.parametrize("argv", [["--name", "tabor"], ["--bbox", "5", "0", "1", "1"]])
+def test_invalid_area_options_are_parser_errors(parser, argv, capsys):
+    args = parser.parse_args(argv)
+
+    with pytest.raises(SystemExit):
+        study_area.area_from_args(args, parser)
+    assert "error" in capsys.readouterr().err
+
+
+def test_name_without_bbox_raises_without_parser(parser):
+    args = parser.parse_args(["--name", "tabor"])
+
+    with pytest.raises(ValueError, match="--name"):
+        study_area.area_from_args(args)